@@ -0,0 +1,138 @@
+"""Simulation of the AppendEntries round trips a leader needs to find where the
+log of a follower matches its own, either by decrementing the next index by one
+per failed consistency check (the original behaviour, one attempt per heartbeat)
+or by following the conflict hints of the responses (one attempt per network
+round trip, as the leader retries at once).
+
+Following the hints takes at most one round trip per term of the divergent tail
+of the follower (one for a follower that is only behind), plus the one that
+succeeds: the run fails, exiting with a non-zero status, if any scenario takes
+more.
+
+Run from the source directory with `python -m bench.catch_up`."""
+
+from sys import exit
+from typing import List, Tuple, Union
+
+from db import DatabaseDriver, Entry, Log
+from roles import LeaderRole, SharedState
+from rpc import AppendEntriesRPCResponse
+from state import TIMEOUT_LOWER_BOUND, TIMEOUT_UPPER_BOUND, Server
+from utils import Address
+
+# average interval between heartbeats of a leader
+HEARTBEAT_INTERVAL: float = (TIMEOUT_LOWER_BOUND + TIMEOUT_UPPER_BOUND) / 2 / 3
+# assumed network round trip within a data center
+ROUND_TRIP: float = 0.001
+
+LEADER: Address = Address(port=5000)
+FOLLOWER: Address = Address(port=5001)
+
+
+def _log(terms: List[Tuple[int, int]]) -> Log:
+  """Build a log from runs of (term, number of entries) after the first entry."""
+  entries = [Entry(index=0, term=0, key="", value="")]
+
+  for term, count in terms:
+    for _ in range(count):
+      entries.append(Entry(index=len(entries), term=term, key="k", value="v"))
+
+  return Log(entries)
+
+
+def _respond(
+  follower: Log, previous_log_index: int, previous_log_term: int
+) -> Tuple[bool, int, Union[int, None]]:
+  """Run the consistency check of the follower, as its request handler does."""
+  if previous_log_index >= len(follower):
+    return False, len(follower), None
+
+  term = follower[previous_log_index].term
+
+  if term != previous_log_term:
+    return False, follower.term_start(term), term
+  else:
+    return True, 0, None
+
+
+def _round_trips(leader: Log, follower: Log, hints: bool) -> int:
+  """Count the AppendEntries RPCs sent until the consistency check succeeds."""
+  server = Server(addresses=[LEADER, FOLLOWER], driver=DatabaseDriver(directory=None))
+  server._state = SharedState(
+    driver=server.driver, log=leader, commit_index=0, last_applied_index=0
+  )
+  server._role = LeaderRole(
+    next_index={FOLLOWER: len(leader)},
+    match_index={FOLLOWER: 0},
+  )
+  round_trips = 0
+
+  while True:
+    next_index = server._role.next_index[FOLLOWER]
+    success, conflict_index, conflict_term = _respond(
+      follower, next_index - 1, leader[next_index - 1].term
+    )
+    round_trips += 1
+
+    if success:
+      return round_trips
+    elif hints:
+      res = AppendEntriesRPCResponse(
+        term=0,
+        success=False,
+        request_identity=round_trips,
+        conflict_index=conflict_index,
+        conflict_term=conflict_term,
+      )
+      server._role.next_index[FOLLOWER] = server._next_index_after_conflict(
+        res, FOLLOWER
+      )
+    else:
+      server._role.next_index[FOLLOWER] -= 1
+
+
+def main() -> None:
+  """Program enters here."""
+  # name, terms of the leader and of the follower, most round trips with hints
+  scenarios = (
+    ("follower 10000 entries behind", [(1, 1000), (2, 10000)], [(1, 1000)], 2),
+    (
+      "divergent tail of 5000 entries",
+      [(1, 1000), (3, 5000)],
+      [(1, 1000), (2, 5000)],
+      2,
+    ),
+    (
+      "divergent tail over 50 terms",
+      [(1, 1000), (60, 5000)],
+      [(1, 1000)] + [(term, 100) for term in range(2, 52)],
+      51,
+    ),
+  )
+  failed = False
+
+  for name, leader_terms, follower_terms, max_round_trips in scenarios:
+    leader, follower = _log(leader_terms), _log(follower_terms)
+    before = _round_trips(leader, follower, hints=False)
+    after = _round_trips(leader, follower, hints=True)
+
+    print(f"{name}:")
+    print(
+      f"  {'decrement':>9}: {before:6d} round trips, "
+      f"{before * HEARTBEAT_INTERVAL / 3600:8.2f} h"
+    )
+    print(
+      f"  {'hints':>9}: {after:6d} round trips, "
+      f"{after * ROUND_TRIP * 1000:8.2f} ms"
+    )
+
+    if after > max_round_trips:
+      print(f"  more than {max_round_trips} round trips with hints")
+      failed = True
+
+  if failed:
+    exit(1)
+
+
+if __name__ == "__main__":
+  main()
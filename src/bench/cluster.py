@@ -0,0 +1,98 @@
+"""Throughput and latency of simulated clusters, across cluster sizes and
+payload sizes. Each cluster elects a leader, then closed-loop clients (each
+sending its next request once the previous one is answered) keep it busy for a
+while, then the leader is cut off and the rest elect a new one. Every run with
+the same seed is the same, but for the host time taken.
+
+Reported per cluster: commits per virtual second, median and 99th percentile
+commit latency, time to elect the first leader and to replace it, bytes sent
+over the network per committed entry, and host time per committed entry (the
+number to watch when changing code on the hot path).
+
+Run from the source directory with `python -m bench.cluster`."""
+
+from time import perf_counter
+from typing import List, Tuple
+
+from sim import SimulatedClient, SimulatedCluster
+from utils import Address
+
+CLUSTER_SIZES: Tuple[int, ...] = (3, 5, 7)
+PAYLOAD_SIZES: Tuple[int, ...] = (16, 256, 4096)  # bytes per value
+CLIENTS: int = 64
+DURATION: float = 1  # virtual seconds of load
+ELECTION_TIMEOUT: float = 30  # virtual seconds
+SEED: int = 1
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+  """Return the value below which a fraction of the sorted values falls."""
+  return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def _run(size: int, payload: int) -> None:
+  """Measure a cluster under load, printing a row of the report."""
+  cluster = SimulatedCluster(size=size, seed=SEED)
+  started_at = cluster.clock()
+  cluster.run_until(lambda: cluster.leader() is not None, ELECTION_TIMEOUT)
+  election = cluster.clock() - started_at
+
+  value = "x" * payload
+  latencies: List[float] = []
+  clients = [
+    SimulatedClient(cluster, Address(port=6000 + i)) for i in range(CLIENTS)
+  ]
+
+  def send(client: SimulatedClient, key: str) -> None:
+    def answered(success: bool, latency: float) -> None:
+      if success:
+        latencies.append(latency)
+      if cluster.clock() < load_until:
+        send(client, key)
+
+    client.request(key, value, answered)
+
+  bytes_sent = cluster.network.bytes_sent
+  host_started_at = perf_counter()
+  load_until = cluster.clock() + DURATION
+
+  for i, client in enumerate(clients):
+    send(client, f"account-{i}")
+  cluster.run(DURATION)
+
+  host_time = perf_counter() - host_started_at
+  commits = len(latencies)
+  bytes_sent = cluster.network.bytes_sent - bytes_sent
+  latencies.sort()
+
+  # cut the leader off, and time its replacement
+  leader = cluster.leader()
+  cluster.partition([leader], [a for a in cluster.addresses if a != leader])
+  started_at = cluster.clock()
+  cluster.run_until(lambda: cluster.leader() not in (None, leader), ELECTION_TIMEOUT)
+  failover = cluster.clock() - started_at
+
+  p50, p99 = _percentile(latencies, 0.5), _percentile(latencies, 0.99)
+
+  print(
+    f"{size:>5} {payload:>8} {commits / DURATION:>10.0f}"
+    f" {p50 * 1e3:>8.2f} {p99 * 1e3:>8.2f}"
+    f" {election:>9.2f} {failover:>9.2f}"
+    f" {bytes_sent / max(commits, 1):>10.0f} {host_time / max(commits, 1) * 1e6:>9.1f}"
+  )
+
+
+def main() -> None:
+  """Program enters here."""
+  print(
+    f"{'size':>5} {'payload':>8} {'commits/s':>10} {'p50 ms':>8} {'p99 ms':>8}"
+    f" {'elect s':>9} {'failover':>9} {'bytes/ent':>10} {'host us':>9}"
+  )
+
+  for size in CLUSTER_SIZES:
+    for payload in PAYLOAD_SIZES:
+      _run(size, payload)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,91 @@
+"""Micro-benchmark of the bytes and CPU time spent per AppendEntries RPC by the
+original double JSON encoding, the single JSON encoding and the binary codec,
+the latter either encoding the entries or splicing them in already encoded (as
+the leader does for every follower but the first).
+
+Run from the source directory with `python -m bench.codec`."""
+
+from timeit import timeit
+
+from db import Entry
+from rpc import AppendEntriesRPCRequest, Codec, Encoded, decode, encode, encode_model
+from utils import RPC, Address, FrozenModel, RPCDirection, RPCType
+
+ROUNDS: int = 10000
+
+
+class _LegacyRPC(FrozenModel):
+  """Envelope of the original encoding, holding the content as a JSON string."""
+
+  direction: RPCDirection
+  type: RPCType
+  content: str
+
+
+def _legacy_encode(req: AppendEntriesRPCRequest) -> bytes:
+  """Encode the content as JSON, then the envelope around it as JSON again."""
+  rpc = _LegacyRPC(
+    direction=RPCDirection.REQUEST,
+    type=RPCType.APPEND_ENTRIES,
+    content=req.json(),
+  )
+  return f"{rpc.json()}\n".encode()
+
+
+def _legacy_decode(data: bytes) -> AppendEntriesRPCRequest:
+  """Decode the envelope, then the content twice (once to capture the term)."""
+  rpc = _LegacyRPC.parse_raw(data)
+  AppendEntriesRPCRequest.parse_raw(rpc.content).term
+  return AppendEntriesRPCRequest.parse_raw(rpc.content)
+
+
+def _request(num_entries: int) -> AppendEntriesRPCRequest:
+  """Build an AppendEntries request carrying a number of entries."""
+  return AppendEntriesRPCRequest(
+    term=12,
+    leader_identity=Address(port=5000),
+    previous_log_index=1041,
+    previous_log_term=12,
+    entries=[
+      Entry(index=1042 + i, term=12, key=f"account-{i}", value="100")
+      for i in range(num_entries)
+    ],
+    leader_commit_index=1041,
+    request_identity=7,
+  )
+
+
+def main() -> None:
+  """Program enters here."""
+  for num_entries in (0, 1, 16):
+    req = _request(num_entries)
+    rpc = RPC(direction=RPCDirection.REQUEST, type=RPCType.APPEND_ENTRIES, content=req)
+    encoded = Encoded(
+      len(req.entries), b"".join(encode_model(entry) for entry in req.entries)
+    )
+    spliced = RPC(
+      direction=RPCDirection.REQUEST,
+      type=RPCType.APPEND_ENTRIES,
+      content=AppendEntriesRPCRequest.construct(**{**req.__dict__, "entries": encoded}),
+    )
+
+    print(f"AppendEntries with {num_entries} entries:")
+
+    for name, enc, dec in (
+      ("double json", lambda: _legacy_encode(req), _legacy_decode),
+      ("json", lambda: encode(rpc, Codec.JSON), decode),
+      ("binary", lambda: encode(rpc, Codec.BINARY), decode),
+      ("spliced", lambda: encode(spliced, Codec.BINARY), decode),
+    ):
+      data = enc()
+      encode_time = timeit(enc, number=ROUNDS) / ROUNDS * 1e6
+      decode_time = timeit(lambda: dec(data), number=ROUNDS) / ROUNDS * 1e6
+
+      print(
+        f"  {name:>12}: {len(data):5d} bytes, "
+        f"{encode_time:7.2f} us encode, {decode_time:7.2f} us decode"
+      )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,96 @@
+"""Benchmark of the time spent changing role (follower to candidate, candidate
+to leader, leader to follower) against the length of the log, when roles hold
+the whole server state (the original behaviour) or are tags beside the shared
+state.
+
+Run from the source directory with `python -m bench.election`."""
+
+from contextlib import redirect_stdout
+from io import StringIO
+from timeit import timeit
+from typing import Dict, List, Union
+
+from db import DatabaseDriver, Entry, Log
+from pydantic import BaseModel, NonNegativeInt
+from roles import LeaderRole, SharedState
+from state import Server
+from utils import Address
+
+ADDRESSES: List[Address] = [Address(port=port) for port in range(5000, 5005)]
+ROUNDS: int = 10
+
+
+class _LegacyRole(BaseModel):
+  """Role of the original design, holding the whole server state."""
+
+  current_term: NonNegativeInt
+  voted_for: Union[Address, None]
+  log: List[Entry]
+  commit_index: NonNegativeInt
+  last_applied_index: NonNegativeInt
+
+
+class _LegacyLeaderRole(_LegacyRole):
+  """Leader role of the original design."""
+
+  next_index: Dict[Address, NonNegativeInt]
+  match_index: Dict[Address, NonNegativeInt]
+
+
+def _entries(count: int) -> List[Entry]:
+  """Build entries like those appended by clients."""
+  return [Entry(index=0, term=0, key="", value="")] + [
+    Entry.construct(index=i, term=1, key=f"account-{i}", value="100")
+    for i in range(1, count)
+  ]
+
+
+def _legacy_election(role: _LegacyRole) -> None:
+  """Change role as the original design did, through a copy of the state."""
+  role = _LegacyRole(**role.dict())
+  role = _LegacyLeaderRole(
+    **role.dict(),
+    next_index={address: len(role.log) for address in ADDRESSES},
+    match_index={address: 0 for address in ADDRESSES},
+  )
+  _LegacyRole(**role.dict(exclude={"next_index", "match_index"}))
+
+
+def _election(server: Server) -> None:
+  """Change role as the server does (but for the entry appended by a new leader,
+  which would be persisted)."""
+  server._role_promote_to_candidate()
+  server._role = LeaderRole(
+    next_index={address: len(server._state.log) for address in ADDRESSES},
+    match_index={address: 0 for address in ADDRESSES},
+  )
+  server._role_demote_to_follower()
+
+
+def main() -> None:
+  """Program enters here."""
+  for num_entries in (1000, 10000, 100000):
+    entries = _entries(num_entries)
+    legacy = _LegacyRole(
+      current_term=1,
+      voted_for=None,
+      log=entries,
+      commit_index=0,
+      last_applied_index=0,
+    )
+    server = Server(addresses=ADDRESSES, driver=DatabaseDriver(directory=None))
+    server._state = SharedState(
+      driver=server.driver, log=Log(entries), commit_index=0, last_applied_index=0
+    )
+
+    with redirect_stdout(StringIO()):
+      legacy_time = timeit(lambda: _legacy_election(legacy), number=ROUNDS)
+      shared_time = timeit(lambda: _election(server), number=ROUNDS)
+
+    print(f"Log of {num_entries} entries:")
+    print(f"  {'legacy':>8}: {legacy_time / ROUNDS * 1e3:10.3f} ms per election")
+    print(f"  {'shared':>8}: {shared_time / ROUNDS * 1e3:10.3f} ms per election")
+
+
+if __name__ == "__main__":
+  main()
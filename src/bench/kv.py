@@ -0,0 +1,107 @@
+"""Measurement of the memory held by a state machine of a hundred thousand keys,
+either as the dictionary held in memory or as the store kept on disk, along with
+the time taken to apply batches of entries and to read values back, with record
+caches holding all the values, a tenth of them or none. Batches are views of a
+log, as the apply stage hands them over.
+
+Run from the source directory with `python -m bench.kv`."""
+
+from gc import collect
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory, mkdtemp
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+from typing import Callable, List
+
+from db import (
+  APPLY_BATCH_MAX_ENTRIES,
+  DiskStateMachine,
+  Entry,
+  Log,
+  LogView,
+  MemoryStateMachine,
+  StateMachine,
+)
+
+NUM_KEYS: int = 100_000
+VALUE_BYTES: int = 256
+READS: int = 100_000
+
+
+def _batches() -> List[LogView]:
+  """Build batches of entries setting every key once, each with a value of its
+  own."""
+  log = Log(
+    [Entry(index=0, term=0, key="", value="")]
+    + [
+      Entry.construct(index=i, term=1, key=f"key-{i:08d}", value=f"{i:0{VALUE_BYTES}d}")
+      for i in range(1, NUM_KEYS + 1)
+    ]
+  )
+  return [
+    log[first : first + APPLY_BATCH_MAX_ENTRIES]
+    for first in range(1, NUM_KEYS + 1, APPLY_BATCH_MAX_ENTRIES)
+  ]
+
+
+def _measure(build: Callable[[], StateMachine]) -> StateMachine:
+  """Build a state machine and apply every batch to it, printing the memory it
+  holds once they are applied, then the time taken by another one to apply them
+  (memory tracing slows allocations down)."""
+  batches = _batches()
+
+  collect()
+  start()
+  state_machine = build()
+  for batch in batches:
+    state_machine.apply(batch)
+  size, _ = get_traced_memory()
+  stop()
+  print(f"  {size / 2 ** 20:8.1f} MiB per {NUM_KEYS} keys")
+
+  timed = build()
+  started_at = perf_counter()
+  for batch in batches:
+    timed.apply(batch)
+  elapsed = perf_counter() - started_at
+  print(f"  {elapsed / NUM_KEYS * 1e6:8.2f} us per entry applied")
+
+  return state_machine
+
+
+def _read(state_machine: StateMachine, label: str) -> None:
+  """Read random keys back, printing the time taken per read."""
+  random = Random(0)
+  keys = [f"key-{random.randrange(1, NUM_KEYS + 1):08d}" for _ in range(READS)]
+  started_at = perf_counter()
+
+  for key in keys:
+    state_machine.get(key)
+
+  elapsed = perf_counter() - started_at
+  print(f"  {elapsed / READS * 1e6:8.2f} us per read, {label}")
+
+
+def main() -> None:
+  """Program enters here."""
+  print("dictionary:")
+  _read(_measure(MemoryStateMachine), "all in memory")
+
+  for share, label in ((1, "all cached"), (10, "a tenth cached"), (0, "none cached")):
+    print(f"disk store, {label}:")
+    cache_max_bytes = NUM_KEYS * (VALUE_BYTES + 12) // share if share else 0
+
+    with TemporaryDirectory() as directory:
+      state_machine = _measure(
+        lambda: DiskStateMachine(
+          directory=Path(mkdtemp(dir=directory)), cache_max_bytes=cache_max_bytes
+        )
+      )
+      # a first pass fills the cache
+      _read(state_machine, "first pass")
+      _read(state_machine, "second pass")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,66 @@
+"""Measurement of the memory held by a log of a million entries, either as the
+original list of entries or as the columnar log, along with the time taken to
+fetch terms and to slice a batch of entries out of it (a view of the columnar
+log, whose entries are then built, or encoded for AppendEntries RPCs, from it).
+
+Run from the source directory with `python -m bench.log_memory`."""
+
+from gc import collect
+from timeit import timeit
+from tracemalloc import get_traced_memory, start, stop
+from typing import Any, Callable, List
+
+from db import Entry, Log
+from rpc.codec import encode_entries
+
+NUM_ENTRIES: int = 1_000_000
+ROUNDS: int = 10000
+
+
+def _entries(count: int) -> List[Entry]:
+  """Build entries like those appended by clients."""
+  return [Entry(index=0, term=0, key="", value="")] + [
+    Entry.construct(index=i, term=1 + i // 100000, key=f"account-{i}", value="100")
+    for i in range(1, count)
+  ]
+
+
+def _measure(build: Callable[[], Any]) -> Any:
+  """Build a log, printing the memory it holds once built."""
+  collect()
+  start()
+  log = build()
+  size, _ = get_traced_memory()
+  stop()
+
+  print(f"  {size / 2 ** 20:8.1f} MiB per million entries")
+
+  return log
+
+
+def main() -> None:
+  """Program enters here."""
+  print("list of entries:")
+  entries = _measure(lambda: _entries(NUM_ENTRIES))
+  term_time = timeit(lambda: entries[NUM_ENTRIES // 2].term, number=ROUNDS)
+  slice_time = timeit(lambda: entries[-512:], number=ROUNDS // 100)
+  print(f"  {term_time / ROUNDS * 1e6:8.2f} us per term lookup")
+  print(f"  {slice_time / (ROUNDS // 100) * 1e6:8.2f} us per slice of 512 entries")
+  del entries
+
+  print("columnar log:")
+  log = _measure(lambda: Log(_entries(NUM_ENTRIES)))
+  term_time = timeit(lambda: log.term(NUM_ENTRIES // 2), number=ROUNDS)
+  slice_time = timeit(lambda: log[NUM_ENTRIES - 512 :], number=ROUNDS // 100)
+  build_time = timeit(lambda: list(log[NUM_ENTRIES - 512 :]), number=ROUNDS // 1000)
+  encode_time = timeit(
+    lambda: encode_entries(log[NUM_ENTRIES - 512 :]), number=ROUNDS // 1000
+  )
+  print(f"  {term_time / ROUNDS * 1e6:8.2f} us per term lookup")
+  print(f"  {slice_time / (ROUNDS // 100) * 1e6:8.2f} us per slice of 512 entries")
+  print(f"  {build_time / (ROUNDS // 1000) * 1e6:8.2f} us per 512 entries built")
+  print(f"  {encode_time / (ROUNDS // 1000) * 1e6:8.2f} us per 512 entries encoded")
+
+
+if __name__ == "__main__":
+  main()
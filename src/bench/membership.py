@@ -0,0 +1,103 @@
+"""Throughput of a simulated cluster while a fresh server is added, either as a
+learner made a voter once within the allowed lag of the leader, or made a voter
+as soon as it first answers (as if it joined as a voter). One of the three
+servers is down, so that once the new server votes, no majority is reached
+without it: commits stall until it has caught up with the whole log.
+
+Reported per way of adding: time until the new server votes, commits per
+virtual second from the request adding it until a while after, and the longest
+interval without any commit.
+
+Run from the source directory with `python -m bench.membership`."""
+
+from typing import List, Tuple
+
+from sim import SimulatedClient, SimulatedCluster
+from state import LEARNER_MAX_LAG
+from utils import Address
+
+CLIENTS: int = 32
+PAYLOAD: int = 256  # bytes per value
+PRELOAD: float = 4  # virtual seconds of load building the log
+MEASURE: float = 1  # virtual seconds of load measured once adding
+ELECTION_TIMEOUT: float = 30  # virtual seconds
+SEED: int = 1
+
+NEW_SERVER: Address = Address(port=5003)
+VARIANTS: Tuple[Tuple[str, int], ...] = (
+  ("learner", LEARNER_MAX_LAG),
+  ("voter", 2**63),
+)
+
+
+def _run(name: str, learner_max_lag: int) -> None:
+  """Measure a cluster while a server is added, printing a row of the report."""
+  # nothing is compacted, the new server catches up through the whole log
+  cluster = SimulatedCluster(
+    size=3, seed=SEED, snapshot_threshold=2**63, learner_max_lag=learner_max_lag
+  )
+  cluster.run_until(lambda: cluster.leader() is not None, ELECTION_TIMEOUT)
+
+  value = "x" * PAYLOAD
+  committed_at: List[float] = []
+  clients = [
+    SimulatedClient(cluster, Address(port=6000 + i)) for i in range(CLIENTS)
+  ]
+
+  def send(client: SimulatedClient, key: str) -> None:
+    def answered(success: bool, latency: float) -> None:
+      if success:
+        committed_at.append(cluster.clock())
+      if cluster.clock() < load_until:
+        send(client, key)
+
+    client.request(key, value, answered)
+
+  load_until = cluster.clock() + PRELOAD + MEASURE
+  for i, client in enumerate(clients):
+    send(client, f"account-{i}")
+  cluster.run(PRELOAD)
+
+  # take a follower down, then add the new server
+  leader = cluster.leader()
+  assert leader is not None
+  down = next(address for address in cluster.addresses if address != leader)
+  cluster.network.detach(down)
+  cluster.start(NEW_SERVER)
+
+  started_at = cluster.clock()
+  entries = len(cluster.servers[leader]._state.log)
+  added: List[float] = []
+  admin = SimulatedClient(cluster, Address(port=7000))
+  admin.add_server(
+    NEW_SERVER,
+    lambda success, latency: added.append(latency) if success else None,
+    timeout=MEASURE,
+  )
+  cluster.run(MEASURE)
+
+  measured = [at for at in committed_at if at >= started_at]
+  stall = max(
+    (b - a for a, b in zip([started_at] + measured, measured + [cluster.clock()])),
+    default=MEASURE,
+  )
+
+  print(
+    f"{name:>8} {entries:>8} {added[0] * 1e3 if added else float('nan'):>9.1f}"
+    f" {len(measured) / MEASURE:>10.0f} {stall * 1e3:>9.1f}"
+  )
+
+
+def main() -> None:
+  """Program enters here."""
+  print(
+    f"{'added as':>8} {'entries':>8} {'vote ms':>9} {'commits/s':>10}"
+    f" {'stall ms':>9}"
+  )
+
+  for name, learner_max_lag in VARIANTS:
+    _run(name, learner_max_lag)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,76 @@
+"""Simulation of a server that fell terms behind while partitioned away, then
+hears from every server but the leader (the link from the leader to it is cut,
+one way). Its pre-votes propose a term no later than that of the cluster, so
+they are all rejected: it only catches up with the term the rejections carry.
+Once it has, it keeps proposing the next term, which servers hearing from the
+leader still reject, so the leader is not disrupted.
+
+Reported: the terms of the leader and of the cut-off server, and the virtual
+time the latter took to catch up. The run fails, exiting with a non-zero status,
+unless it caught up within two election timeouts and the leader kept leading.
+
+Run from the source directory with `python -m bench.pre_vote`."""
+
+from sys import exit
+
+from sim import SimulatedCluster
+from state import TIMEOUT_UPPER_BOUND
+from utils import Address
+
+SIZE: int = 5
+ELECTION_TIMEOUT: float = 30  # virtual seconds
+TERMS_BEHIND: int = 2
+SEED: int = 1
+
+
+def main() -> None:
+  """Program enters here."""
+  cluster = SimulatedCluster(size=SIZE, seed=SEED)
+  cluster.run_until(lambda: cluster.leader() is not None, ELECTION_TIMEOUT)
+  leader = cluster.leader()
+  assert leader is not None
+
+  stale = next(address for address in cluster.addresses if address != leader)
+  stale_server = cluster.servers[stale]
+
+  # every partition away of the leader has the majority elect another one, in a
+  # later term the stale server misses
+  for _ in range(TERMS_BEHIND):
+    others = [a for a in cluster.addresses if a not in (stale, leader)]
+    cluster.partition([stale], [leader], others)
+    cluster.run_until(
+      lambda: cluster.leader() is not None and cluster.leader() != leader,
+      ELECTION_TIMEOUT,
+    )
+    new_leader = cluster.leader()
+    assert new_leader is not None
+    leader = new_leader
+
+  cluster.heal()
+  cluster.cut(leader, stale)
+  leader_server = cluster.servers[leader]
+  term = leader_server._state.current_term
+  print(f"leader term {term}, cut-off server term {stale_server._state.current_term}")
+
+  started_at = cluster.clock()
+  caught_up = cluster.run_until(
+    lambda: stale_server._state.current_term >= term, 2 * TIMEOUT_UPPER_BOUND
+  )
+  elapsed = cluster.clock() - started_at
+  cluster.run(2 * TIMEOUT_UPPER_BOUND)
+
+  print(
+    f"cut-off server term {stale_server._state.current_term} after "
+    f"{elapsed:.2f} s, leader term {leader_server._state.current_term}"
+  )
+
+  if not caught_up:
+    print("the cut-off server did not catch up with the term of the leader")
+    exit(1)
+  if cluster.leader() != leader or leader_server._state.current_term != term:
+    print("the leader was disrupted")
+    exit(1)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,2 @@
+from .histogram import *
+from .client import *
@@ -0,0 +1,98 @@
+"""Administrative commands sent to a cluster. `transfer-leadership` has the
+leader hand leadership over to a follower (the most up-to-date one unless a port
+is given) before it is restarted, so that writes resume within a round trip
+rather than after an election timeout. `add-server` adds a started server to the
+cluster, returning once it caught up and votes, and `remove-server` removes one.
+Against Multi-Raft hosts, every command applies to each group in turn, unless a
+group is given.
+
+Run from the source directory with `python -m client.admin`."""
+
+from argparse import ArgumentParser
+from pathlib import Path
+from sys import exit
+
+from orjson import loads
+
+from state import TIMEOUT_LOWER_BOUND
+from transport import TCPTransport, UDPTransport
+from utils import Address
+
+from .client import CLIENT_MAX_ATTEMPTS, Client
+
+# python -m client.admin transfer-leadership [--to PORT] [--group GROUP]
+#                        [--transport {udp,tcp}]
+# python -m client.admin {add-server,remove-server} --server PORT [--group GROUP]
+#                        [--transport {udp,tcp}]
+parser = ArgumentParser(description="Raft cluster administration.")
+
+parser.add_argument(
+  "command",
+  choices=["transfer-leadership", "add-server", "remove-server"],
+  help="administrative command",
+)
+parser.add_argument(
+  "--to", type=int, help="port of the server leadership is transferred to"
+)
+parser.add_argument("--server", type=int, help="port of the server added or removed")
+parser.add_argument(
+  "--group", type=int, help="Raft group of Multi-Raft hosts, every one by default"
+)
+parser.add_argument(
+  "--transport",
+  choices=["udp", "tcp"],
+  default="udp",
+  help="transport carrying requests to the cluster",
+)
+
+
+def main() -> None:
+  """Program enters here."""
+  args = parser.parse_args()
+
+  if args.command != "transfer-leadership" and args.server is None:
+    parser.error(f"{args.command} requires --server")
+
+  with open(Path(__file__).parent.parent / "config.json", mode="r") as fp:
+    config = loads(fp.read())
+  ports = list(map(int, config["ports"]))
+  groups = config.get("groups", 1)
+
+  if args.group is not None and not 0 <= args.group < groups:
+    parser.error(f"--group must be below {groups}")
+
+  client = Client(
+    addresses=[Address(port=port) for port in ports],
+    transport=TCPTransport() if args.transport == "tcp" else UDPTransport(),
+    # the leader answers once the transfer ended, or after an election timeout
+    request_timeout=TIMEOUT_LOWER_BOUND * 1.5,
+    # one redirect to the leader, and one more attempt; membership changes wait
+    # along with their retries, so they may be retried as client requests are
+    max_attempts=3 if args.command == "transfer-leadership" else CLIENT_MAX_ATTEMPTS,
+    groups=groups,
+  )
+  client.open()
+
+  try:
+    for group in range(groups) if args.group is None else [args.group]:
+      # only the groups of Multi-Raft hosts are named
+      of_group = f" in group {group}" if groups > 1 else ""
+
+      if args.command == "add-server":
+        client.add_server(Address(port=args.server), group)
+        print(f"Server 127.0.0.1:{args.server} added{of_group}.")
+      elif args.command == "remove-server":
+        client.remove_server(Address(port=args.server), group)
+        print(f"Server 127.0.0.1:{args.server} removed{of_group}.")
+      else:
+        leader = client.transfer_leadership(
+          Address(port=args.to) if args.to is not None else None, group
+        )
+        print(f"Leadership transferred to {leader.host}:{leader.port}{of_group}.")
+  except RuntimeError as e:
+    print(e)
+    exit(1)
+
+
+if __name__ == "__main__":
+  main()
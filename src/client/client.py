@@ -0,0 +1,380 @@
+"""Defines the client of a cluster. Requests go to the server believed to lead,
+and that belief is revised whenever a response names another leader or a
+request goes unanswered. Any number of requests may be in flight at once, told
+apart by their request identity; over TCP they share one persistent connection
+per server, which the transport keeps open between requests.
+
+Against Multi-Raft hosts (see `multi`), a leader is believed in for every group,
+and requests go to that of the group of their key (administrative requests to
+that of the group they name)."""
+
+from logging import getLogger
+from select import select
+from struct import error as StructError
+from time import time
+from typing import Callable, Dict, List, Union
+
+from pydantic import (
+  BaseModel,
+  Extra,
+  Field,
+  NonNegativeInt,
+  PositiveFloat,
+  PositiveInt,
+  ValidationError,
+)
+from rpc import (
+  AddServerRPCRequest,
+  ClientQueryRPCRequest,
+  ClientRequestRPCRequest,
+  Codec,
+  RemoveServerRPCRequest,
+  TransferLeadershipRPCRequest,
+)
+from rpc.codec import decode, encode
+from transport import BaseTransport, UDPTransport
+from utils import RPC, Address, RPCDirection, RPCType, group_of
+
+logger = getLogger(__name__)
+
+CLIENT_REQUEST_TIMEOUT: float = 0.5  # seconds before a request is sent elsewhere
+CLIENT_RETRY_DELAY: float = 0.05  # seconds before retrying without a leader hint
+CLIENT_MAX_ATTEMPTS: int = 8  # sends of a request before it fails
+
+# called with whether the request succeeded, the value read (for queries), and
+# the seconds since the request was submitted
+Callback = Callable[[bool, Union[str, None], float], None]
+
+
+class _Request(BaseModel):
+  """Request in flight, or waiting to be retried."""
+
+  rpc: RPC
+  callback: Callback
+  submitted_at: float
+  # when the request times out if sent, or is retried if not
+  deadline: float = 0
+  target: Union[Address, None] = None
+  group: NonNegativeInt = 0
+  sent: bool = False
+  attempts: NonNegativeInt = 0
+
+  class Config:
+    arbitrary_types_allowed = True
+    extra = Extra.allow
+
+
+class Client(BaseModel):
+  """Client pipelining requests to the leader of a cluster."""
+
+  addresses: List[Address]
+  transport: BaseTransport = Field(default_factory=UDPTransport)
+  codec: Codec = Codec.BINARY
+  request_timeout: PositiveFloat = CLIENT_REQUEST_TIMEOUT
+  retry_delay: PositiveFloat = CLIENT_RETRY_DELAY
+  max_attempts: PositiveInt = CLIENT_MAX_ATTEMPTS
+  groups: PositiveInt = 1
+
+  class Config:
+    arbitrary_types_allowed = True
+    extra = Extra.allow
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    # server believed to lead each group, until told or found otherwise
+    self.leaders: List[Address] = [self.addresses[0]] * self.groups
+    # number of requests submitted, identifying each of them
+    self._request_count: NonNegativeInt = 0
+    self._pending: Dict[NonNegativeInt, _Request] = {}
+
+  def _complete(
+    self, request_identity: NonNegativeInt, success: bool, value: Union[str, None]
+  ) -> None:
+    """Call back for a request, which is no longer pending."""
+    request = self._pending.pop(request_identity)
+    request.callback(success, value, time() - request.submitted_at)
+
+  def _expire(self) -> None:
+    """Resend every request whose response is overdue, to the next server if the
+    one it was sent to still is believed to lead, and every request whose retry
+    is due."""
+    now = time()
+
+    for request_identity, request in list(self._pending.items()):
+      if request.deadline > now:
+        continue
+
+      if request.sent and request.target == self.leaders[request.group]:
+        self._leader_rotate(request.group)
+      self._retry(request_identity)
+
+  def _leader_rotate(self, group: NonNegativeInt) -> None:
+    """Believe the server after the current one to lead a group."""
+    leader = self.leaders[group]
+    index = self.addresses.index(leader) if leader in self.addresses else -1
+    self.leaders[group] = self.addresses[(index + 1) % len(self.addresses)]
+
+  def _receive(self, data: bytes, sender: Address) -> None:
+    """Handle every response received. A failed response naming another leader
+    is retried there at once; one naming no leader (an election is under way)
+    is retried on the next server after a delay. Malformed data is dropped."""
+    try:
+      rpcs = decode(data)
+    except (KeyError, StructError, ValidationError, ValueError):
+      logger.debug("Invalid RPC response received from %s.", sender)
+      return
+
+    for rpc in rpcs:
+      if rpc.direction != RPCDirection.RESPONSE:
+        continue
+
+      res = rpc.content
+      if res.request_identity not in self._pending:
+        continue
+
+      request = self._pending[res.request_identity]
+      if res.success:
+        # a leadership transfer names the new leader
+        if res.leader_hint is not None:
+          self.leaders[request.group] = res.leader_hint
+        self._complete(res.request_identity, True, getattr(res, "value", None))
+        continue
+
+      if res.leader_hint is not None and res.leader_hint != request.target:
+        self.leaders[request.group] = res.leader_hint
+        self._retry(res.request_identity)
+      else:
+        leader = self.leaders[request.group]
+        if res.leader_hint is None and request.target == leader:
+          self._leader_rotate(request.group)
+        request.sent = False
+        request.deadline = time() + self.retry_delay
+
+  def _retry(self, request_identity: NonNegativeInt) -> None:
+    """Send a request to the leader, or fail it after too many attempts."""
+    request = self._pending[request_identity]
+
+    if request.attempts >= self.max_attempts:
+      self._complete(request_identity, False, None)
+    else:
+      self._send(request)
+
+  def _send(self, request: _Request) -> None:
+    """Send a request to the server believed to lead its group."""
+    request.target = self.leaders[request.group]
+    request.sent = True
+    request.deadline = time() + self.request_timeout
+    request.attempts += 1
+    self.transport.send(encode(request.rpc, self.codec), request.target)
+
+  def _submit(self, rpc: RPC, callback: Callback) -> NonNegativeInt:
+    """Send a request, then wait for its response in later polls."""
+    key = getattr(rpc.content, "key", None)
+    request = _Request(
+      rpc=rpc,
+      callback=callback,
+      submitted_at=time(),
+      group=(
+        group_of(key, self.groups)
+        if key is not None
+        else getattr(rpc.content, "group", 0)
+      ),
+    )
+    self._pending[rpc.content.request_identity] = request
+    self._send(request)
+
+    return rpc.content.request_identity
+
+  def _wait(
+    self,
+    submit: Callable[[Address, Callback, NonNegativeInt], NonNegativeInt],
+    address: Address,
+    group: NonNegativeInt,
+  ) -> None:
+    """Send a membership change, waiting for its response."""
+    results: list = []
+    submit(address, lambda *result: results.append(result), group)
+
+    while not results:
+      self.poll(self.request_timeout)
+
+    success, _, _ = results[0]
+    if not success:
+      raise RuntimeError(
+        f"Changing the membership of {address.host}:{address.port} failed."
+      )
+
+  def add_server(self, address: Address, group: NonNegativeInt = 0) -> None:
+    """Add a server to the cluster (to a group of Multi-Raft hosts), waiting for
+    it to catch up and vote."""
+    self._wait(self.submit_add_server, address, group)
+
+  def close(self) -> None:
+    """Fail every pending request."""
+    for request_identity in list(self._pending):
+      self._complete(request_identity, False, None)
+
+  def get(self, key: str) -> Union[str, None]:
+    """Read the value of a key, waiting for the response."""
+    results: list = []
+    self.submit_get(key, lambda *result: results.append(result))
+
+    while not results:
+      self.poll(self.request_timeout)
+
+    success, value, _ = results[0]
+    if not success:
+      raise RuntimeError(f"Reading {key} failed.")
+
+    return value
+
+  def open(self, host: str = "127.0.0.1") -> None:
+    """Open the transport on any free port, responses being sent back to it."""
+    self.transport.open(Address(host=host, port=0))
+
+  def pending(self) -> int:
+    """Return the number of requests awaiting a response."""
+    return len(self._pending)
+
+  def poll(self, timeout: float = 0) -> None:
+    """Wait up to a timeout for responses (less if a request is due sooner),
+    calling back for every request completed, then resend overdue ones."""
+    if self._pending:
+      due = min(request.deadline for request in self._pending.values())
+      timeout = min(timeout, max(0, due - time()))
+
+    readable, writable, exceptional = select(
+      self.transport.readers(),
+      self.transport.writers(),
+      self.transport.readers(),
+      max(0, timeout),
+    )
+
+    for sock in writable:
+      self.transport.write(sock)
+
+    for sock in readable:
+      for data, sender in self.transport.receive(sock):
+        self._receive(data, sender)
+
+    for sock in exceptional:
+      self.transport.discard(sock)
+
+    self._expire()
+
+  def remove_server(self, address: Address, group: NonNegativeInt = 0) -> None:
+    """Remove a server from the cluster (from a group of Multi-Raft hosts),
+    waiting for the change to commit."""
+    self._wait(self.submit_remove_server, address, group)
+
+  def set(self, key: str, value: str) -> None:
+    """Set a key to a value, waiting for the entry to commit."""
+    results: list = []
+    self.submit_set(key, value, lambda *result: results.append(result))
+
+    while not results:
+      self.poll(self.request_timeout)
+
+    success, _, _ = results[0]
+    if not success:
+      raise RuntimeError(f"Setting {key} failed.")
+
+  def submit_add_server(
+    self, address: Address, callback: Callback, group: NonNegativeInt = 0
+  ) -> NonNegativeInt:
+    """Send a request adding a server, returning its request identity."""
+    self._request_count += 1
+    return self._submit(
+      RPC(
+        direction=RPCDirection.REQUEST,
+        type=RPCType.ADD_SERVER,
+        content=AddServerRPCRequest(
+          request_identity=self._request_count, new_server=address, group=group
+        ),
+      ),
+      callback,
+    )
+
+  def submit_get(self, key: str, callback: Callback) -> NonNegativeInt:
+    """Send a query reading a key, returning its request identity."""
+    self._request_count += 1
+    return self._submit(
+      RPC(
+        direction=RPCDirection.REQUEST,
+        type=RPCType.CLIENT_QUERY,
+        content=ClientQueryRPCRequest(
+          request_identity=self._request_count, key=key
+        ),
+      ),
+      callback,
+    )
+
+  def submit_remove_server(
+    self, address: Address, callback: Callback, group: NonNegativeInt = 0
+  ) -> NonNegativeInt:
+    """Send a request removing a server, returning its request identity."""
+    self._request_count += 1
+    return self._submit(
+      RPC(
+        direction=RPCDirection.REQUEST,
+        type=RPCType.REMOVE_SERVER,
+        content=RemoveServerRPCRequest(
+          request_identity=self._request_count, old_server=address, group=group
+        ),
+      ),
+      callback,
+    )
+
+  def submit_set(self, key: str, value: str, callback: Callback) -> NonNegativeInt:
+    """Send a request setting a key to a value, returning its request identity."""
+    self._request_count += 1
+    return self._submit(
+      RPC(
+        direction=RPCDirection.REQUEST,
+        type=RPCType.CLIENT_REQUEST,
+        content=ClientRequestRPCRequest(
+          request_identity=self._request_count, key=key, value=value
+        ),
+      ),
+      callback,
+    )
+
+  def submit_transfer_leadership(
+    self,
+    target: Union[Address, None],
+    callback: Callback,
+    group: NonNegativeInt = 0,
+  ) -> NonNegativeInt:
+    """Send a request asking the leader to hand leadership over to a server (the
+    most up-to-date one if none is given), returning its request identity."""
+    self._request_count += 1
+    return self._submit(
+      RPC(
+        direction=RPCDirection.REQUEST,
+        type=RPCType.TRANSFER_LEADERSHIP,
+        content=TransferLeadershipRPCRequest(
+          request_identity=self._request_count, target=target, group=group
+        ),
+      ),
+      callback,
+    )
+
+  def transfer_leadership(
+    self, target: Union[Address, None] = None, group: NonNegativeInt = 0
+  ) -> Address:
+    """Hand leadership (of a group of Multi-Raft hosts) over to a server (the
+    most up-to-date one if none is given), waiting for the leader to step down.
+    Returns the new leader."""
+    results: list = []
+    self.submit_transfer_leadership(
+      target, lambda *result: results.append(result), group
+    )
+
+    while not results:
+      self.poll(self.request_timeout)
+
+    success, _, _ = results[0]
+    if not success:
+      raise RuntimeError("Transferring leadership failed.")
+
+    return self.leaders[group]
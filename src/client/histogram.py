@@ -0,0 +1,133 @@
+"""Defines the latency histogram of the load generator, after HdrHistogram:
+values are counted in log-linear buckets (linear within each power of two), so
+every value is kept to a fixed relative precision whatever its magnitude, and
+histograms recorded by separate processes merge by adding their counts. The
+percentile distribution is printed in the layout of HdrHistogram's."""
+
+from math import log2, sqrt
+from typing import Dict
+
+# linear buckets per power of two, keeping values within 1/128 of their own
+SUB_BUCKET_BITS: int = 8
+
+
+class LatencyHistogram:
+  """Counts of integer values (microseconds) in log-linear buckets."""
+
+  def __init__(self, sub_bucket_bits: int = SUB_BUCKET_BITS) -> None:
+    self.sub_bucket_bits = sub_bucket_bits
+    self.counts: Dict[int, int] = {}
+    self.total = 0
+    self.min = 0
+    self.max = 0
+    self._sum = 0
+    self._sum_squares = 0
+
+  def _bucket(self, value: int) -> int:
+    """Return the bucket of a value: values below a power of two with as many
+    bits as a sub-bucket have a bucket each, every later power of two is split
+    in half as many buckets."""
+    shift = max(0, value.bit_length() - self.sub_bucket_bits)
+    return (shift << (self.sub_bucket_bits - 1)) + (value >> shift)
+
+  def _count_at_percentile(self, percentile: float) -> int:
+    """Return how many values are at or below a percentile."""
+    return min(self.total, max(1, int(percentile / 100 * self.total + 0.5)))
+
+  def _highest_value(self, bucket: int) -> int:
+    """Return the highest value counted in a bucket."""
+    half = 1 << (self.sub_bucket_bits - 1)
+    shift = max(0, bucket // half - 1)
+    mantissa = bucket - (shift << (self.sub_bucket_bits - 1))
+    return ((mantissa + 1) << shift) - 1
+
+  def mean(self) -> float:
+    return self._sum / self.total if self.total else 0
+
+  def merge(self, other: "LatencyHistogram") -> None:
+    """Add the counts of another histogram of the same precision."""
+    for bucket, count in other.counts.items():
+      self.counts[bucket] = self.counts.get(bucket, 0) + count
+
+    if other.total:
+      self.min = min(self.min, other.min) if self.total else other.min
+      self.max = max(self.max, other.max)
+    self.total += other.total
+    self._sum += other._sum
+    self._sum_squares += other._sum_squares
+
+  def percentile_distribution(
+    self, ticks_per_half_distance: int = 5, scale: float = 1000
+  ) -> str:
+    """Render the value at every percentile tick, ticks getting closer as the
+    percentile nears 100, with values divided by a scale (microseconds printed
+    as milliseconds by default)."""
+    lines = [
+      f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}",
+      "",
+    ]
+
+    percentile = 0.0
+    while self.total:
+      value = self.value_at_percentile(percentile) / scale
+      count = self._count_at_percentile(percentile)
+
+      if percentile < 100:
+        inverse = f"{1 / (1 - percentile / 100):>14.2f}"
+      else:
+        inverse = f"{'inf':>14}"
+      lines.append(
+        f"{value:>12.3f} {percentile / 100:>14.12f} {count:>10} {inverse}"
+      )
+
+      if percentile >= 100:
+        break
+      # halve the distance to 100 every so many ticks
+      half_distance = 2 ** (int(log2(100 / (100 - percentile))) + 1)
+      percentile += 100 / (ticks_per_half_distance * half_distance)
+      # stop refining once a tick is finer than a single value
+      if 1 / (1 - percentile / 100) > self.total:
+        percentile = 100
+
+    lines.append(
+      f"#[Mean    = {self.mean() / scale:>12.3f}, StdDeviation   = "
+      f"{self.stddev() / scale:>12.3f}]"
+    )
+    lines.append(
+      f"#[Max     = {self.max / scale:>12.3f}, Total count    = {self.total:>12}]"
+    )
+    lines.append(
+      f"#[Buckets = {len(self.counts):>12}, SubBuckets     = "
+      f"{1 << self.sub_bucket_bits:>12}]"
+    )
+
+    return "\n".join(lines)
+
+  def record(self, value: int) -> None:
+    """Count a value."""
+    bucket = self._bucket(value)
+    self.counts[bucket] = self.counts.get(bucket, 0) + 1
+
+    self.min = min(self.min, value) if self.total else value
+    self.max = max(self.max, value)
+    self.total += 1
+    self._sum += value
+    self._sum_squares += value * value
+
+  def stddev(self) -> float:
+    if not self.total:
+      return 0
+    return sqrt(max(0, self._sum_squares / self.total - self.mean() ** 2))
+
+  def value_at_percentile(self, percentile: float) -> int:
+    """Return the highest value (to the precision of its bucket) at or below
+    which a percentile of the values fall."""
+    target = self._count_at_percentile(percentile)
+    seen = 0
+
+    for bucket in sorted(self.counts):
+      seen += self.counts[bucket]
+      if seen >= target:
+        return min(self.max, self._highest_value(bucket))
+
+    return self.max
@@ -0,0 +1,189 @@
+"""Load generator driving a cluster end to end. Every process keeps a number of
+requests in flight through its own client, each request reading or writing a
+key drawn from a uniform or zipfian distribution, then the latency histograms of
+all processes are merged and printed as a percentile distribution.
+
+Run from the source directory with `python -m client.loadgen`."""
+
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from random import Random
+from time import time
+from typing import Callable, List, Tuple, Union
+
+from orjson import loads
+
+from rpc import Codec
+from transport import TCPTransport, UDPTransport
+from utils import Address
+
+from .client import Client
+from .histogram import LatencyHistogram
+
+# seconds given to the requests still in flight once the load stops
+DRAIN_TIMEOUT: float = 2
+
+# python -m client.loadgen [--processes N] [--in-flight N] [--duration SECONDS]
+#   [--keys N] [--distribution {uniform,zipfian}] [--zipf-theta THETA]
+#   [--value-size BYTES] [--read-ratio RATIO] [--transport {udp,tcp}]
+#   [--codec {binary,json}]
+parser = ArgumentParser(description="Raft cluster load generator.")
+
+parser.add_argument(
+  "--processes", type=int, default=4, help="client processes generating load"
+)
+parser.add_argument(
+  "--in-flight", type=int, default=32, help="requests in flight per process"
+)
+parser.add_argument(
+  "--duration", type=float, default=10, help="seconds of load generated"
+)
+parser.add_argument("--keys", type=int, default=10000, help="number of keys")
+parser.add_argument(
+  "--distribution",
+  choices=["uniform", "zipfian"],
+  default="uniform",
+  help="distribution keys are drawn from",
+)
+parser.add_argument(
+  "--zipf-theta",
+  type=float,
+  default=0.99,
+  help="skew of the zipfian distribution (0 is uniform, must be below 1)",
+)
+parser.add_argument(
+  "--value-size", type=int, default=128, help="bytes per value written"
+)
+parser.add_argument(
+  "--read-ratio", type=float, default=0.5, help="fraction of requests that read"
+)
+parser.add_argument(
+  "--transport",
+  choices=["udp", "tcp"],
+  default="udp",
+  help="transport carrying requests to the cluster",
+)
+parser.add_argument(
+  "--codec",
+  choices=[codec.value for codec in Codec],
+  default=Codec.BINARY.value,
+  help="wire format of requests sent",
+)
+
+
+def uniform(keys: int, random: Random) -> Callable[[], int]:
+  """Return a generator of keys drawn uniformly."""
+  return lambda: random.randrange(keys)
+
+
+def zipfian(keys: int, theta: float, random: Random) -> Callable[[], int]:
+  """Return a generator of keys drawn from a zipfian distribution, key 0 being
+  the most popular, as generated by YCSB (after Gray et al., "Quickly Generating
+  Billion-Record Synthetic Databases")."""
+  zeta_keys = sum(1 / i**theta for i in range(1, keys + 1))
+  zeta_two = 1 + 1 / 2**theta
+  alpha = 1 / (1 - theta)
+  eta = (1 - (2 / keys) ** (1 - theta)) / (1 - zeta_two / zeta_keys)
+
+  def generate() -> int:
+    u = random.random()
+    uz = u * zeta_keys
+
+    if uz < 1:
+      return 0
+    if uz < zeta_two:
+      return 1
+    return min(keys - 1, int(keys * (eta * u - eta + 1) ** alpha))
+
+  return generate
+
+
+def _worker(
+  args: Namespace, ports: List[int], groups: int, seed: int
+) -> Tuple[LatencyHistogram, int, int, int]:
+  """Generate load from one process, returning the latencies of its successful
+  requests, and how many reads and writes succeeded and how many failed."""
+  random = Random(seed)
+  client = Client(
+    addresses=[Address(port=port) for port in ports],
+    transport=TCPTransport() if args.transport == "tcp" else UDPTransport(),
+    codec=Codec(args.codec),
+    groups=groups,
+  )
+  client.open()
+
+  if args.distribution == "zipfian":
+    key = zipfian(args.keys, args.zipf_theta, random)
+  else:
+    key = uniform(args.keys, random)
+
+  value = "x" * args.value_size
+  histogram = LatencyHistogram()
+  # reads and writes that succeeded, and requests that failed
+  counts = [0, 0, 0]
+
+  def callback(read: bool) -> Callable[[bool, Union[str, None], float], None]:
+    def answered(success: bool, _: Union[str, None], latency: float) -> None:
+      if success:
+        histogram.record(int(latency * 1e6))
+        counts[0 if read else 1] += 1
+      else:
+        counts[2] += 1
+
+    return answered
+
+  load_until = time() + args.duration
+
+  while time() < load_until:
+    while client.pending() < args.in_flight:
+      if random.random() < args.read_ratio:
+        client.submit_get(f"key-{key()}", callback(True))
+      else:
+        client.submit_set(f"key-{key()}", value, callback(False))
+
+    client.poll(load_until - time())
+
+  drain_until = time() + DRAIN_TIMEOUT
+  while client.pending() and time() < drain_until:
+    client.poll(drain_until - time())
+  client.close()
+
+  return histogram, counts[0], counts[1], counts[2]
+
+
+def main() -> None:
+  """Program enters here."""
+  args = parser.parse_args()
+
+  with open(Path(__file__).parent.parent / "config.json", mode="r") as fp:
+    config = loads(fp.read())
+  ports = list(map(int, config["ports"]))
+  groups = config.get("groups", 1)
+
+  histogram = LatencyHistogram()
+  reads = writes = failures = 0
+
+  with ProcessPoolExecutor(args.processes) as executor:
+    futures = [
+      executor.submit(_worker, args, ports, groups, seed)
+      for seed in range(args.processes)
+    ]
+
+    for future in futures:
+      worker_histogram, worker_reads, worker_writes, worker_failures = future.result()
+      histogram.merge(worker_histogram)
+      reads += worker_reads
+      writes += worker_writes
+      failures += worker_failures
+
+  print(histogram.percentile_distribution())
+  print(
+    f"#[Reads/s = {reads / args.duration:>12.0f}, Writes/s       = "
+    f"{writes / args.duration:>12.0f}]"
+  )
+  print(f"#[Failed  = {failures:>12}]")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,2 +1,12 @@
 from .entry import *
+from .log import *
+from .configuration import *
+from .snapshot import *
+from .state_machine import *
+from .apply import *
+from .cache import *
+from .wal import *
+from .group_wal import *
+from .kv import *
+from .memory import *
 from .driver import *
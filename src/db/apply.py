@@ -0,0 +1,119 @@
+"""Defines the stage applying committed entries to the state machine, decoupled
+from the loop handling RPCs: batches are applied one at a time on a worker
+thread, so that a slow state machine delays neither heartbeats nor replication,
+and every entry committed while a batch is applied joins the next one. A batch
+is handed over as a view of the log (see `log`), so the loop only copies its
+columns: the entries themselves are built on the worker thread as they are
+applied.
+
+Between two batches, the stage also runs other jobs on the state machine, which
+must not stall the loop either: taking a snapshot, and restoring one.
+
+A socket is made readable whenever a batch has been applied, so that the loop
+driving the server wakes up to collect it. Where everything must happen on one
+thread (as in the simulator), batches are applied inline instead."""
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from socket import socket, socketpair
+from time import perf_counter
+from typing import Any, Callable, List, Union
+
+from pydantic import NonNegativeInt
+from utils.metrics import SIZE_BUCKETS, Histogram
+
+from . import LogView
+
+APPLY_BATCH_MAX_ENTRIES: int = 1024  # entries per batch applied
+
+APPLY_BATCH_ENTRIES = Histogram(
+  "raft_apply_batch_entries", "Entries per batch applied.", SIZE_BUCKETS
+)
+APPLY_SECONDS = Histogram("raft_apply_seconds", "Time applying a batch of entries.")
+
+
+class ApplyStage:
+  """Applies batches of committed entries with a given function, one at a time,
+  and hands back the index of the last entry of each batch applied. Jobs run
+  between two batches hand back their result to a callback instead."""
+
+  def __init__(self, apply: Callable[[LogView], None], threaded: bool = True) -> None:
+    self._apply = apply
+    self._executor: Union[ThreadPoolExecutor, None] = None
+    self._waker: Union[socket, None] = None
+    self._wakeup: Union[socket, None] = None
+
+    if threaded:
+      self._executor = ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix="apply"
+      )
+      self._waker, self._wakeup = socketpair()
+      self._waker.setblocking(False)
+
+    # batch (or job) being run, and what collecting its result returns
+    self._future: Union[Future, None] = None
+    self._collected: Callable[[Any], Union[NonNegativeInt, None]] = lambda _: None
+
+  def _run(self, entries: LogView) -> None:
+    """Apply a batch of entries, timing it."""
+    started_at = perf_counter()
+    self._apply(entries)
+    APPLY_SECONDS.observe(perf_counter() - started_at)
+    APPLY_BATCH_ENTRIES.observe(len(entries))
+
+  def _start(self, function: Callable[..., Any], *args: Any) -> None:
+    """Run a function on the worker thread, or inline if there is none."""
+    if self._executor is None:
+      self._future = Future()
+      self._future.set_result(function(*args))
+    else:
+      self._future = self._executor.submit(function, *args)
+      # woken up once the future is done, so that collecting then finds it so
+      self._future.add_done_callback(lambda _: self._wakeup.send(b"\0"))
+
+  def collect(self) -> Union[NonNegativeInt, None]:
+    """Return the index of the last entry of the batch applied since the last
+    call, if there is one, or call back with the result of the job run since.
+    An exception raised applying or running it is raised here."""
+    # a wakeup may come after the batch is found done, but never before
+    if self._waker is not None:
+      try:
+        self._waker.recv(64)
+      except BlockingIOError:
+        pass
+
+    if self._future is None or not self._future.done():
+      return None
+
+    future, self._future = self._future, None
+
+    return self._collected(future.result())
+
+  def is_busy(self) -> bool:
+    """Indicate if a batch (or job) is being run, or waits to be collected."""
+    return self._future is not None
+
+  def readers(self) -> List[socket]:
+    """Return the sockets made readable whenever a batch has been applied."""
+    return [self._waker] if self._waker is not None else []
+
+  def run(self, job: Callable[[], Any], done: Callable[[Any], None]) -> None:
+    """Start running a job on the state machine, once the previous batch was
+    collected; collecting the job calls back with its result."""
+    assert self._future is None
+    self._collected = done
+    self._start(job)
+
+  def submit(self, entries: LogView) -> None:
+    """Start applying a batch of entries, which must directly follow those of
+    the previous batch, once that one was collected."""
+    assert self._future is None and entries
+    last_index = entries.start + len(entries) - 1
+    self._collected = lambda _: last_index
+    self._start(self._run, entries)
+
+  def wait(self) -> Union[NonNegativeInt, None]:
+    """Wait for the batch (or job) being run, if any, then collect it."""
+    if self._future is not None:
+      self._future.exception()
+
+    return self.collect()
@@ -0,0 +1,45 @@
+"""Defines the cache of encoded log entries. A leader sends the same entries to
+every follower, and again to those that fall behind, so each entry is encoded
+once and its bytes spliced into every AppendEntries RPC carrying it. The cache
+is bounded in bytes, evicting the entries cached first, which followers are the
+least likely to still be missing."""
+
+from typing import Dict, Union
+
+from pydantic import NonNegativeInt
+
+ENTRY_CACHE_MAX_BYTES: int = 16 * 1024 * 1024  # bytes
+
+
+class EntryCache:
+  """Encoded entries by index."""
+
+  def __init__(self, max_bytes: int = ENTRY_CACHE_MAX_BYTES) -> None:
+    self.max_bytes = max_bytes
+    self._encoded: Dict[NonNegativeInt, bytes] = {}
+    self._size = 0
+
+  def __len__(self) -> int:
+    return len(self._encoded)
+
+  def clear(self) -> None:
+    """Evict every entry."""
+    self._encoded = {}
+    self._size = 0
+
+  def get(self, index: NonNegativeInt) -> Union[bytes, None]:
+    """Fetch the encoded entry at an index, if it is cached."""
+    return self._encoded.get(index)
+
+  def put(self, index: NonNegativeInt, data: bytes) -> None:
+    """Cache an encoded entry, evicting the oldest ones past the bound."""
+    self._size += len(data) - len(self._encoded.pop(index, b""))
+    self._encoded[index] = data
+
+    while self._size > self.max_bytes and len(self._encoded) > 1:
+      self._size -= len(self._encoded.pop(next(iter(self._encoded))))
+
+  def truncate(self, index: NonNegativeInt) -> None:
+    """Evict the entry at an index and every later one, as they were replaced."""
+    for cached in [cached for cached in self._encoded if cached >= index]:
+      self._size -= len(self._encoded.pop(cached))
@@ -0,0 +1,35 @@
+"""Defines the cluster configuration, which changes through the log (Chapter 4).
+A configuration entry sets a reserved key to the new configuration, so that it
+is applied, snapshotted and sent to followers along with every other entry, and
+every server uses the latest configuration in its log, committed or not.
+
+Learners receive every entry but neither vote nor count towards any majority,
+so that a server joining the cluster catches up without slowing commits."""
+
+from typing import List
+
+from orjson import dumps, loads
+from pydantic import BaseModel
+from utils.address import Address
+
+CONFIGURATION_KEY: str = "raft.configuration"
+
+
+class Configuration(BaseModel):
+  """Servers of the cluster: voters, then learners catching up to become so."""
+
+  voters: List[Address]
+  learners: List[Address] = []
+
+  @classmethod
+  def from_value(cls, value: str) -> "Configuration":
+    """Read the configuration set by a configuration entry."""
+    return cls.parse_obj(loads(value))
+
+  def members(self) -> List[Address]:
+    """Return every server replicated to, voters first."""
+    return self.voters + self.learners
+
+  def to_value(self) -> str:
+    """Write the configuration as the value of a configuration entry."""
+    return dumps(self.dict()).decode()
@@ -2,12 +2,27 @@
 dictated to do so by the leader) and returning account balances."""
 
 from pathlib import Path
-from typing import Dict, List, Union
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple, Union
 
-from pydantic import BaseModel, NonNegativeInt, StrictBool
+from pydantic import BaseModel, Extra, Field, NonNegativeInt, StrictBool
 from utils.address import Address
-
-from . import Entry
+from utils.metrics import Counter, Histogram
+
+from . import (
+  Entry,
+  EntryCache,
+  GroupWriteAheadLog,
+  Log,
+  LogView,
+  MemorySnapshotStore,
+  MemoryStateMachine,
+  MemoryWriteAheadLog,
+  Snapshot,
+  SnapshotStore,
+  StateMachine,
+  WriteAheadLog,
+)
 
 
 class _Database(BaseModel):
@@ -28,115 +43,347 @@ class _State(BaseModel):
   voted_for: Union[Address, None]
 
 
+WAL_WRITE_SECONDS = Histogram(
+  "raft_wal_write_seconds", "Time handing buffered WAL writes to the OS per sync."
+)
+FSYNC_SECONDS = Histogram("raft_fsync_seconds", "Time making WAL writes durable.")
+SNAPSHOT_SECONDS = Histogram("raft_snapshot_seconds", "Time taking a snapshot.")
+SNAPSHOT_RESTORE_SECONDS = Histogram(
+  "raft_snapshot_restore_seconds", "Time restoring a snapshot received."
+)
+ENTRY_CACHE_LOOKUPS = Counter(
+  "raft_entry_cache_lookups_total",
+  "Encoded entries looked up in the cache, by whether they were cached.",
+  ("result",),
+)
+
 relative = lambda path: Path(__file__).parent / path
 
 
+def _load_db(state_machine: StateMachine, snapshots: SnapshotStore) -> None:
+  """Restore the state machine from the latest snapshot, seeding it from the
+  JSON database if there is no snapshot yet, unless it already holds every entry
+  the snapshot does."""
+  snapshot = snapshots.latest
+  index = 0 if snapshot is None else snapshot.last_included_index
+  applied = state_machine.last_applied_index()
+
+  # a state machine persisting itself may be past the snapshot already
+  if applied > 0 and applied >= index:
+    return
+
+  if snapshot is None:
+    db = _Database.parse_file(relative("json/db.json")).db
+    state_machine.restore(((k.encode(), v.encode()) for k, v in db.items()), 0)
+  else:
+    state_machine.restore(snapshots.records(snapshot), index)
+
+
+def _replay_log(wal: WriteAheadLog, snapshots: SnapshotStore) -> Log:
+  """Load the log entries past the latest snapshot from the write-ahead log,
+  seeding it from the JSON log if both are still empty."""
+  entries = wal.replay()
+  snapshot = snapshots.latest
+
+  if snapshot is not None:
+    # the last entry included in the snapshot is only kept for its term
+    return Log(
+      [
+        Entry(
+          index=snapshot.last_included_index,
+          term=snapshot.last_included_term,
+          key="",
+          value="",
+        )
+      ]
+      + [entry for entry in entries if entry.index > snapshot.last_included_index]
+    )
+
+  if not entries:
+    entries = _Log.parse_file(relative("json/log.json")).log
+    for entry in entries:
+      wal.append(entry)
+
+  return Log(entries)
+
+
+def _replay_state(wal: WriteAheadLog) -> _State:
+  """Load the state from the replayed write-ahead log, seeding it from the JSON
+  state if the write-ahead log does not hold any yet."""
+  if wal.state is not None:
+    return _State.parse_raw(wal.state)
+
+  state = _State.parse_file(relative("json/state.json"))
+  wal.set_state(state.json().encode())
+
+  return state
+
+
 class DatabaseDriver(BaseModel):
-  """Driver for server variables that need to be persistent."""
-
-  _db: _Database = _Database.parse_file(relative("json/db.json"))
-  _log: _Log = _Log.parse_file(relative("json/log.json"))
-  _state: _State = _State.parse_file(relative("json/state.json"))
-
-  @staticmethod
-  def _dump(path: str, content: str) -> None:
-    """Dump information to a file."""
-    with open(relative(path), mode="w") as fp:
-      fp.write(f"{content}\n")
-
-  @classmethod
-  def _dump_db(cls) -> None:
-    """Store the server database to disk."""
-    cls._dump("json/db.json", cls._db.json())
-
-  @classmethod
-  def _dump_log(cls) -> None:
-    """Store the server log to disk."""
-    cls._dump("json/log.json", cls._log.json())
-
-  @classmethod
-  def _dump_state(cls) -> None:
-    """Store the server state to disk."""
-    cls._dump("json/state.json", cls._state.json())
-
-  @classmethod
-  def get_db(cls, key: str) -> Union[str, None]:
+  """Driver for server variables that need to be persistent, kept in a directory,
+  or in memory if there is none (so that several servers may share a process).
+  The log of a Raft group sharing its host's write-ahead log may be given, and
+  so may the state machine committed entries are applied to."""
+
+  directory: Union[Path, None] = Path(__file__).parent
+  wal: Union[GroupWriteAheadLog, None] = None
+  state_machine: StateMachine = Field(default_factory=MemoryStateMachine)
+
+  class Config:
+    arbitrary_types_allowed = True
+    copy_on_model_validation = "none"
+    extra = Extra.allow
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._snapshots: SnapshotStore
+    self._wal: Union[WriteAheadLog, GroupWriteAheadLog, MemoryWriteAheadLog]
+
+    if self.directory is None:
+      self._snapshots = MemorySnapshotStore()
+      self._wal = MemoryWriteAheadLog()
+    else:
+      self._snapshots = SnapshotStore(directory=self.directory / "snapshot")
+      self._wal = (
+        self.wal
+        if self.wal is not None
+        else WriteAheadLog(directory=self.directory / "wal")
+      )
+
+    _load_db(self.state_machine, self._snapshots)
+    self._log: Log = _replay_log(self._wal, self._snapshots)
+    self._state: _State = _replay_state(self._wal)
+    # entries encoded for AppendEntries RPCs, emptied of those overwritten
+    self._encoded = EntryCache()
+
+  def _dump_state(self) -> None:
+    """Append the server state to the write-ahead log (durable on next sync)."""
+    self._wal.set_state(self._state.json().encode())
+
+  def commit_snapshot(self, snapshot: Snapshot) -> Log:
+    """Make a snapshot taken or installed on the apply stage the latest one, then
+    discard the log it covers: the log is kept past the snapshot if it holds the
+    last included entry, else discarded whole."""
+    self._snapshots.commit(snapshot)
+    index, term = snapshot.last_included_index, snapshot.last_included_term
+
+    if self._log.start <= index < len(self._log) and self._log.term(index) == term:
+      self._log.compact(index)
+      self._wal.compact(index)
+    else:
+      self._log.reset(index, term)
+      self._wal.reset(index + 1)
+      self._encoded.clear()
+
+    return self._log
+
+  def get_db(self, key: str) -> Union[str, None]:
     """Fetch key from database."""
-    return cls._db.db[key] if isinstance(key, str) else None
+    return self.state_machine.get(key) if isinstance(key, str) else None
 
-  @classmethod
-  def get_current_term(cls) -> NonNegativeInt:
+  def get_current_term(self) -> NonNegativeInt:
     """Fetch current term from database."""
-    return cls._state.current_term
+    return self._state.current_term
 
-  @classmethod
-  def get_voted_for(cls) -> Union[Address, None]:
+  def get_voted_for(self) -> Union[Address, None]:
     """Fetch who server voted for this term."""
-    return cls._state.voted_for
+    return self._state.voted_for
 
-  @classmethod
-  def get_entry(cls, i: NonNegativeInt) -> Union[Entry, None]:
+  def get_entry(self, i: NonNegativeInt) -> Union[Entry, None]:
     """Fetch inside log, if it exists, else None."""
-    if isinstance(i, NonNegativeInt) and 0 <= i < len(cls._log.log):
-      return cls._log.log[i]
+    if isinstance(i, NonNegativeInt) and self._log.start <= i < len(self._log):
+      return self._log[i]
     else:
       return None
 
-  @classmethod
-  def get_log(cls) -> List[Entry]:
+  def get_encoded_entries(
+    self,
+    lower: NonNegativeInt,
+    upper: NonNegativeInt,
+    encode: Callable[[LogView], List[bytes]],
+  ) -> bytes:
+    """Fetch the entries from a lower index up to an upper one, encoded back to
+    back, encoding (and caching) those that were not yet: every run of entries
+    missing from the cache is encoded at once, out of a view of the log."""
+    encoded: List[bytes] = []
+    misses = 0
+    index = lower
+
+    while index < upper:
+      data = self._encoded.get(index)
+
+      if data is not None:
+        encoded.append(data)
+        index += 1
+        continue
+
+      end = index + 1
+      while end < upper and self._encoded.get(end) is None:
+        end += 1
+
+      for i, data in enumerate(encode(self._log[index:end])):
+        self._encoded.put(index + i, data)
+        encoded.append(data)
+      misses += end - index
+      index = end
+
+    ENTRY_CACHE_LOOKUPS.inc("hit", amount=upper - lower - misses)
+    ENTRY_CACHE_LOOKUPS.inc("miss", amount=misses)
+
+    return b"".join(encoded)
+
+  def get_last_applied_index(self) -> NonNegativeInt:
+    """Fetch the index of the last entry applied before a restart: that of the
+    snapshot, or of the last entry the state machine holds if it persists itself
+    (and the log still holds it)."""
+    return max(
+      self._log.start,
+      min(self.state_machine.last_applied_index(), self.last_index()),
+    )
+
+  def get_log(self) -> Log:
     """Fetch log."""
-    return cls._log.log
-
-  @classmethod
-  def last_index(cls) -> NonNegativeInt:
-    """Fetch index of last entry inside the log."""
-    return len(cls._log.log) - 1
-
-  @classmethod
-  def set_db(cls, key: str, value: str) -> StrictBool:
-    """Set key-value inside database."""
-    if isinstance(key, str) and isinstance(value, str):
-      cls._db.db[key] = value
+    return self._log
 
-      return True
-    else:
-      return False
+  def get_snapshot(self) -> Union[Snapshot, None]:
+    """Fetch the metadata of the latest snapshot, if there is one."""
+    return self._snapshots.latest
 
-  @classmethod
-  def set_current_term(cls, new_term: NonNegativeInt) -> NonNegativeInt:
+  def last_index(self) -> NonNegativeInt:
+    """Fetch index of last entry inside the log."""
+    return len(self._log) - 1
+
+  def read_snapshot(self, offset: NonNegativeInt, size: NonNegativeInt) -> bytes:
+    """Fetch a chunk of the latest snapshot."""
+    return self._snapshots.read(offset, size)
+
+  def receive_snapshot(
+    self,
+    last_included_index: NonNegativeInt,
+    last_included_term: NonNegativeInt,
+    offset: NonNegativeInt,
+    data: bytes,
+    done: StrictBool,
+  ) -> Tuple[NonNegativeInt, Union[Snapshot, None]]:
+    """Store a chunk of a snapshot sent by the leader. Returns the offset of the
+    next chunk expected, and the snapshot once it is complete, to be installed
+    (see `install_snapshot`)."""
+    next_offset = self._snapshots.receive(
+      last_included_index, last_included_term, offset, data
+    )
+
+    if not done or next_offset != offset + len(data):
+      return next_offset, None
+
+    return next_offset, self._snapshots.received()
+
+  def apply(self, entries: LogView) -> None:
+    """Apply a batch of committed entries to the state machine, in order."""
+    self.state_machine.apply(entries)
+
+  def set_current_term(self, new_term: NonNegativeInt) -> NonNegativeInt:
     """Set the current term with guarantee that new term is larger."""
-    if isinstance(new_term, NonNegativeInt) and new_term > cls._state.current_term:
-      cls._state.current_term = new_term
-      cls._state.voted_for = None
-      cls._dump_state()
+    if isinstance(new_term, NonNegativeInt) and new_term > self._state.current_term:
+      self._state.current_term = new_term
+      self._state.voted_for = None
+      self._dump_state()
 
-    return cls._state.current_term
+    return self._state.current_term
 
-  @classmethod
-  def set_voted_for(cls, voted_for: Union[Address, None]) -> Union[Address, None]:
+  def set_voted_for(self, voted_for: Union[Address, None]) -> Union[Address, None]:
     """Set who the server has voted for in this curren term."""
     if voted_for is None or isinstance(voted_for, Address):
-      cls._state.voted_for = voted_for
-      cls._dump_state()
+      self._state.voted_for = voted_for
+      self._dump_state()
 
-    return cls._state.voted_for
+    return self._state.voted_for
 
-  @classmethod
-  def set_log(cls, new_entry: Entry) -> List[Entry]:
+  def set_log(self, new_entry: Entry) -> Log:
     """Set an entry at a given index. If valid, append, if conflicting,
     erasing everything past that entry."""
-    if isinstance(new_entry, Entry) and 0 < new_entry.index <= len(cls._log.log):
+    if isinstance(new_entry, Entry) and self._log.start < new_entry.index <= len(
+      self._log
+    ):
       existing_entry: Union[Entry, None] = None
 
-      if new_entry.index < len(cls._log.log):
-        existing_entry = cls._log.log[new_entry.index]
+      if new_entry.index < len(self._log):
+        existing_entry = self._log[new_entry.index]
 
       if existing_entry is None:
-        cls._log.log.append(new_entry)
-        cls._dump_log()
+        self._log.append(new_entry)
+        self._wal.append(new_entry)
       elif new_entry.term != existing_entry.term:
-        cls._log.log = cls._log.log[: new_entry.index]
-        cls._log.log.append(new_entry)
-        cls._dump_log()
+        self._log.truncate(new_entry.index)
+        self._encoded.truncate(new_entry.index)
+        self._log.append(new_entry)
+        self._wal.truncate(new_entry.index)
+        self._wal.append(new_entry)
+
+    return self._log
+
+  def extend_log(self, new_entries: List[Entry]) -> Log:
+    """Append a batch of entries, which must directly follow the last entry, to
+    the log in a single call."""
+    if all(
+      isinstance(entry, Entry) and entry.index == len(self._log) + i
+      for i, entry in enumerate(new_entries)
+    ):
+      self._log.extend(new_entries)
+      for entry in new_entries:
+        self._wal.append(entry)
+
+    return self._log
+
+  def take_snapshot(self, index: NonNegativeInt, term: NonNegativeInt) -> Snapshot:
+    """Durably snapshot the state machine, which must reflect every entry up to
+    a given index (of a given term) and no later one. Runs on the apply stage;
+    the snapshot becomes the latest one once committed (see `commit_snapshot`)."""
+    started_at = perf_counter()
+    snapshot = self.state_machine.snapshot(self._snapshots, index, term)
+    SNAPSHOT_SECONDS.observe(perf_counter() - started_at)
+
+    return snapshot
+
+  def install_snapshot(self, snapshot: Snapshot) -> Union[Snapshot, None]:
+    """Durably keep a snapshot completely received, then restore the state
+    machine from it, record by record. Runs on the apply stage; the snapshot
+    becomes the latest one once committed (see `commit_snapshot`). Returns the
+    snapshot, or nothing if it was found corrupted."""
+    started_at = perf_counter()
+
+    try:
+      self._snapshots.install(snapshot)
+    except RuntimeError:
+      return None
+
+    self.state_machine.restore(
+      self._snapshots.records(snapshot), snapshot.last_included_index
+    )
+    SNAPSHOT_RESTORE_SECONDS.observe(perf_counter() - started_at)
+
+    return snapshot
+
+  def is_dirty(self) -> StrictBool:
+    """Indicate if there are mutations not yet being made durable."""
+    return self._wal.is_dirty()
+
+  def sync(self) -> None:
+    """Make every mutation since the last sync durable with a single fsync."""
+    self.sync_deferred()()
+
+  def sync_deferred(self) -> Callable[[], None]:
+    """Prepare a sync of every mutation so far, returning the blocking part,
+    which may run on another thread while mutations go on."""
+    if not self._wal.is_dirty():
+      return self._wal.sync_deferred()
+
+    started_at = perf_counter()
+    fsync = self._wal.sync_deferred()
+    WAL_WRITE_SECONDS.observe(perf_counter() - started_at)
+
+    def timed_fsync() -> None:
+      started_at = perf_counter()
+      fsync()
+      FSYNC_SECONDS.observe(perf_counter() - started_at)
 
-    return cls._log.log
+    return timed_fsync
@@ -0,0 +1,221 @@
+"""Defines a write-ahead log shared by the Raft groups of a host (see `multi`), so
+that the mutations every group made in a tick are made durable by a single fsync
+rather than one per group.
+
+Records are framed as in the write-ahead log of a single server, their payload
+starting with the group they belong to. The groups share the tail segment, so a
+group cannot cut the log where its entries conflict: truncating or restarting
+the log of a group appends a marker record instead, which replay applies in
+order. A segment is deleted once no group needs the entries it holds, and every
+new segment begins with the latest state record of each group."""
+
+from array import array
+from os import remove
+from struct import Struct
+from typing import Callable, Dict, List, Union
+
+from pydantic import BaseModel, Extra, NonNegativeInt, StrictBool
+
+from . import Entry
+from .wal import (
+  RECORD_ENTRY,
+  RECORD_STATE,
+  _SegmentedLog,
+  _decode,
+  _encode,
+  _frame,
+)
+
+RECORD_TRUNCATE: int = 3
+RECORD_RESET: int = 4
+
+# group, record kind
+_GROUP_KIND = Struct("<IB")
+# index the log of the group is truncated from, or restarted at
+_INDEX = Struct("<Q")
+
+
+def _frame_state(group: NonNegativeInt, state: bytes) -> bytes:
+  """Frame the state record of a group."""
+  return _frame(_GROUP_KIND.pack(group, RECORD_STATE) + state)
+
+
+class _Replayed:
+  """Log of a group as read back from disk."""
+
+  def __init__(self) -> None:
+    self.first_index: NonNegativeInt = 0
+    self.entries: List[Entry] = []
+    self.entry_segment = array("Q")
+    self.state: Union[bytes, None] = None
+
+  def append(self, entry: Entry, segment: NonNegativeInt) -> None:
+    """Append an entry, read from a segment."""
+    # a log restarted after a snapshot may follow leftover older segments
+    if self.entries and entry.index != self.entries[-1].index + 1:
+      self.reset(entry.index)
+    if not self.entries:
+      self.first_index = entry.index
+    self.entries.append(entry)
+    self.entry_segment.append(segment)
+
+  def reset(self, index: NonNegativeInt) -> None:
+    """Forget every entry, restarting the log with the entry at a given index."""
+    self.first_index = index
+    self.entries.clear()
+    del self.entry_segment[:]
+
+  def truncate(self, index: NonNegativeInt) -> None:
+    """Forget the entry at a given index and everything after it."""
+    if self.first_index <= index < self.first_index + len(self.entries):
+      del self.entries[index - self.first_index :]
+      del self.entry_segment[index - self.first_index :]
+
+
+class SharedWriteAheadLog(_SegmentedLog):
+  """Segmented write-ahead log of group-tagged records, read and written through
+  the log of each group."""
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._groups: Dict[NonNegativeInt, "GroupWriteAheadLog"] = {}
+    # logs read back from disk, by group, until the group replays its own
+    self._replayed: Union[Dict[NonNegativeInt, _Replayed], None] = None
+
+  def _collect(self) -> None:
+    """Delete every segment older than the oldest one holding entries kept by a
+    group (the state records are rewritten into every new segment)."""
+    needed = min(
+      (
+        log._entry_segment[0]
+        for log in self._groups.values()
+        if len(log._entry_segment) > 0
+      ),
+      default=self._segments[-1],
+    )
+
+    while self._segments[0] < needed:
+      remove(self._path(self._segments.pop(0)))
+      self._dirty_directory = True
+
+  def _replay(self) -> Dict[NonNegativeInt, _Replayed]:
+    """Read every record back from disk once, then open the log for appending."""
+    if self._replayed is None:
+      self._replayed = {}
+
+      for segment, offset, payload in self._read_segments():
+        group, kind = _GROUP_KIND.unpack_from(payload)
+        replayed = self._replayed.setdefault(group, _Replayed())
+
+        if kind == RECORD_ENTRY:
+          replayed.append(_decode(payload, _GROUP_KIND.size), segment)
+        elif kind == RECORD_STATE:
+          replayed.state = payload[_GROUP_KIND.size :]
+        elif kind == RECORD_TRUNCATE:
+          replayed.truncate(_INDEX.unpack_from(payload, _GROUP_KIND.size)[0])
+        else:
+          replayed.reset(_INDEX.unpack_from(payload, _GROUP_KIND.size)[0])
+
+      self._open_tail()
+
+    return self._replayed
+
+  def _write_states(self) -> None:
+    for group, log in self._groups.items():
+      if log.state is not None:
+        self._fp.write(_frame_state(group, log.state))
+
+  def group(self, group: NonNegativeInt) -> "GroupWriteAheadLog":
+    """Return the log of a group, to be replayed before it is written to."""
+    if group not in self._groups:
+      self._groups[group] = GroupWriteAheadLog(shared=self, group=group)
+
+    return self._groups[group]
+
+
+class GroupWriteAheadLog(BaseModel):
+  """Log of one group within a shared write-ahead log. Syncing makes the writes
+  of every group durable: once one group has prepared a sync, the others find
+  nothing left to sync, so every fsync prepared must be done before any group
+  goes on as if its writes were durable."""
+
+  shared: SharedWriteAheadLog
+  group: NonNegativeInt
+
+  class Config:
+    arbitrary_types_allowed = True
+    copy_on_model_validation = "none"
+    extra = Extra.allow
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    # segment holding every entry on disk, starting from the entry at the first
+    # index
+    self._first_index: NonNegativeInt = 0
+    self._entry_segment = array("Q")
+    # latest state record, rewritten into every new segment
+    self.state: Union[bytes, None] = None
+
+  def _write(self, kind: int, body: bytes) -> NonNegativeInt:
+    """Append a record of this group, returning the segment holding it."""
+    return self.shared._write(_GROUP_KIND.pack(self.group, kind) + body)[0]
+
+  def replay(self) -> List[Entry]:
+    """Return every entry of this group read back from disk."""
+    replayed = self.shared._replay().pop(self.group, _Replayed())
+    self._first_index = replayed.first_index
+    self._entry_segment = replayed.entry_segment
+    self.state = replayed.state
+
+    return replayed.entries
+
+  def append(self, entry: Entry) -> None:
+    """Append an entry to the tail of the log."""
+    assert entry.index == self._first_index + len(self._entry_segment)
+    self._entry_segment.append(self._write(RECORD_ENTRY, _encode(entry)))
+
+  def compact(self, index: NonNegativeInt) -> None:
+    """Forget every entry before a given index, down to the first one of its
+    segment, deleting the segments no group needs any more."""
+    if self._first_index < index < self._first_index + len(self._entry_segment):
+      segment = self._entry_segment[index - self._first_index]
+
+      # the first entry kept is the first one of the oldest segment left
+      kept = self._entry_segment.index(segment)
+      del self._entry_segment[:kept]
+      self._first_index += kept
+      self.shared._collect()
+
+  def reset(self, index: NonNegativeInt) -> None:
+    """Forget every entry, restarting the log with the entry at a given index."""
+    self._write(RECORD_RESET, _INDEX.pack(index))
+    self._first_index = index
+    del self._entry_segment[:]
+
+    # the marker must be durable before the entries it erases may go
+    self.shared.sync()
+    self.shared._collect()
+
+  def set_state(self, state: bytes) -> None:
+    """Append a state record, superseding any previous one."""
+    self.state = state
+    self._write(RECORD_STATE, state)
+
+  def truncate(self, index: NonNegativeInt) -> None:
+    """Erase the entry at a given index and everything after it."""
+    if self._first_index <= index < self._first_index + len(self._entry_segment):
+      self._write(RECORD_TRUNCATE, _INDEX.pack(index))
+      del self._entry_segment[index - self._first_index :]
+
+  def is_dirty(self) -> StrictBool:
+    """Indicate if there are writes of any group not yet being made durable."""
+    return self.shared.is_dirty()
+
+  def sync(self) -> None:
+    """Make every write of every group durable with a single fsync."""
+    self.shared.sync()
+
+  def sync_deferred(self) -> Callable[[], None]:
+    """Prepare a sync of every write of every group so far, returning the fsync
+    itself."""
+    return self.shared.sync_deferred()
@@ -0,0 +1,348 @@
+"""Defines a key-value state machine kept on disk, so that the dataset is bounded
+by the disk rather than by the memory of the process. It is a log-structured
+store: every value set is appended to the tail of a segmented log, framed as in
+the write-ahead log, and an index held in memory maps every key to where its
+latest value lies. Only the keys are held in memory, along with a sorted copy of
+them for ordered range scans; values are read back through a record cache
+bounded in bytes, which evicts the least recently used ones.
+
+Setting a key leaves its previous value behind as garbage. Once most of a sealed
+segment is garbage, its live values are appended anew and the segment deleted.
+Compaction runs after a batch is applied, on the apply stage, away from the loop
+handling RPCs.
+
+The last index of every batch applied is recorded after its values, so that a
+restart resumes applying past it rather than from the latest snapshot. Records
+are those of snapshots (see `snapshot`): taking one seals the tail segment and
+links every segment into it, without reading back a single value. Writes
+are only synced as segments fill up, or before values lose their older copies:
+a store losing its tail in a crash reads back as of an earlier batch, and the
+entries past it are applied again."""
+
+from bisect import bisect_left
+from collections import OrderedDict
+from os import O_RDONLY, close, open as os_open, pread, remove
+from struct import Struct
+from threading import Lock
+from typing import Dict, Iterable, List, Tuple, Union
+
+from pydantic import NonNegativeInt
+from utils.metrics import Counter
+
+from . import LogView, Snapshot, SnapshotStore, StateMachine
+from .snapshot import RECORD_SET, _SET
+from .wal import _HEADER, _SegmentedLog, _frame
+
+RECORD_CACHE_MAX_BYTES: int = 16 * 1024 * 1024  # bytes
+COMPACTION_MAX_LIVE_RATIO: float = 0.5  # of the bytes of a sealed segment
+
+RECORD_APPLIED: int = 2
+
+# record kind, index of the last entry applied
+_APPLIED = Struct("<BQ")
+
+RECORD_CACHE_LOOKUPS = Counter(
+  "raft_record_cache_lookups_total",
+  "Values looked up in the record cache, by whether they were cached.",
+  ("result",),
+)
+
+
+def _locate(segment: NonNegativeInt, offset: int, length: int) -> int:
+  """Pack the segment, byte offset and length of a value into a single integer,
+  which takes less memory per key than a tuple."""
+  return segment << 64 | offset << 32 | length
+
+
+def _unlocate(location: int) -> Tuple[NonNegativeInt, int, int]:
+  """Unpack the segment, byte offset and length of a value."""
+  return location >> 64, location >> 32 & 0xFFFFFFFF, location & 0xFFFFFFFF
+
+
+def _record_size(key_length: int, value_length: int) -> int:
+  """Return the bytes taken on disk by the record setting a value."""
+  return _HEADER.size + _SET.size + key_length + value_length
+
+
+class RecordCache:
+  """Values by key, bounded in bytes, evicting the least recently used ones."""
+
+  def __init__(self, max_bytes: int = RECORD_CACHE_MAX_BYTES) -> None:
+    self.max_bytes = max_bytes
+    self._values: "OrderedDict[str, str]" = OrderedDict()
+    self._size = 0
+
+  def __contains__(self, key: str) -> bool:
+    return key in self._values
+
+  def __len__(self) -> int:
+    return len(self._values)
+
+  def clear(self) -> None:
+    """Evict every value."""
+    self._values = OrderedDict()
+    self._size = 0
+
+  def get(self, key: str) -> Union[str, None]:
+    """Fetch the value of a key, if it is cached, as the most recently used."""
+    value = self._values.get(key)
+
+    if value is not None:
+      self._values.move_to_end(key)
+
+    return value
+
+  def put(self, key: str, value: str) -> None:
+    """Cache the value of a key, evicting the least recently used ones past the
+    bound."""
+    previous = self._values.pop(key, None)
+    if previous is not None:
+      self._size -= len(key) + len(previous)
+    self._values[key] = value
+    self._size += len(key) + len(value)
+
+    while self._size > self.max_bytes and len(self._values) > 1:
+      evicted, value = self._values.popitem(last=False)
+      self._size -= len(evicted) + len(value)
+
+
+class DiskStateMachine(StateMachine, _SegmentedLog):
+  """Key-value state machine kept in a log-structured store. Batches are applied
+  on the apply stage while values are read on the loop handling RPCs, so every
+  access to the store holds a lock, released between two values set."""
+
+  cache_max_bytes: NonNegativeInt = RECORD_CACHE_MAX_BYTES
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._lock = Lock()
+    self._cache = RecordCache(self.cache_max_bytes)
+    # location of the latest value of every key (see `_locate`)
+    self._index: Dict[str, int] = {}
+    # every key in order, but for those first set since the last scan
+    self._sorted: List[str] = []
+    self._unsorted: List[str] = []
+    # bytes written to every segment, and those of the values still live
+    self._sizes: Dict[NonNegativeInt, int] = {}
+    self._live: Dict[NonNegativeInt, int] = {}
+    # file descriptors values are read back through, by segment
+    self._readers: Dict[NonNegativeInt, int] = {}
+    self._applied: NonNegativeInt = 0
+
+    self._replay()
+
+  def _compact(self) -> None:
+    """Rewrite the live values of the sealed segment holding the least of them,
+    if they fall short of the share kept, then delete the segment."""
+    sealed = [
+      segment
+      for segment in self._segments[:-1]
+      if self._live.get(segment, 0)
+      < self._sizes.get(segment, 0) * COMPACTION_MAX_LIVE_RATIO
+    ]
+
+    if not sealed:
+      return
+
+    segment = min(
+      sealed, key=lambda segment: self._live.get(segment, 0) / self._sizes[segment]
+    )
+    records, _ = self._read_segment(segment)
+
+    for offset, payload in records:
+      kind, key_length = _SET.unpack_from(payload)
+      if kind != RECORD_SET:
+        continue
+
+      key = payload[_SET.size : _SET.size + key_length]
+      with self._lock:
+        location = self._index.get(key.decode())
+        start = offset + _HEADER.size + _SET.size + key_length
+        # values set anew since are garbage already
+        if location is not None and _unlocate(location)[:2] == (segment, start):
+          self._set(key, payload[_SET.size + key_length :])
+
+    # the values copied must be durable before the segment holding them goes
+    self.sync()
+
+    with self._lock:
+      self._segments.remove(segment)
+      if segment in self._readers:
+        close(self._readers.pop(segment))
+      remove(self._path(segment))
+      self._sizes.pop(segment, None)
+      self._live.pop(segment, None)
+      self._dirty_directory = True
+
+  def _index_set(
+    self,
+    key: str,
+    segment: NonNegativeInt,
+    offset: int,
+    key_length: int,
+    value_length: int,
+  ) -> None:
+    """Point a key to its latest value, the previous one becoming garbage."""
+    previous = self._index.get(key)
+
+    if previous is None:
+      self._unsorted.append(key)
+    else:
+      previous_segment, _, previous_length = _unlocate(previous)
+      self._live[previous_segment] -= _record_size(key_length, previous_length)
+
+    self._index[key] = _locate(segment, offset, value_length)
+    self._live[segment] = self._live.get(segment, 0) + _record_size(
+      key_length, value_length
+    )
+
+  def _read(self, segment: NonNegativeInt, offset: int, length: int) -> bytes:
+    """Read a value back from disk."""
+    # values set lately may still be buffered
+    if segment == self._segments[-1]:
+      self._fp.flush()
+
+    if segment not in self._readers:
+      self._readers[segment] = os_open(self._path(segment), O_RDONLY)
+
+    return pread(self._readers[segment], length, offset)
+
+  def _replay(self) -> None:
+    """Rebuild the index from every record on disk, then open the store for
+    appending. A torn record at the end of the tail segment is discarded."""
+    for segment, offset, payload in self._read_segments():
+      size = _HEADER.size + len(payload)
+      self._sizes[segment] = self._sizes.get(segment, 0) + size
+      kind, key_length = _SET.unpack_from(payload)
+
+      if kind == RECORD_SET:
+        start = _SET.size + key_length
+        self._index_set(
+          payload[_SET.size : start].decode(),
+          segment,
+          offset + _HEADER.size + start,
+          key_length,
+          len(payload) - start,
+        )
+      else:
+        self._applied = _APPLIED.unpack_from(payload)[1]
+
+    self._open_tail()
+
+  def _set(self, key: bytes, value: bytes) -> None:
+    """Append the value of a key to the tail segment."""
+    segment, offset = self._write(_SET.pack(RECORD_SET, len(key)) + key + value)
+    size = _record_size(len(key), len(value))
+    self._sizes[segment] = self._sizes.get(segment, 0) + size
+
+    start = offset + _HEADER.size + _SET.size + len(key)
+    decoded = key.decode()
+    self._index_set(decoded, segment, start, len(key), len(value))
+
+    if decoded in self._cache:
+      self._cache.put(decoded, value.decode())
+
+  def _write_applied(self) -> None:
+    """Append the index of the last entry applied to the tail segment."""
+    record = _frame(_APPLIED.pack(RECORD_APPLIED, self._applied))
+    self._fp.write(record)
+    self._dirty = True
+
+    tail = self._segments[-1]
+    self._sizes[tail] = self._sizes.get(tail, 0) + len(record)
+
+  def _write_states(self) -> None:
+    self._write_applied()
+
+  def apply(self, entries: LogView) -> None:
+    # keys and values are written as encoded in the log
+    for _, _, key, value in entries.columns():
+      if key:
+        with self._lock:
+          self._set(key, value)
+
+    with self._lock:
+      self._applied = entries.start + len(entries) - 1
+      self._write_applied()
+      self._fp.flush()
+
+    self._compact()
+
+  def get(self, key: str) -> Union[str, None]:
+    with self._lock:
+      value = self._cache.get(key)
+
+      if value is not None:
+        RECORD_CACHE_LOOKUPS.inc("hit")
+        return value
+
+      location = self._index.get(key)
+      if location is None:
+        return None
+
+      RECORD_CACHE_LOOKUPS.inc("miss")
+      value = self._read(*_unlocate(location)).decode()
+      self._cache.put(key, value)
+
+    return value
+
+  def last_applied_index(self) -> NonNegativeInt:
+    return self._applied
+
+  def restore(
+    self, records: Iterable[Tuple[bytes, bytes]], index: NonNegativeInt
+  ) -> None:
+    """Write every key and value of a snapshot to new segments as they come,
+    then delete the old ones. Until the new segments are durable, the index
+    recorded is the one of the old store, so that a crash meanwhile restores the
+    snapshot again."""
+    with self._lock:
+      self._fp.close()
+      for fd in self._readers.values():
+        close(fd)
+      segments, self._segments = self._segments, [self._segments[-1] + 1]
+      self._open_tail()
+      self._dirty_directory = True
+
+      self._cache.clear()
+      self._index, self._sorted, self._unsorted = {}, [], []
+      self._sizes, self._live, self._readers = {}, {}, {}
+
+    for key, value in records:
+      with self._lock:
+        self._set(key, value)
+
+    with self._lock:
+      self._applied = index
+      self._write_applied()
+      self.sync()
+
+      for segment in segments:
+        remove(self._path(segment))
+      self._dirty_directory = True
+
+  def scan(self, start: str, end: Union[str, None] = None) -> List[Tuple[str, str]]:
+    with self._lock:
+      if self._unsorted:
+        # sorting a sorted run followed by a short one is about linear
+        self._sorted = sorted(self._sorted + self._unsorted)
+        self._unsorted = []
+
+      upper = len(self._sorted) if end is None else bisect_left(self._sorted, end)
+      keys = self._sorted[bisect_left(self._sorted, start) : upper]
+
+    # keys are only ever removed by restoring a snapshot, which a server serving
+    # scans (the leader) does not do
+    return [(key, self.get(key)) for key in keys]
+
+  def snapshot(
+    self, snapshots: SnapshotStore, index: NonNegativeInt, term: NonNegativeInt
+  ) -> Snapshot:
+    """Seal the tail segment, then link every segment into the snapshot: they
+    hold the records of every entry applied, which the snapshot reads as they
+    are, and sealed segments never change (compaction deletes them whole)."""
+    with self._lock:
+      self._roll_over()
+      paths = [self._path(segment) for segment in self._segments[:-1]]
+
+    return snapshots.link(index, term, paths)
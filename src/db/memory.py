@@ -0,0 +1,103 @@
+"""Defines in-memory stand-ins for the write-ahead log and the snapshot store,
+so that several servers can share a process (as in the simulator) without
+touching the disk. Nothing they hold outlives the process; syncing does no more
+than clear the dirty flag."""
+
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+
+from pydantic import BaseModel, Extra, NonNegativeInt, StrictBool
+
+from . import Entry, SnapshotStore
+
+
+class MemoryWriteAheadLog(BaseModel):
+  """Write-ahead log keeping its entries and state in memory."""
+
+  class Config:
+    extra = Extra.allow
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._entries: List[Entry] = []
+    self.state: Union[bytes, None] = None
+    self._dirty = False
+
+  def replay(self) -> List[Entry]:
+    """Return every entry kept."""
+    return list(self._entries)
+
+  def append(self, entry: Entry) -> None:
+    """Append an entry to the tail of the log."""
+    self._entries.append(entry)
+    self._dirty = True
+
+  def compact(self, index: NonNegativeInt) -> None:
+    """Forget every entry before a given index."""
+    self._entries = [entry for entry in self._entries if entry.index >= index]
+
+  def reset(self, index: NonNegativeInt) -> None:
+    """Forget every entry, restarting the log with the entry at a given index."""
+    self._entries = []
+    self._dirty = True
+
+  def set_state(self, state: bytes) -> None:
+    """Keep a state, superseding any previous one."""
+    self.state = state
+    self._dirty = True
+
+  def truncate(self, index: NonNegativeInt) -> None:
+    """Erase the entry at a given index and everything after it."""
+    self._entries = [entry for entry in self._entries if entry.index < index]
+    self._dirty = True
+
+  def is_dirty(self) -> StrictBool:
+    """Indicate if there are writes not yet synced."""
+    return self._dirty
+
+  def sync(self) -> None:
+    """Mark every write as synced."""
+    self.sync_deferred()()
+
+  def sync_deferred(self) -> Callable[[], None]:
+    """Mark every write as synced, returning nothing left to do."""
+    self._dirty = False
+    return lambda: None
+
+
+class MemorySnapshotStore(SnapshotStore):
+  """Snapshot store keeping its snapshot files in memory."""
+
+  directory: Union[Path, None] = None
+
+  def _link(self, source: Path, name: str) -> None:
+    self._files[name] = bytearray(source.read_bytes())
+
+  def _names(self) -> List[str]:
+    return list(self._files)
+
+  def _open(self) -> None:
+    self._files: Dict[str, bytearray] = {}
+
+  def _read(
+    self, name: str, offset: NonNegativeInt = 0, size: int = -1
+  ) -> Union[bytes, None]:
+    if name not in self._files:
+      return None
+
+    data = self._files[name]
+    return bytes(data[offset:] if size < 0 else data[offset : offset + size])
+
+  def _remove(self, name: str) -> None:
+    self._files.pop(name, None)
+
+  def _replace(self, source: str, target: str) -> None:
+    self._files[target] = self._files.pop(source)
+
+  def _sync(self, name: str) -> None:
+    pass
+
+  def _write(self, name: str, data: bytes, append: StrictBool = False) -> None:
+    if not append or name not in self._files:
+      self._files[name] = bytearray()
+    self._files[name] += data
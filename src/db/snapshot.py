@@ -0,0 +1,366 @@
+"""Defines snapshots of the database, which replace the prefix of the log they
+cover. The payload of a snapshot is a sequence of records setting keys to
+values, framed as in the write-ahead log, a later record for a key superseding
+an earlier one: those are the very records of the segments of the disk store
+(see `kv`), which are linked into a snapshot as they are rather than read back.
+
+The payload is held by one or more part files, listed by a metadata file along
+with the last included index and term. The metadata file is replaced last, so
+that a crash leaves the previous snapshot whole. Records are streamed to and
+from the parts a chunk at a time, so a snapshot is never held in memory. The
+payload is sent to followers byte for byte, every record carrying its own
+checksum."""
+
+from os import O_RDONLY, close, fsync, link, listdir, open as os_open, replace
+from pathlib import Path
+from shutil import copyfile
+from struct import Struct
+from typing import Iterable, Iterator, List, Tuple, Union
+from zlib import crc32
+
+from pydantic import BaseModel, Extra, NonNegativeInt, StrictBool
+
+from .wal import _HEADER, _frame
+
+SNAPSHOT_NAME: str = "snapshot.meta"
+SNAPSHOT_INCOMING_NAME: str = "snapshot.incoming"
+SNAPSHOT_TEMPORARY_NAME: str = "snapshot.tmp"
+SNAPSHOT_PART_SUFFIX: str = ".part"
+SNAPSHOT_IO_BYTES: int = 1024 * 1024  # bytes read or written at once
+
+RECORD_SET: int = 1
+
+# last included index, last included term, payload size, number of parts
+_META = Struct("<QQQI")
+# part size
+_PART = Struct("<Q")
+# record kind, key length
+_SET = Struct("<BI")
+
+
+def _part_name(index: NonNegativeInt, part: NonNegativeInt) -> str:
+  """Return the name of a part of the snapshot taken at an index."""
+  return f"{index:020d}-{part:04d}{SNAPSHOT_PART_SUFFIX}"
+
+
+class Snapshot(BaseModel):
+  """Snapshot metadata, along with the name and size of every part holding its
+  payload, in order."""
+
+  last_included_index: NonNegativeInt
+  last_included_term: NonNegativeInt
+  size: NonNegativeInt
+  parts: List[Tuple[str, NonNegativeInt]] = []
+
+
+class SnapshotStore(BaseModel):
+  """Stores the latest snapshot, and the one being received from the leader.
+  Snapshots are written on the apply stage, but only become the latest one on
+  the loop handling RPCs (see `commit`), which reads chunks of it."""
+
+  directory: Path
+
+  class Config:
+    arbitrary_types_allowed = True
+    extra = Extra.allow
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._open()
+    self.latest: Union[Snapshot, None] = self._read_meta(SNAPSHOT_NAME)
+    # snapshot being received, and how many of its bytes were received so far
+    self._incoming: Union[Snapshot, None] = None
+    self._incoming_offset: NonNegativeInt = 0
+
+    # parts of snapshots a crash left behind
+    kept = {name for name, _ in self.latest.parts} if self.latest else set()
+    for name in self._names():
+      if name.endswith(SNAPSHOT_PART_SUFFIX) and name not in kept:
+        self._remove(name)
+
+  def _fsync_directory(self) -> None:
+    """Make renames within the directory durable."""
+    fd = os_open(self.directory, O_RDONLY)
+    try:
+      fsync(fd)
+    finally:
+      close(fd)
+
+  def _link(self, source: Path, name: str) -> None:
+    """Hard-link a file into a snapshot file, copying it if it cannot be linked
+    (as across file systems)."""
+    self._remove(name)
+
+    try:
+      link(source, self.directory / name)
+    except OSError:
+      copyfile(source, self.directory / name)
+
+  def _names(self) -> List[str]:
+    """Return the name of every snapshot file."""
+    return listdir(self.directory)
+
+  def _open(self) -> None:
+    """Prepare the storage of the snapshot files."""
+    self.directory.mkdir(parents=True, exist_ok=True)
+
+  def _read(
+    self, name: str, offset: NonNegativeInt = 0, size: int = -1
+  ) -> Union[bytes, None]:
+    """Read a range of a snapshot file (all of it by default), if it exists."""
+    path = self.directory / name
+
+    if not path.exists():
+      return None
+
+    with open(path, mode="rb") as fp:
+      fp.seek(offset)
+      return fp.read(size)
+
+  def _read_meta(self, name: str) -> Union[Snapshot, None]:
+    """Read a snapshot metadata file, if it exists."""
+    data = self._read(name)
+
+    if data is None:
+      return None
+
+    index, term, size, count = _META.unpack_from(data)
+    sizes = [
+      _PART.unpack_from(data, _META.size + i * _PART.size)[0] for i in range(count)
+    ]
+
+    return Snapshot(
+      last_included_index=index,
+      last_included_term=term,
+      size=size,
+      parts=[(_part_name(index, i), part) for i, part in enumerate(sizes)],
+    )
+
+  def _remove(self, name: str) -> None:
+    """Delete a snapshot file, if it exists."""
+    path = self.directory / name
+
+    if path.exists():
+      path.unlink()
+
+  def _replace(self, source: str, target: str) -> None:
+    """Durably make a completely written snapshot file replace another one."""
+    self._sync(source)
+    replace(self.directory / source, self.directory / target)
+    self._fsync_directory()
+
+  def _sync(self, name: str) -> None:
+    """Make the content of a snapshot file durable."""
+    with open(self.directory / name, mode="rb+") as fp:
+      fsync(fp.fileno())
+
+  def _write(self, name: str, data: bytes, append: StrictBool = False) -> None:
+    """Write to a snapshot file, appending to or else replacing its content."""
+    with open(self.directory / name, mode="ab" if append else "wb") as fp:
+      fp.write(data)
+
+  def _write_meta(self, snapshot: Snapshot) -> None:
+    """Durably write the metadata of a snapshot whose parts are durable, which
+    then survives a restart as the latest one."""
+    data = _META.pack(
+      snapshot.last_included_index,
+      snapshot.last_included_term,
+      snapshot.size,
+      len(snapshot.parts),
+    ) + b"".join(_PART.pack(size) for _, size in snapshot.parts)
+
+    self._write(SNAPSHOT_TEMPORARY_NAME, data)
+    # also makes the names of new parts durable
+    self._replace(SNAPSHOT_TEMPORARY_NAME, SNAPSHOT_NAME)
+
+  def commit(self, snapshot: Snapshot) -> None:
+    """Make a durable snapshot (taken or installed) the latest one, deleting the
+    parts of the previous one."""
+    previous, self.latest = self.latest, snapshot
+
+    if previous is not None:
+      kept = {name for name, _ in snapshot.parts}
+      for name, _ in previous.parts:
+        if name not in kept:
+          self._remove(name)
+
+  def install(self, snapshot: Snapshot) -> None:
+    """Durably keep a snapshot completely received (see `received`), once every
+    record of it is verified, so that it may become the latest one. A corrupted
+    snapshot is deleted, raising RuntimeError."""
+    name, _ = snapshot.parts[0]
+    self._replace(SNAPSHOT_INCOMING_NAME, name)
+
+    try:
+      for _ in self.records(snapshot):
+        pass
+    except RuntimeError:
+      self._remove(name)
+      raise
+
+    self._write_meta(snapshot)
+
+  def link(
+    self,
+    last_included_index: NonNegativeInt,
+    last_included_term: NonNegativeInt,
+    paths: List[Path],
+  ) -> Snapshot:
+    """Durably write a snapshot whose payload is a sequence of files of records,
+    which must not change anymore, linking them as they are (see `commit`)."""
+    parts: List[Tuple[str, NonNegativeInt]] = []
+
+    for i, path in enumerate(paths):
+      name = _part_name(last_included_index, i)
+      self._link(path, name)
+      parts.append((name, path.stat().st_size))
+
+    snapshot = Snapshot(
+      last_included_index=last_included_index,
+      last_included_term=last_included_term,
+      size=sum(size for _, size in parts),
+      parts=parts,
+    )
+    self._write_meta(snapshot)
+
+    return snapshot
+
+  def read(self, offset: NonNegativeInt, size: NonNegativeInt) -> bytes:
+    """Read a chunk of the payload of the latest snapshot, across its parts."""
+    chunks: List[bytes] = []
+
+    for name, part_size in self.latest.parts if self.latest else []:
+      if size <= 0:
+        break
+      if offset >= part_size:
+        offset -= part_size
+        continue
+
+      chunk = self._read(name, offset, min(size, part_size - offset)) or b""
+      chunks.append(chunk)
+      size -= len(chunk)
+      offset = 0
+
+    return b"".join(chunks)
+
+  def receive(
+    self,
+    last_included_index: NonNegativeInt,
+    last_included_term: NonNegativeInt,
+    offset: NonNegativeInt,
+    data: bytes,
+  ) -> NonNegativeInt:
+    """Write a chunk of a snapshot being received, restarting whenever a chunk
+    of another snapshot begins. Returns the offset of the next chunk expected."""
+    if offset == 0:
+      self._incoming = Snapshot(
+        last_included_index=last_included_index,
+        last_included_term=last_included_term,
+        size=0,
+      )
+      self._incoming_offset = 0
+      self._write(SNAPSHOT_INCOMING_NAME, b"")
+    elif (
+      self._incoming is None
+      or self._incoming.last_included_index != last_included_index
+    ):
+      return 0
+    elif offset != self._incoming_offset:
+      return self._incoming_offset
+
+    self._write(SNAPSHOT_INCOMING_NAME, data, append=True)
+    self._incoming_offset += len(data)
+
+    return self._incoming_offset
+
+  def received(self) -> Snapshot:
+    """Return the snapshot completely received, to be installed (see `install`)
+    before any other is received."""
+    assert self._incoming is not None
+    index = self._incoming.last_included_index
+    snapshot = Snapshot(
+      last_included_index=index,
+      last_included_term=self._incoming.last_included_term,
+      size=self._incoming_offset,
+      parts=[(_part_name(index, 0), self._incoming_offset)],
+    )
+    self._incoming, self._incoming_offset = None, 0
+
+    return snapshot
+
+  def records(self, snapshot: Snapshot) -> Iterator[Tuple[bytes, bytes]]:
+    """Read back every key and value a snapshot sets, in order, reading its
+    parts a chunk at a time and verifying every record. Records of other kinds
+    (those the disk store keeps for itself) are skipped."""
+    for name, _ in snapshot.parts:
+      buffer, offset = b"", 0
+
+      while True:
+        chunk = self._read(name, offset, SNAPSHOT_IO_BYTES)
+        if chunk is None:
+          raise RuntimeError(f"Snapshot part {name} is missing.")
+
+        offset += len(chunk)
+        buffer += chunk
+        start = 0
+
+        while start + _HEADER.size <= len(buffer):
+          length, checksum = _HEADER.unpack_from(buffer, start)
+          end = start + _HEADER.size + length
+          if end > len(buffer):
+            break
+
+          payload = buffer[start + _HEADER.size : end]
+          if crc32(payload) != checksum:
+            raise RuntimeError(f"Snapshot part {name} is corrupted.")
+
+          kind, key_length = _SET.unpack_from(payload)
+          if kind == RECORD_SET:
+            key_end = _SET.size + key_length
+            yield payload[_SET.size : key_end], payload[key_end:]
+          start = end
+
+        buffer = buffer[start:]
+
+        if not chunk:
+          if buffer:
+            raise RuntimeError(f"Snapshot part {name} is truncated.")
+          break
+
+  def save(
+    self,
+    last_included_index: NonNegativeInt,
+    last_included_term: NonNegativeInt,
+    records: Iterable[Tuple[bytes, bytes]],
+  ) -> Snapshot:
+    """Durably write a snapshot of every key and value, streaming their records
+    to a single part a chunk at a time (see `commit`)."""
+    name = _part_name(last_included_index, 0)
+    chunk: List[bytes] = []
+    chunk_size = size = 0
+
+    self._write(name, b"")
+
+    for key, value in records:
+      record = _frame(_SET.pack(RECORD_SET, len(key)) + key + value)
+      chunk.append(record)
+      chunk_size += len(record)
+
+      if chunk_size >= SNAPSHOT_IO_BYTES:
+        self._write(name, b"".join(chunk), append=True)
+        size += chunk_size
+        chunk, chunk_size = [], 0
+
+    self._write(name, b"".join(chunk), append=True)
+    size += chunk_size
+    self._sync(name)
+
+    snapshot = Snapshot(
+      last_included_index=last_included_index,
+      last_included_term=last_included_term,
+      size=size,
+      parts=[(name, size)],
+    )
+    self._write_meta(snapshot)
+
+    return snapshot
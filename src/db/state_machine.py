@@ -0,0 +1,98 @@
+"""Defines the state machine committed entries are applied to. Entries are
+applied in batches, in log order, and the state machine is captured whole by
+snapshots: the snapshot taken at an index is the checkpoint of the state machine
+up to it, so that a restart only applies the entries past the latest one. A
+state machine persisting itself (see `kv`) checkpoints every batch instead, and
+a restart only applies the entries past the last one it holds.
+
+Snapshots are taken and restored on the apply stage, between two batches, as
+streams of records: neither the state machine nor the snapshot is ever copied
+whole into memory."""
+
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from pydantic import BaseModel, Extra, NonNegativeInt
+
+from . import LogView, Snapshot, SnapshotStore
+
+
+class StateMachine(BaseModel):
+  """State machine of a server, which only the apply stage mutates."""
+
+  class Config:
+    arbitrary_types_allowed = True
+    extra = Extra.allow
+
+  def apply(self, entries: LogView) -> None:
+    """Apply a batch of committed entries, in order, given as a view of the log:
+    iterating it builds the entries, its columns are read without building any.
+    Entries with an empty key (the first entry, leader no-ops) are not
+    commands."""
+    raise NotImplementedError
+
+  def get(self, key: str) -> Union[str, None]:
+    """Return the value of a key, if it is set."""
+    raise NotImplementedError
+
+  def last_applied_index(self) -> NonNegativeInt:
+    """Return the index of the last entry the state machine holds across
+    restarts, 0 if it does not outlive the process."""
+    return 0
+
+  def records(self) -> Iterator[Tuple[bytes, bytes]]:
+    """Yield every key and its value, encoded, for a snapshot (see `snapshot`)."""
+    raise NotImplementedError
+
+  def restore(
+    self, records: Iterable[Tuple[bytes, bytes]], index: NonNegativeInt
+  ) -> None:
+    """Replace every key and value with those a snapshot taken at an index sets,
+    read as they come, a later record for a key superseding an earlier one."""
+    raise NotImplementedError
+
+  def scan(self, start: str, end: Union[str, None] = None) -> List[Tuple[str, str]]:
+    """Return every key from a start key up to an end key (excluded, or up to the
+    last key if there is none) along with its value, in key order."""
+    raise NotImplementedError
+
+  def snapshot(
+    self, snapshots: SnapshotStore, index: NonNegativeInt, term: NonNegativeInt
+  ) -> Snapshot:
+    """Durably write a snapshot of the state machine, which must reflect every
+    entry up to an index and no later one, streaming its records to the store."""
+    return snapshots.save(index, term, self.records())
+
+
+class MemoryStateMachine(StateMachine):
+  """Key-value state machine held in a dictionary."""
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._db: Dict[str, str] = {}
+
+  def apply(self, entries: LogView) -> None:
+    for _, _, key, value in entries.columns():
+      if key:
+        self._db[key.decode()] = value.decode()
+
+  def get(self, key: str) -> Union[str, None]:
+    return self._db.get(key)
+
+  def records(self) -> Iterator[Tuple[bytes, bytes]]:
+    for key, value in self._db.items():
+      yield key.encode(), value.encode()
+
+  def restore(
+    self, records: Iterable[Tuple[bytes, bytes]], index: NonNegativeInt
+  ) -> None:
+    # swapped in once whole
+    db: Dict[str, str] = {}
+    for key, value in records:
+      db[key.decode()] = value.decode()
+    self._db = db
+
+  def scan(self, start: str, end: Union[str, None] = None) -> List[Tuple[str, str]]:
+    keys = sorted(self._db)
+    upper = len(keys) if end is None else bisect_left(keys, end)
+    return [(key, self._db[key]) for key in keys[bisect_left(keys, start) : upper]]
@@ -0,0 +1,314 @@
+"""Defines a segmented, append-only write-ahead log for persisting log entries.
+
+Every record is framed as a little-endian header holding the payload length and
+its CRC32 checksum, followed by the payload itself. Records are appended to the
+tail segment until it reaches its size limit, at which point a new segment is
+started. Truncating conflicting entries only ever cuts the tail of the log, and
+compacting entries covered by a snapshot only ever deletes whole segments.
+
+Besides entries, the log also carries opaque state records (the current term
+and vote) so that a single fsync makes every mutation of a tick durable."""
+
+from array import array
+from os import O_RDONLY, close, dup, fsync, listdir, open as os_open, remove
+from pathlib import Path
+from struct import Struct
+from typing import Callable, Iterator, List, Tuple, Union
+from zlib import crc32
+
+from pydantic import BaseModel, Extra, NonNegativeInt, PositiveInt
+
+from . import Entry
+
+SEGMENT_MAX_BYTES: int = 4 * 1024 * 1024  # bytes
+SEGMENT_SUFFIX: str = ".wal"
+
+RECORD_ENTRY: int = 1
+RECORD_STATE: int = 2
+
+# payload length, payload checksum
+_HEADER = Struct("<II")
+# record kind
+_KIND = Struct("<B")
+# entry index, entry term, key length
+_ENTRY = Struct("<QQI")
+
+
+def _frame(payload: bytes) -> bytes:
+  """Frame a payload into a record."""
+  return _HEADER.pack(len(payload), crc32(payload)) + payload
+
+
+def _encode(entry: Entry) -> bytes:
+  """Encode an entry into the payload of a record, past its kind."""
+  key, value = entry.key.encode(), entry.value.encode()
+  return _ENTRY.pack(entry.index, entry.term, len(key)) + key + value
+
+
+def _decode(payload: bytes, offset: int) -> Entry:
+  """Decode an entry from the payload of a record, past its kind."""
+  index, term, key_length = _ENTRY.unpack_from(payload, offset)
+  key_start = offset + _ENTRY.size
+  key_end = key_start + key_length
+  return Entry(
+    index=index,
+    term=term,
+    key=payload[key_start:key_end].decode(),
+    value=payload[key_end:].decode(),
+  )
+
+
+class _SegmentedLog(BaseModel):
+  """Segments of framed records in a directory, appended to the tail one."""
+
+  directory: Path
+  segment_max_bytes: PositiveInt = SEGMENT_MAX_BYTES
+
+  class Config:
+    arbitrary_types_allowed = True
+    extra = Extra.allow
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self.directory.mkdir(parents=True, exist_ok=True)
+    # sequence numbers of every segment on disk, oldest first
+    self._segments: List[NonNegativeInt] = sorted(
+      int(name[: -len(SEGMENT_SUFFIX)])
+      for name in listdir(self.directory)
+      if name.endswith(SEGMENT_SUFFIX)
+    )
+    self._fp = None
+    # whether there are writes (or directory changes) not yet made durable
+    self._dirty = False
+    self._dirty_directory = False
+
+  def _path(self, segment: NonNegativeInt) -> Path:
+    """Return the path of a segment."""
+    return self.directory / f"{segment:08d}{SEGMENT_SUFFIX}"
+
+  def _open_tail(self) -> None:
+    """Open the tail segment for appending, creating one if necessary."""
+    if not self._segments:
+      self._segments.append(0)
+    self._fp = open(self._path(self._segments[-1]), mode="ab")
+
+  def _roll_over(self) -> None:
+    """Close the tail segment and start a new one, which begins with the latest
+    state records so that they survive older segments being removed."""
+    self._fp.flush()
+    fsync(self._fp.fileno())
+    self._fp.close()
+    self._segments.append(self._segments[-1] + 1)
+    self._fp = open(self._path(self._segments[-1]), mode="ab")
+    self._dirty_directory = True
+    self._write_states()
+
+  def _write(self, payload: bytes) -> Tuple[NonNegativeInt, int]:
+    """Append a record to the tail segment, starting a new one if it is full.
+    Returns the segment and byte offset of the record."""
+    record = _frame(payload)
+    offset = self._fp.tell()
+
+    if offset > 0 and offset + len(record) > self.segment_max_bytes:
+      self._roll_over()
+      offset = self._fp.tell()
+
+    self._fp.write(record)
+    self._dirty = True
+
+    return self._segments[-1], offset
+
+  def _write_states(self) -> None:
+    """Append the latest state records to the tail segment."""
+    raise NotImplementedError
+
+  def _read_segment(
+    self, segment: NonNegativeInt
+  ) -> Tuple[List[Tuple[int, bytes]], int]:
+    """Read all valid records of a segment, along with the length of the valid
+    prefix of the segment."""
+    with open(self._path(segment), mode="rb") as fp:
+      data = fp.read()
+
+    records: List[Tuple[int, bytes]] = []
+    offset = 0
+
+    while offset + _HEADER.size <= len(data):
+      length, checksum = _HEADER.unpack_from(data, offset)
+      start, end = offset + _HEADER.size, offset + _HEADER.size + length
+
+      if end > len(data) or crc32(data[start:end]) != checksum:
+        break
+
+      records.append((offset, data[start:end]))
+      offset = end
+
+    return records, offset
+
+  def _read_segments(self) -> Iterator[Tuple[NonNegativeInt, int, bytes]]:
+    """Read back every valid record, oldest first, along with its segment and
+    byte offset. A torn record at the end of the tail segment is discarded."""
+    for i, segment in enumerate(self._segments):
+      records, valid = self._read_segment(segment)
+
+      if valid < self._path(segment).stat().st_size:
+        if i + 1 < len(self._segments):
+          raise RuntimeError(f"Write-ahead log segment {segment} is corrupted.")
+        # drop the partially written record at the end of the log
+        with open(self._path(segment), mode="r+b") as fp:
+          fp.truncate(valid)
+
+      for offset, payload in records:
+        yield segment, offset, payload
+
+  def is_dirty(self) -> bool:
+    """Indicate if there are writes not yet being made durable."""
+    return self._dirty or self._dirty_directory
+
+  def sync(self) -> None:
+    """Make every write since the last sync durable with a single fsync."""
+    self.sync_deferred()()
+
+  def sync_deferred(self) -> Callable[[], None]:
+    """Prepare a sync of every write so far, returning the fsync itself. The
+    fsync works on its own file descriptors, so it may run on another thread
+    while writes go on (those are only made durable by a later sync)."""
+    fds: List[int] = []
+
+    if self._dirty:
+      self._fp.flush()
+      fds.append(dup(self._fp.fileno()))
+      self._dirty = False
+
+    if self._dirty_directory:
+      fds.append(os_open(self.directory, O_RDONLY))
+      self._dirty_directory = False
+
+    def fsync_all() -> None:
+      for fd in fds:
+        try:
+          fsync(fd)
+        finally:
+          close(fd)
+
+    return fsync_all
+
+
+class WriteAheadLog(_SegmentedLog):
+  """Segmented write-ahead log of framed entry and state records."""
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    # location (segment sequence number, byte offset) of every entry on disk,
+    # starting from the entry at the first index
+    self._first_index: NonNegativeInt = 0
+    self._entry_segment = array("Q")
+    self._entry_offset = array("Q")
+    # latest state record, rewritten whenever the record itself may be lost
+    self.state: Union[bytes, None] = None
+
+  def _write_state(self) -> None:
+    """Append the latest state record to the tail segment."""
+    self._fp.write(_frame(_KIND.pack(RECORD_STATE) + self.state))
+    self._dirty = True
+
+  def _write_states(self) -> None:
+    if self.state is not None:
+      self._write_state()
+
+  def replay(self) -> List[Entry]:
+    """Read every entry back from disk and open the log for appending. A torn
+    record at the end of the tail segment is discarded."""
+    entries: List[Entry] = []
+
+    for segment, offset, payload in self._read_segments():
+      if _KIND.unpack_from(payload)[0] == RECORD_STATE:
+        self.state = payload[_KIND.size :]
+      else:
+        entry = _decode(payload, _KIND.size)
+        # a log restarted after a snapshot may follow leftover older segments
+        if entries and entry.index != entries[-1].index + 1:
+          entries.clear()
+          del self._entry_segment[:]
+          del self._entry_offset[:]
+        if not entries:
+          self._first_index = entry.index
+        entries.append(entry)
+        self._entry_segment.append(segment)
+        self._entry_offset.append(offset)
+
+    self._open_tail()
+
+    return entries
+
+  def append(self, entry: Entry) -> None:
+    """Append an entry to the tail of the log."""
+    assert entry.index == self._first_index + len(self._entry_offset)
+    segment, offset = self._write(
+      _KIND.pack(RECORD_ENTRY) + _encode(entry)
+    )
+    self._entry_segment.append(segment)
+    self._entry_offset.append(offset)
+
+  def compact(self, index: NonNegativeInt) -> None:
+    """Delete every segment holding only entries before a given index."""
+    if self._first_index < index < self._first_index + len(self._entry_offset):
+      segment = self._entry_segment[index - self._first_index]
+
+      while self._segments[0] < segment:
+        remove(self._path(self._segments.pop(0)))
+        self._dirty_directory = True
+
+      # the first entry kept is the first one of the oldest segment left
+      kept = self._entry_segment.index(segment)
+      del self._entry_segment[:kept]
+      del self._entry_offset[:kept]
+      self._first_index += kept
+
+  def reset(self, index: NonNegativeInt) -> None:
+    """Delete every entry, restarting the log with the entry at a given index."""
+    self._fp.close()
+    segments, self._segments = self._segments, [self._segments[-1] + 1]
+    self._open_tail()
+
+    self._first_index = index
+    del self._entry_segment[:]
+    del self._entry_offset[:]
+
+    # the state must be durable in the new segment before the old ones go
+    if self.state is not None:
+      self._write_state()
+    self._dirty_directory = True
+    self.sync()
+
+    for segment in segments:
+      remove(self._path(segment))
+    self._dirty_directory = True
+
+  def set_state(self, state: bytes) -> None:
+    """Append a state record, superseding any previous one."""
+    self.state = state
+    self._write_state()
+
+  def truncate(self, index: NonNegativeInt) -> None:
+    """Erase the entry at a given index and everything after it."""
+    if self._first_index <= index < self._first_index + len(self._entry_offset):
+      i = index - self._first_index
+      segment, offset = self._entry_segment[i], self._entry_offset[i]
+
+      self._fp.close()
+      # whole segments past the truncation point are simply deleted
+      while self._segments[-1] > segment:
+        remove(self._path(self._segments.pop()))
+        self._dirty_directory = True
+      with open(self._path(segment), mode="r+b") as fp:
+        fp.truncate(offset)
+
+      del self._entry_segment[i:]
+      del self._entry_offset[i:]
+      self._open_tail()
+      self._dirty = True
+
+      # the latest state record may have been cut off with the entries
+      if self.state is not None:
+        self._write_state()
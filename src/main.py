@@ -1,20 +1,51 @@
 """Define server main loop here."""
 
 from argparse import ArgumentParser
+from asyncio import run
+from logging import getLogger
 from pathlib import Path
 from select import select
-from time import time
+from signal import SIGTERM, set_wakeup_fd, signal
+from socket import socket, socketpair
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Tuple, Union
 
 from orjson import loads
 
-from state import Server
-from utils import RPC, Address
+from db import (
+  RECORD_CACHE_MAX_BYTES,
+  DatabaseDriver,
+  DiskStateMachine,
+  MemoryStateMachine,
+  StateMachine,
+)
+from multi import MultiRaftHost
+from rpc import Codec
+from runtime import AsyncioRuntime
+from state import (
+  APPEND_ENTRIES_MAX_BYTES,
+  APPEND_ENTRIES_MAX_ENTRIES,
+  CLIENT_BATCH_LINGER,
+  CLIENT_BATCH_SIZE,
+  LOOP_ITERATION_SECONDS,
+  PIPELINE_WINDOW,
+  LEARNER_MAX_LAG,
+  SNAPSHOT_THRESHOLD,
+  TIMEOUT_LOWER_BOUND,
+  Server,
+)
+from transport import TCPTransport, UDPTransport
+from utils import LOG_RATE_LIMIT, Address, configure_logging, serve_metrics
+
+logger = getLogger(__name__)
 
 ###############################################################################
 # SET UP ARGUMENT PARSER
 ###############################################################################
 
-# ./main.py PORT
+# ./main.py --port PORT [--transport {udp,tcp}] [--codec {binary,json}]
+#           [--runtime {select,asyncio}] [--log-level {debug,info,warning,error}]
+#           [--metrics-port PORT]
 parser = ArgumentParser(description="Raft server.")
 
 parser.add_argument(
@@ -23,6 +54,35 @@ parser.add_argument(
   required=True,
   help="server port number",
 )
+parser.add_argument(
+  "--transport",
+  choices=["udp", "tcp"],
+  default="udp",
+  help="transport carrying RPCs between servers",
+)
+parser.add_argument(
+  "--codec",
+  choices=[codec.value for codec in Codec],
+  default=Codec.BINARY.value,
+  help="wire format of RPCs sent (both are always understood)",
+)
+parser.add_argument(
+  "--runtime",
+  choices=["select", "asyncio"],
+  default="select",
+  help="event loop driving the server",
+)
+parser.add_argument(
+  "--log-level",
+  choices=["debug", "info", "warning", "error"],
+  default="info",
+  help="least severe level logged",
+)
+parser.add_argument(
+  "--metrics-port",
+  type=int,
+  help="port of the local HTTP endpoint exposing metrics (off if not given)",
+)
 
 args = parser.parse_args()
 
@@ -31,54 +91,223 @@ args = parser.parse_args()
 ###############################################################################
 
 
-def main() -> None:
-  """Program enters here."""
+def _wake_on_signals() -> Tuple[socket, socket]:
+  """Return a socket made readable by every signal received, so that the select
+  loop handles signals between iterations rather than wherever they land, and
+  the socket written to (which must be kept open)."""
+  waker, wakeup = socketpair()
+  waker.setblocking(False)
+  wakeup.setblocking(False)
+  set_wakeup_fd(wakeup.fileno())
+  # the handler has nothing left to do, but must be set for the wakeup to happen
+  signal(SIGTERM, lambda signum, frame: None)
 
-  with open(Path(__file__).parent / "config.json", mode="r") as fp:
-    config = loads(fp.read())
+  return waker, wakeup
 
-  ports = map(int, config["ports"])
-  # ensure other servers are aware of us
-  assert args.port in ports
 
-  # inialize server
-  server = Server(addresses=[Address(port=port) for port in ports])
-  server.init_sock(args.port)
+def serve_select(server: Server) -> None:
+  """Serve with a blocking select loop, persisting once per iteration. On
+  SIGTERM, a leader hands leadership over before the loop ends."""
+  waker, wakeup = _wake_on_signals()
+  stopping_until: Union[float, None] = None
 
-  print(f"INFO: Server is starting on 127.0.0.1:{args.port}...")
+  while stopping_until is None or (server.is_leader() and time() < stopping_until):
+    logger.debug("Timing out in %.2f seconds...", server.timeout - time())
 
-  try:
-    while True:
-      print(f"INFO: Timing out in {server.timeout - time():.2f} seconds...")
+    readable, writable, exceptional = select(
+      server.transport.readers() + server.apply_readers() + [waker],
+      server.transport.writers(),
+      server.transport.readers(),
+      max(0, server.deadline() - time()),
+    )
+    started_at = perf_counter()
+    # batches applied are collected with the commits below
+    readable = [sock for sock in readable if sock not in server.apply_readers()]
 
-      readable, _, exceptional = select(
-        [server.sock], [], [], max(0, server.timeout - time())
-      )
+    if waker in readable:
+      readable.remove(waker)
+
+      if SIGTERM in waker.recv(64) and stopping_until is None:
+        logger.info("Terminating...")
+        stopping_until = time() + TIMEOUT_LOWER_BOUND
+        server.transfer_leadership()
+
+    if server.is_timed_out():
+      if server.is_leader():
+        server.start_heartbeat()
+      else:
+        server.start_election()
+
+    for sock in writable:
+      server.transport.write(sock)
+
+    for sock in readable:
+      for data, sender in server.transport.receive(sock):
+        server.rpc_receive(data, sender)
+
+    for sock in exceptional:
+      server.transport.discard(sock)
+
+    # append batched client requests that have lingered long enough
+    server.expire_client_batch()
+
+    # persist this tick's mutations, then send its RPCs
+    server.flush()
+
+    # apply commits when commit index is incremented
+    server.apply_commits()
+
+    LOOP_ITERATION_SECONDS.observe(perf_counter() - started_at)
 
-      if server.is_timed_out():
-        if server.is_leader():
-          server.start_heartbeat()
-        else:
-          server.start_election()
 
-      for sock in readable:
-        data, addr = sock.recvfrom(1024)
-        for payload in data.decode().splitlines(keepends=True):
-          server.rpc_handle(RPC.parse_raw(payload), Address(host=addr[0], port=addr[1]))
+def serve_multi(host: MultiRaftHost) -> None:
+  """Serve every group of a Multi-Raft host with a blocking select loop,
+  persisting the mutations of every group once per iteration. On SIGTERM, the
+  host hands leadership of every group it leads over before the loop ends."""
+  waker, wakeup = _wake_on_signals()
+  stopping_until: Union[float, None] = None
 
-      for sock in exceptional:
-        if sock is server.sock:
-          server.init_sock(args.port)
+  while stopping_until is None or (host.is_leader() and time() < stopping_until):
+    readable, writable, exceptional = select(
+      host.transport.readers() + host.apply_readers() + [waker],
+      host.transport.writers(),
+      host.transport.readers(),
+      max(0, host.deadline() - time()),
+    )
+    started_at = perf_counter()
+    # batches applied are collected with the commits below
+    readable = [sock for sock in readable if sock not in host.apply_readers()]
 
-      # apply commits when commit index is incremented
-      server.apply_commits()
+    if waker in readable:
+      readable.remove(waker)
+
+      if SIGTERM in waker.recv(64) and stopping_until is None:
+        logger.info("Terminating...")
+        stopping_until = time() + TIMEOUT_LOWER_BOUND
+        host.transfer_leadership()
+
+    host.start_timed_out()
+
+    for sock in writable:
+      host.transport.write(sock)
+
+    for sock in readable:
+      for data, sender in host.transport.receive(sock):
+        host.receive(data, sender)
+
+    for sock in exceptional:
+      host.transport.discard(sock)
+
+    host.expire_client_batch()
+    host.flush()
+    host.apply_commits()
+
+    LOOP_ITERATION_SECONDS.observe(perf_counter() - started_at)
+
+
+def serve(config: Dict[str, Any]) -> None:
+  """Set up the server described by the configuration, then serve until
+  interrupted or failing."""
+
+  # the initial configuration: a server outside of it waits to be added to the
+  # cluster (see `python -m client.admin add-server`)
+  ports = list(map(int, config["ports"]))
+
+  options = dict(
+    codec=Codec(args.codec),
+    client_batch_size=config.get("client_batch_size", CLIENT_BATCH_SIZE),
+    client_batch_linger=config.get("client_batch_linger", CLIENT_BATCH_LINGER),
+    read_lease=config.get("read_lease", False),
+    pre_vote=config.get("pre_vote", True),
+    check_quorum=config.get("check_quorum", True),
+    append_entries_max_entries=config.get(
+      "append_entries_max_entries", APPEND_ENTRIES_MAX_ENTRIES
+    ),
+    append_entries_max_bytes=config.get(
+      "append_entries_max_bytes", APPEND_ENTRIES_MAX_BYTES
+    ),
+    pipeline_window=config.get("pipeline_window", PIPELINE_WINDOW),
+    snapshot_threshold=config.get("snapshot_threshold", SNAPSHOT_THRESHOLD),
+    learner_max_lag=config.get("learner_max_lag", LEARNER_MAX_LAG),
+  )
+  addresses = [Address(port=port) for port in ports]
+  transport = TCPTransport() if args.transport == "tcp" else UDPTransport()
+  groups = config.get("groups", 1)
+  directory = Path(__file__).parent / "db"
+
+  # the state machine is kept on disk rather than in memory, if so configured
+  state_machine: Union[Callable[[Path], StateMachine], None] = None
+  if config.get("state_machine", "memory") == "disk":
+    cache_max_bytes = config.get("record_cache_max_bytes", RECORD_CACHE_MAX_BYTES)
+    state_machine = lambda path: DiskStateMachine(
+      directory=path, cache_max_bytes=cache_max_bytes
+    )
+
+  # many groups share one host, each serving a hash shard of the key space
+  if groups > 1:
+    if args.runtime != "select":
+      logger.critical("Multi-Raft hosts only run on the select runtime.")
+      return
+
+    host = MultiRaftHost(
+      addresses,
+      groups,
+      transport,
+      directory=directory / "multi",
+      state_machine=state_machine,
+      **options,
+    )
+    host.open(args.port)
+  else:
+    # inialize server
+    driver = DatabaseDriver(
+      state_machine=(
+        MemoryStateMachine()
+        if state_machine is None
+        else state_machine(directory / "kv")
+      )
+    )
+    server = Server(addresses=addresses, transport=transport, driver=driver, **options)
+    server.init_sock(args.port)
+
+  if args.metrics_port is not None:
+    serve_metrics(args.metrics_port)
+    logger.info("Metrics are served on 127.0.0.1:%d/metrics.", args.metrics_port)
+
+  logger.info("Server is starting on 127.0.0.1:%d...", args.port)
+
+  try:
+    if groups > 1:
+      logger.info("Hosting %d Raft groups.", groups)
+      serve_multi(host)
+    elif args.runtime == "asyncio":
+      run(AsyncioRuntime(server).serve())
+    else:
+      serve_select(server)
 
   except KeyboardInterrupt:
-    print("INFO: Server ending normally...")
-  except Exception as e:
-    print(f"CRITICAL: {e}")
+    logger.info("Server ending normally...")
+  except Exception:
+    logger.critical("Server failed.", exc_info=True)
+
+  logger.info("End of processing.")
+
+
+def main() -> None:
+  """Program enters here."""
 
-  print("End of processing.")
+  with open(Path(__file__).parent / "config.json", mode="r") as fp:
+    config = loads(fp.read())
+
+  listener = configure_logging(
+    args.log_level.upper(), config.get("log_rate_limit", LOG_RATE_LIMIT)
+  )
+
+  try:
+    serve(config)
+  finally:
+    # write the records still queued
+    listener.stop()
 
 
 if __name__ == "__main__":
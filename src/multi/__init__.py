@@ -0,0 +1,2 @@
+from .transport import *
+from .host import *
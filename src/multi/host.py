@@ -0,0 +1,224 @@
+"""Defines the Multi-Raft host, running many independent Raft groups in one
+process. Every group is a whole server, replicating its own log to the same
+group on every other host, and serving the keys hashed to it (see `utils.group`)
+out of its own database and snapshots. The groups of a host share:
+
+- the transport: one socket, every message between hosts being enveloped with
+  its group, and the messages of every group to a host being sent together;
+  client requests are routed by the group of their key, administrative ones by
+  the group they name, so that hosts are added to or removed from each group;
+- heartbeats: whenever a group led by the host is due one, every group it leads
+  sends one, so that they travel together rather than each on its own schedule;
+- the write-ahead log: the writes of every group in a tick are made durable by
+  a single fsync, before any group sends the RPCs that waited on them.
+
+The preferred leader of each group is another host, round robin, so that
+wherever a group elects its leader, leadership moves to its preferred host once
+that host is up to date: client requests spread evenly across hosts, and so
+does the work of leading."""
+
+from logging import getLogger
+from pathlib import Path
+from socket import socket
+from struct import error as StructError
+from typing import Any, Callable, Dict, List, Union
+
+from pydantic import ValidationError
+
+from db import DatabaseDriver, MemoryStateMachine, SharedWriteAheadLog, StateMachine
+from rpc.codec import decode
+from state import Server
+from transport import BaseTransport
+from utils import RPC, Address, Gauge, group_of
+
+from .transport import GroupTransport, is_enveloped, unwrap
+
+logger = getLogger(__name__)
+
+GROUPS_LED = Gauge("raft_groups_led", "Raft groups led by this host.")
+
+
+class MultiRaftHost:
+  """Host of many Raft groups sharing one transport and one write-ahead log.
+
+  The host is driven like a single server: messages received are handed to
+  their group, timeouts are checked, then `flush` persists the tick's mutations
+  of every group at once and sends their RPCs, before commits are applied. The
+  state machine of each group may be built from its directory, else it is held
+  in memory."""
+
+  def __init__(
+    self,
+    addresses: List[Address],
+    groups: int,
+    transport: BaseTransport,
+    directory: Union[Path, None] = None,
+    state_machine: Union[Callable[[Path], StateMachine], None] = None,
+    **options: Any,
+  ) -> None:
+    self.addresses = addresses
+    self.transport = transport
+    self.state_machine = state_machine
+    # messages queued by every group, sent once all of them have flushed
+    self._outbox: Dict[Address, List[bytes]] = {}
+    self._wal: Union[SharedWriteAheadLog, None] = None
+
+    if directory is not None:
+      self._wal = SharedWriteAheadLog(directory=directory / "wal")
+
+    self.servers: List[Server] = [
+      self._start(group, directory, options) for group in range(groups)
+    ]
+
+  def _queue(self, messages: List[bytes], addr: Address) -> None:
+    """Queue messages of a group, to be sent along with those of the others."""
+    self._outbox.setdefault(addr, []).extend(messages)
+
+  def _route(self, rpc: RPC) -> Union[Server, None]:
+    """Return the group serving a client RPC: the group of its key, or the one
+    named by administrative RPCs, if it is hosted."""
+    key = getattr(rpc.content, "key", None)
+    if key is not None:
+      return self.servers[group_of(key, len(self.servers))]
+
+    group = getattr(rpc.content, "group", 0)
+    return self.servers[group] if group < len(self.servers) else None
+
+  def _send(self) -> None:
+    """Send the messages queued by every group, coalesced per destination."""
+    outbox, self._outbox = self._outbox, {}
+
+    for addr, messages in outbox.items():
+      try:
+        self.transport.send_many(messages, addr)
+      except:
+        logger.error("Failed to send RPC to %s.", addr)
+
+  def _start(
+    self, group: int, directory: Union[Path, None], options: Dict[str, Any]
+  ) -> Server:
+    """Set up the server of a group, its leader preferred to be a host of its
+    own."""
+    if directory is None or self._wal is None:
+      driver = DatabaseDriver(directory=None)
+    else:
+      directory = directory / f"group-{group:04d}"
+      driver = DatabaseDriver(
+        directory=directory,
+        wal=self._wal.group(group),
+        state_machine=(
+          MemoryStateMachine()
+          if self.state_machine is None
+          else self.state_machine(directory / "kv")
+        ),
+      )
+
+    server = Server(
+      addresses=self.addresses,
+      transport=GroupTransport(
+        group=group, hosts=set(self.addresses), queue=self._queue
+      ),
+      driver=driver,
+      preferred_leader=self.addresses[group % len(self.addresses)],
+      group=group,
+      **options,
+    )
+    # hosts added to the group are enveloped to as soon as they are replicated to
+    server.transport.members = server.members
+
+    return server
+
+  def apply_commits(self) -> None:
+    """Apply the commits of every group."""
+    for server in self.servers:
+      server.apply_commits()
+
+    GROUPS_LED.set(sum(server.is_leader() for server in self.servers))
+
+  def apply_readers(self) -> List[socket]:
+    """Return the sockets made readable whenever a group has applied a batch."""
+    return [sock for server in self.servers for sock in server.apply_readers()]
+
+  def deadline(self) -> float:
+    """Return the time by which the host must act, even if nothing arrives."""
+    return min(server.deadline() for server in self.servers)
+
+  def expire_client_batch(self) -> None:
+    """Append the batched client requests of every group that have lingered long
+    enough."""
+    for server in self.servers:
+      server.expire_client_batch()
+
+  def flush(self) -> None:
+    """Persist every mutation of every group with a single fsync, then send all
+    queued RPCs, so that no group replies before it has persisted."""
+    fsyncs: List[Callable[[], None]] = [
+      server.flush_begin() for server in self.servers
+    ]
+
+    # the first group syncs the writes of all, the others find nothing left
+    for fsync in fsyncs:
+      fsync()
+
+    for server in self.servers:
+      server.flush_end()
+
+    self._send()
+
+  def is_leader(self) -> bool:
+    """Indicate if the host leads any group."""
+    return any(server.is_leader() for server in self.servers)
+
+  def open(self, port: int) -> None:
+    """Start listening on a port, for every group."""
+    self.transport.open(Address(port=port))
+
+    for server in self.servers:
+      server.transport.open(self.transport.address)
+
+  def receive(self, data: bytes, sender: Address) -> None:
+    """Hand every message received to its group: messages from other hosts are
+    enveloped with it, client RPCs are routed by their key."""
+    if is_enveloped(data):
+      try:
+        messages = unwrap(data)
+      except (StructError, ValueError):
+        logger.error("Invalid group envelope received.")
+        return
+
+      for group, message in messages:
+        if group < len(self.servers):
+          # replies go back enveloped, even to a host the group no longer holds
+          self.servers[group].transport.hosts.add(sender)
+          self.servers[group].rpc_receive(message, sender)
+    else:
+      try:
+        rpcs = decode(data)
+      except (KeyError, StructError, ValidationError, ValueError):
+        logger.error("Invalid RPC request/response received.")
+        return
+
+      for rpc in rpcs:
+        server = self._route(rpc)
+        if server is None:
+          logger.error("RPC received for a group not hosted.")
+        else:
+          server.rpc_handle(rpc, sender)
+
+  def start_timed_out(self) -> None:
+    """Start the heartbeats and elections that are due. When any group led is
+    due a heartbeat, every group led sends one, so that they are coalesced."""
+    led = [server for server in self.servers if server.is_leader()]
+
+    if any(server.is_timed_out() for server in led):
+      for server in led:
+        server.start_heartbeat()
+
+    for server in self.servers:
+      if not server.is_leader() and server.is_timed_out():
+        server.start_election()
+
+  def transfer_leadership(self) -> None:
+    """Hand leadership of every group led over to another host."""
+    for server in self.servers:
+      server.transfer_leadership()
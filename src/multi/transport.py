@@ -0,0 +1,87 @@
+"""Defines the transport of a Raft group over the transport of its host. Messages
+to other hosts are enveloped with the group they belong to, and queued until the
+host sends those of every group at once: the messages to each host, heartbeats
+included, are coalesced into as few datagrams (or stream writes) as fit.
+Messages to clients are queued as they are, since clients know nothing of
+groups.
+
+The hosts of a group are those it started with, those its configuration names
+as it changes (a host added is replicated to before the host hears of it), and
+those it heard from, such as a host removed that has yet to learn of it."""
+
+from struct import Struct
+from typing import Callable, List, Set, Tuple
+
+from pydantic import NonNegativeInt
+from transport import BaseTransport
+from utils import Address
+
+GROUP_MAGIC: int = 0xFB
+
+# magic, group, length of the enveloped message
+_ENVELOPE = Struct("!BII")
+
+
+def envelop(group: NonNegativeInt, message: bytes) -> bytes:
+  """Envelop a message of a group."""
+  return _ENVELOPE.pack(GROUP_MAGIC, group, len(message)) + message
+
+
+def is_enveloped(data: bytes) -> bool:
+  """Indicate if the data holds enveloped messages, rather than bare RPCs."""
+  return data[:1] == bytes((GROUP_MAGIC,))
+
+
+def unwrap(data: bytes) -> List[Tuple[NonNegativeInt, bytes]]:
+  """Return every message held by the data, along with its group."""
+  messages: List[Tuple[NonNegativeInt, bytes]] = []
+  offset = 0
+
+  while offset < len(data):
+    magic, group, length = _ENVELOPE.unpack_from(data, offset)
+    offset += _ENVELOPE.size
+
+    if magic != GROUP_MAGIC or offset + length > len(data):
+      raise ValueError("Malformed group envelope.")
+
+    messages.append((group, data[offset : offset + length]))
+    offset += length
+
+  return messages
+
+
+class GroupTransport(BaseTransport):
+  """Transport of a group, handing its messages over to its host to be queued.
+  The host owns the sockets, so there are none to wait on."""
+
+  group: NonNegativeInt
+  hosts: Set[Address]
+  queue: Callable[[List[bytes], Address], None]
+  # members of the latest configuration of the group, once its server is set up
+  members: Callable[[], List[Address]] = list
+
+  def discard(self, sock: object) -> None:
+    pass
+
+  def open(self, address: Address) -> None:
+    """Take the address of the host."""
+    self.address = address
+
+  def readers(self) -> List:
+    return []
+
+  def receive(self, sock: object) -> List:
+    return []
+
+  def send(self, message: bytes, addr: Address) -> None:
+    """Queue a message for the host to send."""
+    self.send_many([message], addr)
+
+  def send_many(self, messages: List[bytes], addr: Address) -> None:
+    """Queue messages for the host to send, enveloped if sent to a host."""
+    if addr not in self.hosts and addr in self.members():
+      self.hosts.add(addr)
+
+    if addr in self.hosts:
+      messages = [envelop(self.group, message) for message in messages]
+    self.queue(messages, addr)
@@ -1,4 +1,6 @@
 from ._base import *
+from .shared import *
 from .candidate import *
 from .follower import *
 from .leader import *
+from .pre_candidate import *
@@ -1,44 +1,10 @@
 """Defines the base server role."""
 
-from typing import List, Union
-
-from db import Entry, DatabaseDriver
-from pydantic import BaseModel, NonNegativeInt
-from utils import Address
+from pydantic import BaseModel
 
 
 class BaseRole(BaseModel):
-  """Implements state properties present on all servers."""
-
-  _driver: DatabaseDriver = DatabaseDriver()
-  current_term: NonNegativeInt = _driver.get_current_term()
-  voted_for: Union[Address, None] = _driver.get_voted_for()
-  log: List[Entry] = _driver.get_log()
-  commit_index: NonNegativeInt
-  last_applied_index: NonNegativeInt
-
-  def apply_commits(self) -> None:
-    """Apply all committed entries to the state machine."""
-    while self.commit_index > self.last_applied_index:
-      entry = self.log[self.last_applied_index]
-      print(f"INFO: Applying {entry} to the database.")
-
-      self._driver.set_db(entry.key, entry.value)
-      self.last_applied_index += 1
-
-  def update_current_term(self, new_term: NonNegativeInt) -> None:
-    """Update the current term with the driver, then here."""
-    self.current_term = self._driver.set_current_term(new_term)
-
-    print(f"INFO: Updated current term to {self.current_term}.")
-
-  def update_voted_for(self, voted_for: Union[Address, None]) -> None:
-    """Update the voted for first with the driver, then here."""
-    self.voted_for = self._driver.set_voted_for(voted_for)
-
-    if voted_for is not None:
-      print(f"INFO: Voted {voted_for} in term {self.current_term}.")
+  """Tags the role of a server. The state present on all servers is shared
+  between roles rather than held by them, so that changing role is cheap."""
 
-  def update_log(self, new_entry: Entry) -> None:
-    """Update the log first with the driver, then here."""
-    self.log = self._driver.set_log(new_entry)
+  pass
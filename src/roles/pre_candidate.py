@@ -0,0 +1,9 @@
+"""Defines the pre-candidate server role."""
+
+from . import BaseRole
+
+
+class PreCandidateRole(BaseRole):
+  """Pre-candidate role, polling servers before standing for election."""
+
+  pass
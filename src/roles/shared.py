@@ -0,0 +1,221 @@
+"""Defines the state shared by every server role."""
+
+from logging import getLogger
+from typing import List, Tuple, Union
+
+from db import (
+  APPLY_BATCH_MAX_ENTRIES,
+  CONFIGURATION_KEY,
+  ApplyStage,
+  Configuration,
+  Entry,
+  DatabaseDriver,
+  Log,
+  Snapshot,
+)
+from pydantic import BaseModel, NonNegativeInt, StrictBool
+from utils import Address
+
+logger = getLogger(__name__)
+
+
+class SharedState(BaseModel):
+  """Implements state properties present on all servers, whatever their role
+  (the persistent state backed by the driver, the commit and applied indices,
+  the stage applying committed entries and taking or restoring snapshots, and
+  the configurations held by the log)."""
+
+  driver: DatabaseDriver
+  stage: ApplyStage
+  current_term: NonNegativeInt
+  voted_for: Union[Address, None]
+  log: Log
+  commit_index: NonNegativeInt
+  last_applied_index: NonNegativeInt
+  # configuration entries of the log by index, preceded by the configuration
+  # applied up to its start, if any
+  configurations: List[Tuple[NonNegativeInt, Configuration]]
+  # index of the snapshot being restored on the apply stage, and of the one
+  # restored since the leader was last told, if any
+  installing: Union[NonNegativeInt, None] = None
+  installed: Union[NonNegativeInt, None] = None
+
+  class Config:
+    arbitrary_types_allowed = True
+
+  def __init__(self, **data) -> None:
+    driver: DatabaseDriver = data["driver"]
+    data.setdefault("current_term", driver.get_current_term())
+    data.setdefault("voted_for", driver.get_voted_for())
+    data.setdefault("log", driver.get_log())
+    # everything up to the start of the log is in the snapshot, hence applied,
+    # and so is everything past it a persisted state machine holds
+    data.setdefault("commit_index", driver.get_last_applied_index())
+    data.setdefault("last_applied_index", driver.get_last_applied_index())
+    data.setdefault("configurations", [])
+    data.setdefault("stage", ApplyStage(driver.apply, threaded=False))
+    super().__init__(**data)
+    self._configurations_reset()
+
+  def _configurations_reset(self) -> None:
+    """Find the configuration applied up to the start of the log, as the state
+    machine holds it, then every configuration entry past the start."""
+    value = self.driver.get_db(CONFIGURATION_KEY)
+    self.configurations = (
+      [] if value is None else [(self.log.start, Configuration.from_value(value))]
+    )
+
+    for entry in self.log[self.log.start + 1 :].with_key(CONFIGURATION_KEY):
+      self._configurations_track(entry)
+
+  def _configurations_track(self, entry: Entry) -> None:
+    """Note an entry appended to the log, if it is a configuration entry."""
+    if entry.key == CONFIGURATION_KEY:
+      self.configurations.append((entry.index, Configuration.from_value(entry.value)))
+
+  def _configurations_truncate(self, index: NonNegativeInt) -> None:
+    """Forget the configuration entries from an index onwards, which were
+    discarded from the log."""
+    while self.configurations and self.configurations[-1][0] >= index:
+      self.configurations.pop()
+
+  def _snapshot_installed(self, snapshot: Union[Snapshot, None]) -> None:
+    """Skip every entry a snapshot restored on the apply stage covers, unless it
+    was found corrupted: it is then received again from the start."""
+    self.installing = None
+
+    if snapshot is None:
+      logger.warning("Received corrupted snapshot.")
+      return
+
+    index = snapshot.last_included_index
+    self.log = self.driver.commit_snapshot(snapshot)
+    self._configurations_reset()
+    self.commit_index = max(self.commit_index, index)
+    self.last_applied_index = index
+    self.installed = index
+
+    logger.info("Installed snapshot up to %d.", index)
+
+  def _snapshot_taken(self, snapshot: Snapshot) -> None:
+    """Compact the log up to a snapshot taken on the apply stage."""
+    self.log = self.driver.commit_snapshot(snapshot)
+    # the configuration entries compacted are superseded by the latest of them
+    compacted = [c for c in self.configurations if c[0] <= self.log.start]
+    self.configurations = compacted[-1:] + self.configurations[len(compacted) :]
+
+    logger.info("Took snapshot up to %d.", snapshot.last_included_index)
+
+  def apply_collect(self) -> None:
+    """Advance the applied index past the batch the apply stage has applied, if
+    there is one (a snapshot taken or restored there is handled on its own)."""
+    last_index = self.stage.collect()
+
+    if last_index is not None:
+      self.last_applied_index = last_index
+
+  def apply_commits(self) -> None:
+    """Hand the committed entries not yet applied over to the apply stage in
+    batches, unless one is being applied: those committed meanwhile join the
+    next batch. Batches applied inline are collected at once."""
+    while not self.stage.is_busy() and self.commit_index > self.last_applied_index:
+      last_index = min(
+        self.commit_index, self.last_applied_index + APPLY_BATCH_MAX_ENTRIES
+      )
+      logger.debug(
+        "Applying entries %d to %d.", self.last_applied_index + 1, last_index
+      )
+      # a view only copies the columns, its entries are built once applied
+      self.stage.submit(self.log[self.last_applied_index + 1 : last_index + 1])
+      self.apply_collect()
+
+  def install_snapshot(
+    self,
+    last_included_index: NonNegativeInt,
+    last_included_term: NonNegativeInt,
+    offset: NonNegativeInt,
+    data: bytes,
+    done: StrictBool,
+  ) -> NonNegativeInt:
+    """Store a chunk of a snapshot with the driver, and once it is complete,
+    have the apply stage restore the state machine from it: that starts once
+    the batch being applied is done, unless that batch reached the snapshot.
+    Returns the offset of the next chunk expected."""
+    if done:
+      last_index = self.stage.wait()
+
+      if last_index is not None:
+        self.last_applied_index = last_index
+      if self.last_applied_index >= last_included_index:
+        return offset + len(data)
+
+    next_offset, snapshot = self.driver.receive_snapshot(
+      last_included_index, last_included_term, offset, data, done
+    )
+
+    if snapshot is not None:
+      self.installing = last_included_index
+      self.stage.run(
+        lambda: self.driver.install_snapshot(snapshot), self._snapshot_installed
+      )
+      self.apply_collect()
+
+    return next_offset
+
+  def configuration(self) -> Union[Configuration, None]:
+    """Return the latest configuration in the log, committed or not (Section
+    4.1), if there is one."""
+    return self.configurations[-1][1] if self.configurations else None
+
+  def configuration_index(self) -> NonNegativeInt:
+    """Return the index of the latest configuration entry in the log (that of
+    the snapshot for the configuration it holds, 0 if there is none)."""
+    return self.configurations[-1][0] if self.configurations else 0
+
+  def take_snapshot(self) -> None:
+    """Have the apply stage snapshot every applied entry, between two batches,
+    then compact the log once the snapshot is durable."""
+    index = self.last_applied_index
+    term = self.log.term(index)
+
+    self.stage.run(
+      lambda: self.driver.take_snapshot(index, term), self._snapshot_taken
+    )
+    self.apply_collect()
+
+  def update_current_term(self, new_term: NonNegativeInt) -> None:
+    """Update the current term with the driver, then here."""
+    self.current_term = self.driver.set_current_term(new_term)
+
+    logger.info("Updated current term to %d.", self.current_term)
+
+  def update_voted_for(self, voted_for: Union[Address, None]) -> None:
+    """Update the voted for first with the driver, then here."""
+    self.voted_for = self.driver.set_voted_for(voted_for)
+
+    if voted_for is not None:
+      logger.info("Voted %s in term %d.", voted_for, self.current_term)
+
+  def update_log(self, new_entry: Entry) -> None:
+    """Update the log first with the driver, then here, noting the
+    configuration entries it appends or discards."""
+    log = self.log
+    appended = new_entry.index == len(log)
+    replaced = (
+      log.start < new_entry.index < len(log)
+      and log.term(new_entry.index) != new_entry.term
+    )
+
+    self.log = self.driver.set_log(new_entry)
+
+    if replaced:
+      self._configurations_truncate(new_entry.index)
+    if appended or replaced:
+      self._configurations_track(new_entry)
+
+  def extend_log(self, new_entries: List[Entry]) -> None:
+    """Append a batch of entries first with the driver, then here."""
+    self.log = self.driver.extend_log(new_entries)
+
+    for entry in new_entries:
+      self._configurations_track(entry)
@@ -1,3 +1,11 @@
 from ._base import *
+from .add_server import *
 from .append_entries import *
+from .client_query import *
+from .client_request import *
+from .install_snapshot import *
+from .remove_server import *
 from .request_vote import *
+from .timeout_now import *
+from .transfer_leadership import *
+from .codec import *
@@ -0,0 +1,27 @@
+"""Defines the AddServer RPC (Remote Procedure Call) as per Figure 4.1."""
+
+from typing import Union
+
+from pydantic import NonNegativeInt, StrictBool
+from utils import Address
+
+from . import BaseRPC
+
+
+class AddServerRPCRequest(BaseRPC):
+  """Implements AddServer RPC request arguments. The new server joins as a
+  learner, and becomes a voter once it caught up with the leader."""
+
+  request_identity: NonNegativeInt
+  new_server: Address
+  # group of a Multi-Raft host the request is for (see `multi`)
+  group: NonNegativeInt = 0
+
+
+class AddServerRPCResponse(BaseRPC):
+  """Implements AddServer RPC response results, sent once the configuration
+  making the new server a voter is committed."""
+
+  request_identity: NonNegativeInt
+  success: StrictBool
+  leader_hint: Union[Address, None]
@@ -1,6 +1,6 @@
 """Defines the AppendEntries RPC (Remote Procedure Call) as per Figure 3.1."""
 
-from typing import List
+from typing import List, Union
 
 from db import Entry
 from pydantic import NonNegativeInt, StrictBool
@@ -18,10 +18,17 @@ class AppendEntriesRPCRequest(BaseRPC):
   previous_log_term: NonNegativeInt
   entries: List[Entry]
   leader_commit_index: NonNegativeInt
+  request_identity: NonNegativeInt
 
 
 class AppendEntriesRPCResponse(BaseRPC):
-  """Implements AppendEntries RPC response results."""
+  """Implements AppendEntries RPC response results. On a failed consistency
+  check, the conflict term is the term of the follower's entry at the previous
+  log index and the conflict index the first index of that term, or without such
+  an entry, no term and the index past the follower's last entry (Section 3.5)."""
 
   term: NonNegativeInt
   success: StrictBool
+  request_identity: NonNegativeInt
+  conflict_index: NonNegativeInt
+  conflict_term: Union[NonNegativeInt, None]
@@ -0,0 +1,24 @@
+"""Defines the ClientQuery RPC (Remote Procedure Call) as per Figure 6.1."""
+
+from typing import Union
+
+from pydantic import NonNegativeInt, StrictBool, StrictStr
+from utils import Address
+
+from . import BaseRPC
+
+
+class ClientQueryRPCRequest(BaseRPC):
+  """Implements ClientQuery RPC request arguments."""
+
+  request_identity: NonNegativeInt
+  key: StrictStr
+
+
+class ClientQueryRPCResponse(BaseRPC):
+  """Implements ClientQuery RPC response results."""
+
+  request_identity: NonNegativeInt
+  success: StrictBool
+  value: Union[StrictStr, None]
+  leader_hint: Union[Address, None]
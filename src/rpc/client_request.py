@@ -0,0 +1,24 @@
+"""Defines the ClientRequest RPC (Remote Procedure Call) as per Figure 6.1."""
+
+from typing import Union
+
+from pydantic import NonNegativeInt, StrictBool, StrictStr
+from utils import Address
+
+from . import BaseRPC
+
+
+class ClientRequestRPCRequest(BaseRPC):
+  """Implements ClientRequest RPC request arguments."""
+
+  request_identity: NonNegativeInt
+  key: StrictStr
+  value: StrictStr
+
+
+class ClientRequestRPCResponse(BaseRPC):
+  """Implements ClientRequest RPC response results."""
+
+  request_identity: NonNegativeInt
+  success: StrictBool
+  leader_hint: Union[Address, None]
@@ -0,0 +1,329 @@
+"""Defines the wire formats RPCs are encoded in.
+
+The binary format frames every RPC with a struct-packed header (magic, version,
+direction, type and body length) followed by the fields of the RPC packed in
+declaration order: integers as unsigned 64-bit, booleans as a byte, strings and
+bytes prefixed by their length, lists prefixed by their count, and optional
+fields prefixed by a presence byte. The JSON format, one RPC per line, is kept
+for debugging. Both formats may be mixed within the same datagram or stream.
+
+The items of a list field may be given already encoded in the binary format,
+in which case their bytes are spliced in as they are: a leader encodes each log
+entry once, however many AppendEntries RPCs carry it, straight from the columns
+of its log."""
+
+from enum import Enum
+from struct import Struct
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple, Type
+
+from db import LogView
+from orjson import loads
+from pydantic import BaseModel, StrictBool
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON, ModelField
+from utils.rpc import RPC, RPCDirection, RPCType
+
+from . import (
+  AddServerRPCRequest,
+  AddServerRPCResponse,
+  AppendEntriesRPCRequest,
+  AppendEntriesRPCResponse,
+  BaseRPC,
+  ClientQueryRPCRequest,
+  ClientQueryRPCResponse,
+  ClientRequestRPCRequest,
+  ClientRequestRPCResponse,
+  InstallSnapshotRPCRequest,
+  InstallSnapshotRPCResponse,
+  RemoveServerRPCRequest,
+  RemoveServerRPCResponse,
+  RequestVoteRPCRequest,
+  RequestVoteRPCResponse,
+  TimeoutNowRPCRequest,
+  TransferLeadershipRPCRequest,
+  TransferLeadershipRPCResponse,
+)
+
+CODEC_MAGIC: int = 0xFA
+CODEC_VERSION: int = 1
+
+MODELS: Dict[Tuple[RPCDirection, RPCType], Type[BaseRPC]] = {
+  (RPCDirection.REQUEST, RPCType.APPEND_ENTRIES): AppendEntriesRPCRequest,
+  (RPCDirection.RESPONSE, RPCType.APPEND_ENTRIES): AppendEntriesRPCResponse,
+  (RPCDirection.REQUEST, RPCType.REQUEST_VOTE): RequestVoteRPCRequest,
+  (RPCDirection.RESPONSE, RPCType.REQUEST_VOTE): RequestVoteRPCResponse,
+  (RPCDirection.REQUEST, RPCType.ADD_SERVER): AddServerRPCRequest,
+  (RPCDirection.RESPONSE, RPCType.ADD_SERVER): AddServerRPCResponse,
+  (RPCDirection.REQUEST, RPCType.REMOVE_SERVER): RemoveServerRPCRequest,
+  (RPCDirection.RESPONSE, RPCType.REMOVE_SERVER): RemoveServerRPCResponse,
+  (RPCDirection.REQUEST, RPCType.INSTALL_SNAPSHOT): InstallSnapshotRPCRequest,
+  (RPCDirection.RESPONSE, RPCType.INSTALL_SNAPSHOT): InstallSnapshotRPCResponse,
+  (RPCDirection.REQUEST, RPCType.CLIENT_REQUEST): ClientRequestRPCRequest,
+  (RPCDirection.RESPONSE, RPCType.CLIENT_REQUEST): ClientRequestRPCResponse,
+  (RPCDirection.REQUEST, RPCType.CLIENT_QUERY): ClientQueryRPCRequest,
+  (RPCDirection.RESPONSE, RPCType.CLIENT_QUERY): ClientQueryRPCResponse,
+  (RPCDirection.REQUEST, RPCType.TIMEOUT_NOW): TimeoutNowRPCRequest,
+  (RPCDirection.REQUEST, RPCType.TRANSFER_LEADERSHIP): TransferLeadershipRPCRequest,
+  (
+    RPCDirection.RESPONSE,
+    RPCType.TRANSFER_LEADERSHIP,
+  ): TransferLeadershipRPCResponse,
+}
+
+# magic, version, direction, type, body length
+_HEADER = Struct("!BBBBI")
+# length of strings and bytes, count of lists
+_LENGTH = Struct("!I")
+# presence of optional fields
+_PRESENT = Struct("!?")
+# index and term of a log entry, as the schema of an entry packs them
+_ENTRY = Struct("!QQ")
+
+_Pack = Callable[[Any, List[bytes]], None]
+_Unpack = Callable[[bytes, int], Tuple[Any, int]]
+
+_SCHEMAS: Dict[Type[BaseModel], Tuple[_Pack, _Unpack]] = {}
+
+
+class Codec(str, Enum):
+  BINARY = "binary"
+  JSON = "json"
+
+
+class Encoded(NamedTuple):
+  """Items of a list field already encoded back to back in the binary format.
+  Only the binary format may carry them."""
+
+  count: int
+  data: bytes
+
+
+def _pack_str(value: str, out: List[bytes]) -> None:
+  data = value.encode()
+  out.append(_LENGTH.pack(len(data)))
+  out.append(data)
+
+
+def _unpack_str(buf: bytes, offset: int) -> Tuple[str, int]:
+  (length,) = _LENGTH.unpack_from(buf, offset)
+  offset += _LENGTH.size
+  return buf[offset : offset + length].decode(), offset + length
+
+
+def _pack_bytes(value: bytes, out: List[bytes]) -> None:
+  out.append(_LENGTH.pack(len(value)))
+  out.append(value)
+
+
+def _unpack_bytes(buf: bytes, offset: int) -> Tuple[bytes, int]:
+  (length,) = _LENGTH.unpack_from(buf, offset)
+  offset += _LENGTH.size
+  return bytes(buf[offset : offset + length]), offset + length
+
+
+def _compile_scalar(fmt: str) -> Tuple[_Pack, _Unpack]:
+  """Compile the packer and unpacker of a lone integer or boolean."""
+  scalar = Struct(f"!{fmt}")
+
+  def pack(value: Any, out: List[bytes]) -> None:
+    out.append(scalar.pack(value))
+
+  def unpack(buf: bytes, offset: int) -> Tuple[Any, int]:
+    return scalar.unpack_from(buf, offset)[0], offset + scalar.size
+
+  return pack, unpack
+
+
+def _compile_field(field: ModelField) -> Tuple[_Pack, _Unpack]:
+  """Compile the packer and unpacker of a variable-size field."""
+  pack: _Pack
+  unpack: _Unpack
+
+  if _scalar_format(field.type_):
+    pack, unpack = _compile_scalar(_scalar_format(field.type_))
+  elif issubclass(field.type_, BaseModel):
+    pack, unpack = _schema(field.type_)
+  elif issubclass(field.type_, str):
+    pack, unpack = _pack_str, _unpack_str
+  elif issubclass(field.type_, bytes):
+    pack, unpack = _pack_bytes, _unpack_bytes
+  else:
+    raise TypeError(f"Field {field.name} cannot be encoded.")
+
+  if field.shape == SHAPE_LIST:
+    pack_item, unpack_item = pack, unpack
+
+    def pack(values: Any, out: List[bytes]) -> None:
+      if isinstance(values, Encoded):
+        out.append(_LENGTH.pack(values.count))
+        out.append(values.data)
+        return
+
+      out.append(_LENGTH.pack(len(values)))
+      for value in values:
+        pack_item(value, out)
+
+    def unpack(buf: bytes, offset: int) -> Tuple[List[Any], int]:
+      (count,) = _LENGTH.unpack_from(buf, offset)
+      offset += _LENGTH.size
+      values = []
+      for _ in range(count):
+        value, offset = unpack_item(buf, offset)
+        values.append(value)
+      return values, offset
+
+  elif field.shape != SHAPE_SINGLETON:
+    raise TypeError(f"Field {field.name} cannot be encoded.")
+
+  if field.allow_none:
+    pack_value, unpack_value = pack, unpack
+
+    def pack(value: Any, out: List[bytes]) -> None:
+      out.append(_PRESENT.pack(value is not None))
+      if value is not None:
+        pack_value(value, out)
+
+    def unpack(buf: bytes, offset: int) -> Tuple[Any, int]:
+      (present,) = _PRESENT.unpack_from(buf, offset)
+      offset += _PRESENT.size
+      return unpack_value(buf, offset) if present else (None, offset)
+
+  return pack, unpack
+
+
+def _scalar_format(type_: Any) -> str:
+  """Return the struct format of an integer or boolean type, else an empty
+  string."""
+  if type_ in (bool, StrictBool):
+    return "?"
+  elif issubclass(type_, int):
+    return "Q"
+  else:
+    return ""
+
+
+def _fixed_format(field: ModelField) -> str:
+  """Return the struct format of a fixed-size field, else an empty string."""
+  if field.shape != SHAPE_SINGLETON or field.allow_none:
+    return ""
+  else:
+    return _scalar_format(field.type_)
+
+
+def _schema(model: Type[BaseModel]) -> Tuple[_Pack, _Unpack]:
+  """Compile (once) the packer and unpacker of a model. Runs of fixed-size
+  fields are packed together with a single struct."""
+  if model in _SCHEMAS:
+    return _SCHEMAS[model]
+
+  # every step is either a struct over fixed-size fields or a variable field
+  steps: List[Tuple[List[str], Any]] = []
+
+  for name, field in model.__fields__.items():
+    fmt = _fixed_format(field)
+
+    if fmt and steps and isinstance(steps[-1][1], str):
+      steps[-1] = (steps[-1][0] + [name], steps[-1][1] + fmt)
+    elif fmt:
+      steps.append(([name], fmt))
+    else:
+      steps.append(([name], _compile_field(field)))
+
+  compiled = [
+    (names, Struct(f"!{step}") if isinstance(step, str) else step)
+    for names, step in steps
+  ]
+
+  def pack(value: BaseModel, out: List[bytes]) -> None:
+    for names, step in compiled:
+      if isinstance(step, Struct):
+        out.append(step.pack(*(getattr(value, name) for name in names)))
+      else:
+        step[0](getattr(value, names[0]), out)
+
+  def unpack(buf: bytes, offset: int) -> Tuple[BaseModel, int]:
+    values: Dict[str, Any] = {}
+    for names, step in compiled:
+      if isinstance(step, Struct):
+        values.update(zip(names, step.unpack_from(buf, offset)))
+        offset += step.size
+      else:
+        values[names[0]], offset = step[1](buf, offset)
+    # every value was produced by a packer of the same schema
+    return model.construct(**values), offset
+
+  _SCHEMAS[model] = (pack, unpack)
+
+  return pack, unpack
+
+
+def encode(rpc: RPC, codec: Codec = Codec.BINARY) -> bytes:
+  """Encode an RPC in the given format."""
+  if codec == Codec.JSON:
+    return f"{rpc.json()}\n".encode()
+
+  body: List[bytes] = []
+  _schema(type(rpc.content))[0](rpc.content, body)
+  data = b"".join(body)
+  header = _HEADER.pack(CODEC_MAGIC, CODEC_VERSION, rpc.direction, rpc.type, len(data))
+
+  return header + data
+
+
+def encode_model(value: BaseModel) -> bytes:
+  """Encode a model (such as a log entry) in the binary format, to be spliced
+  into RPCs as an item of an `Encoded` list."""
+  out: List[bytes] = []
+  _schema(type(value))[0](value, out)
+
+  return b"".join(out)
+
+
+def encode_entries(entries: LogView) -> List[bytes]:
+  """Encode every entry of a log view in the binary format, each on its own to be
+  spliced into RPCs as an item of an `Encoded` list. Entries are packed as their
+  schema would pack them, but straight from the columns of the log rather than
+  built first."""
+  encoded: List[bytes] = []
+
+  for index, term, key, value in entries.columns():
+    head = _ENTRY.pack(index, term) + _LENGTH.pack(len(key))
+    encoded.append(head + key + _LENGTH.pack(len(value)) + value)
+
+  return encoded
+
+
+def decode(data: bytes) -> List[RPC]:
+  """Decode every RPC, in either format, held by the data."""
+  rpcs: List[RPC] = []
+  offset = 0
+
+  while offset < len(data):
+    if data[offset] == CODEC_MAGIC:
+      _, version, direction, kind, length = _HEADER.unpack_from(data, offset)
+      offset += _HEADER.size
+
+      if version != CODEC_VERSION:
+        raise ValueError(f"Unsupported codec version {version}.")
+
+      direction, kind = RPCDirection(direction), RPCType(kind)
+      content, end = _schema(MODELS[direction, kind])[1](data, offset)
+
+      if end != offset + length:
+        raise ValueError("Malformed RPC body.")
+
+      offset = end
+    else:
+      end = data.find(b"\n", offset)
+      end = len(data) if end < 0 else end + 1
+      raw = loads(data[offset:end])
+      offset = end
+
+      if not isinstance(raw, dict):
+        raise ValueError("Malformed RPC.")
+
+      direction, kind = RPCDirection(raw["direction"]), RPCType(raw["type"])
+      content = MODELS[direction, kind].parse_obj(raw["content"])
+
+    rpcs.append(RPC.construct(direction=direction, type=kind, content=content))
+
+  return rpcs
@@ -0,0 +1,35 @@
+"""Defines the InstallSnapshot RPC (Remote Procedure Call) as per Figure 5.3."""
+
+from base64 import b64decode
+
+from pydantic import NonNegativeInt, StrictBool, validator
+from utils import Address
+
+from . import BaseRPC
+
+
+class InstallSnapshotRPCRequest(BaseRPC):
+  """Implements InstallSnapshot RPC request arguments."""
+
+  term: NonNegativeInt
+  leader_identity: Address
+  last_included_index: NonNegativeInt
+  last_included_term: NonNegativeInt
+  offset: NonNegativeInt
+  data: bytes
+  done: StrictBool
+
+  @validator("data", pre=True)
+  def data_from_base64(cls, v):
+    """Chunks are base64 encoded within JSON."""
+    return b64decode(v, validate=True) if isinstance(v, str) else v
+
+
+class InstallSnapshotRPCResponse(BaseRPC):
+  """Implements InstallSnapshot RPC response results. Beyond the term, the
+  response tells the leader which chunk the follower expects next."""
+
+  term: NonNegativeInt
+  last_included_index: NonNegativeInt
+  offset: NonNegativeInt
+  done: StrictBool
@@ -0,0 +1,26 @@
+"""Defines the RemoveServer RPC (Remote Procedure Call) as per Figure 4.1."""
+
+from typing import Union
+
+from pydantic import NonNegativeInt, StrictBool
+from utils import Address
+
+from . import BaseRPC
+
+
+class RemoveServerRPCRequest(BaseRPC):
+  """Implements RemoveServer RPC request arguments."""
+
+  request_identity: NonNegativeInt
+  old_server: Address
+  # group of a Multi-Raft host the request is for (see `multi`)
+  group: NonNegativeInt = 0
+
+
+class RemoveServerRPCResponse(BaseRPC):
+  """Implements RemoveServer RPC response results, sent once the configuration
+  without the old server is committed."""
+
+  request_identity: NonNegativeInt
+  success: StrictBool
+  leader_hint: Union[Address, None]
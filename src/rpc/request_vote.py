@@ -1,4 +1,5 @@
-"""Defines the RequestVote RPC (Remote Procedure Call) as per Figure 3.1."""
+"""Defines the RequestVote RPC (Remote Procedure Call) as per Figure 3.1, doubling
+as the PreVote RPC of Section 9.6."""
 
 from pydantic import NonNegativeInt, StrictBool
 from utils import Address
@@ -13,6 +14,10 @@ class RequestVoteRPCRequest(BaseRPC):
   candidate_identity: Address
   last_log_index: NonNegativeInt
   last_log_term: NonNegativeInt
+  # asks whether a vote would be granted in the next term, changing no state
+  pre_vote: StrictBool = False
+  # stands at the request of the leader, which no lease protects against
+  leadership_transfer: StrictBool = False
 
 
 class RequestVoteRPCResponse(BaseRPC):
@@ -20,3 +25,4 @@ class RequestVoteRPCResponse(BaseRPC):
 
   term: NonNegativeInt
   vote_granted: StrictBool
+  pre_vote: StrictBool = False
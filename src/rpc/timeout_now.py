@@ -0,0 +1,15 @@
+"""Defines the TimeoutNow RPC (Remote Procedure Call) as per Section 3.10."""
+
+from pydantic import NonNegativeInt
+from utils import Address
+
+from . import BaseRPC
+
+
+class TimeoutNowRPCRequest(BaseRPC):
+  """Implements TimeoutNow RPC request arguments. The leader sends it to the
+  follower it hands leadership over to, once its log is up to date, so that it
+  starts an election without waiting for its election timeout."""
+
+  term: NonNegativeInt
+  leader_identity: Address
@@ -0,0 +1,28 @@
+"""Defines the TransferLeadership RPC (Remote Procedure Call), through which an
+administrator asks the leader to hand leadership over as per Section 3.10."""
+
+from typing import Union
+
+from pydantic import NonNegativeInt, StrictBool
+from utils import Address
+
+from . import BaseRPC
+
+
+class TransferLeadershipRPCRequest(BaseRPC):
+  """Implements TransferLeadership RPC request arguments. Without a target, the
+  most up-to-date follower is chosen."""
+
+  request_identity: NonNegativeInt
+  target: Union[Address, None]
+  # group of a Multi-Raft host the request is for (see `multi`)
+  group: NonNegativeInt = 0
+
+
+class TransferLeadershipRPCResponse(BaseRPC):
+  """Implements TransferLeadership RPC response results, sent once the leader
+  stepped down for the target or gave up on it."""
+
+  request_identity: NonNegativeInt
+  success: StrictBool
+  leader_hint: Union[Address, None]
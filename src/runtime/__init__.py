@@ -0,0 +1 @@
+from .asynchronous import *
@@ -0,0 +1,161 @@
+"""Defines the asyncio runtime of a server, an alternative to the blocking select
+loop of main.py. The sockets of the transport are watched by the event loop,
+the election and heartbeat deadline is a timer handle rather than polled, and
+fsyncs run on an executor so that the server keeps handling RPCs (and the leader
+keeps replicating its log) while its own writes are made durable. On SIGTERM, a
+leader hands leadership over before the runtime stops."""
+
+from asyncio import AbstractEventLoop, Future, TimerHandle, get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from signal import SIGTERM
+from socket import socket
+from time import perf_counter, time
+from typing import Any, Callable, Dict, List, Union
+
+from state import LOOP_ITERATION_SECONDS, TIMEOUT_LOWER_BOUND, Server
+
+logger = getLogger(__name__)
+
+
+class AsyncioRuntime:
+  """Drives a server from an asyncio event loop.
+
+  Every event (a readable or writable socket, the deadline, a completed flush)
+  is followed by a tick: batched client requests are appended, the leader's
+  replication RPCs are sent at once, a flush of everything else is started if
+  none is running, and commits are applied. Flushes run one at a time on a
+  single thread, so mutations made during one are grouped into the next."""
+
+  def __init__(self, server: Server) -> None:
+    self.server = server
+    self._executor = ThreadPoolExecutor(max_workers=1)
+    # sockets watched for reading and writing, with their file descriptor
+    self._readers: Dict[socket, int] = {}
+    self._writers: Dict[socket, int] = {}
+    self._timer: Union[TimerHandle, None] = None
+    self._flushing = False
+    # when a terminating leader stops waiting for leadership to be handed over
+    self._stopping_until: Union[float, None] = None
+
+  async def serve(self) -> None:
+    """Serve until a handler fails, or until terminated."""
+    self._loop: AbstractEventLoop = get_running_loop()
+    self._finished: Future = self._loop.create_future()
+    self._loop.add_signal_handler(SIGTERM, self._call, self._terminate)
+    # the tick following a batch applied by the server collects it
+    applied = [sock.fileno() for sock in self.server.apply_readers()]
+    for fd in applied:
+      self._loop.add_reader(fd, self._call, lambda: None)
+    self._tick()
+
+    try:
+      await self._finished
+    finally:
+      for fd in applied:
+        self._loop.remove_reader(fd)
+      self._loop.remove_signal_handler(SIGTERM)
+      self._executor.shutdown(wait=True)
+
+  def _call(self, handler: Callable[..., None], *args: Any) -> None:
+    """Run an event handler then a tick, failing the runtime on any exception
+    (as the select loop ends on one)."""
+    started_at = perf_counter()
+
+    try:
+      handler(*args)
+      self._tick()
+      LOOP_ITERATION_SECONDS.observe(perf_counter() - started_at)
+    except Exception as e:
+      if not self._finished.done():
+        self._finished.set_exception(e)
+
+  def _flushed(self, future: Future) -> None:
+    """Complete the flush that has been made durable."""
+    self._flushing = False
+    future.result()
+    self.server.flush_end()
+
+  def _readable(self, sock: socket) -> None:
+    """Handle every message read off a socket."""
+    try:
+      messages = self.server.transport.receive(sock)
+    except OSError:
+      self.server.transport.discard(sock)
+      return
+
+    for data, sender in messages:
+      self.server.rpc_receive(data, sender)
+
+  def _terminate(self) -> None:
+    """Start stopping, handing leadership over first if leading."""
+    if self._stopping_until is None:
+      logger.info("Terminating...")
+      self._stopping_until = time() + TIMEOUT_LOWER_BOUND
+      self.server.transfer_leadership()
+
+  def _tick(self) -> None:
+    """Act on the server after an event, then re-arm the deadline and watch the
+    sockets the transport now needs."""
+    server = self.server
+    server.expire_client_batch()
+    server.send_ahead()
+
+    if not self._flushing and server.is_flush_needed():
+      self._flushing = True
+      self._loop.run_in_executor(
+        self._executor, server.flush_begin()
+      ).add_done_callback(lambda future: self._call(self._flushed, future))
+
+    server.apply_commits()
+
+    if self._timer is not None:
+      self._timer.cancel()
+    self._timer = self._loop.call_later(
+      max(0, server.deadline() - time()), self._call, self._timed_out
+    )
+
+    self._watch(self._readers, server.transport.readers(), reader=True)
+    self._watch(self._writers, server.transport.writers(), reader=False)
+
+    # stop once leadership was handed over (or given up on) and sent off
+    if (
+      self._stopping_until is not None
+      and (not server.is_leader() or time() >= self._stopping_until)
+      and not self._flushing
+      and not server.is_flush_needed()
+      and not self._finished.done()
+    ):
+      self._finished.set_result(None)
+
+  def _timed_out(self) -> None:
+    """Start a heartbeat or an election once the deadline passed (the deadline
+    may also be that of a client batch, appended by the tick)."""
+    self._timer = None
+
+    if self.server.is_timed_out():
+      if self.server.is_leader():
+        self.server.start_heartbeat()
+      else:
+        self.server.start_election()
+
+  def _watch(
+    self, watched: Dict[socket, int], sockets: List[socket], reader: bool
+  ) -> None:
+    """Make the event loop watch exactly the given sockets. Sockets are removed
+    by the descriptor they were added with, as they may have been closed."""
+    for sock in [sock for sock in watched if sock not in sockets]:
+      fd = watched.pop(sock)
+      if reader:
+        self._loop.remove_reader(fd)
+      else:
+        self._loop.remove_writer(fd)
+
+    for sock in sockets:
+      if sock not in watched:
+        watched[sock] = sock.fileno()
+        if reader:
+          self._loop.add_reader(watched[sock], self._call, self._readable, sock)
+        else:
+          write = self.server.transport.write
+          self._loop.add_writer(watched[sock], self._call, write, sock)
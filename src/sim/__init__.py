@@ -0,0 +1,3 @@
+from .clock import *
+from .network import *
+from .cluster import *
@@ -0,0 +1,68 @@
+"""Defines the virtual clock of the simulator. Time only moves when the clock
+runs the next scheduled callback, jumping straight to when it was due, so that
+seconds of timeouts cost nothing and every run with the same seed is the same."""
+
+from heapq import heappop, heappush
+from typing import Any, Callable, List, Set, Tuple
+
+
+class VirtualClock:
+  """Clock read by servers in place of the system time, and scheduler of every
+  event of a simulation (deliveries, timeouts, completed writes)."""
+
+  def __init__(self, start: float = 0) -> None:
+    self.now = start
+    # when callbacks are due, in order of scheduling among those due together
+    self._events: List[Tuple[float, int, Callable[..., None], Tuple[Any, ...]]] = []
+    self._scheduled = 0
+    self._cancelled: Set[int] = set()
+
+  def __call__(self) -> float:
+    return self.now
+
+  def call_at(self, when: float, callback: Callable[..., None], *args: Any) -> int:
+    """Schedule a callback, returning a handle to cancel it with."""
+    self._scheduled += 1
+    heappush(self._events, (max(when, self.now), self._scheduled, callback, args))
+    return self._scheduled
+
+  def call_later(self, delay: float, callback: Callable[..., None], *args: Any) -> int:
+    """Schedule a callback after a delay, returning a handle to cancel it with."""
+    return self.call_at(self.now + delay, callback, *args)
+
+  def cancel(self, handle: int) -> None:
+    """Cancel a scheduled callback."""
+    self._cancelled.add(handle)
+
+  def run(self, duration: float) -> None:
+    """Run every callback due within a duration, then move to its end."""
+    end = self.now + duration
+
+    while self._events and self._events[0][0] <= end:
+      self.step()
+
+    self.now = end
+
+  def run_until(self, predicate: Callable[[], bool], timeout: float) -> bool:
+    """Run callbacks until a predicate holds, for at most a duration. Returns
+    whether the predicate held."""
+    end = self.now + timeout
+
+    while not predicate():
+      if not self._events or self._events[0][0] > end:
+        self.now = end
+        return predicate()
+      self.step()
+
+    return True
+
+  def step(self) -> None:
+    """Run the next callback due, moving to when it was due."""
+    when, handle, callback, args = heappop(self._events)
+
+    if handle in self._cancelled:
+      self._cancelled.discard(handle)
+      return
+
+    self.now = when
+    callback(*args)
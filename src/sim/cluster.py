@@ -0,0 +1,255 @@
+"""Defines a cluster of servers running in one process over the simulated
+network, with in-memory storage and a virtual clock. Every server is driven as
+the asyncio runtime drives it: each event (a delivered message, the deadline, a
+completed write) is followed by a tick, and writes take a fixed time to become
+durable while the leader keeps replicating."""
+
+from random import Random
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from db import DatabaseDriver
+from rpc import (
+  AddServerRPCRequest,
+  BaseRPC,
+  ClientRequestRPCRequest,
+  RemoveServerRPCRequest,
+)
+from rpc.codec import decode, encode
+from state import Server
+from utils import Address, RPC, RPCDirection, RPCType
+
+from .clock import VirtualClock
+from .network import NETWORK_JITTER, NETWORK_LATENCY, SimulatedNetwork
+from .network import SimulatedTransport
+
+DISK_LATENCY: float = 0.0002  # seconds per write made durable
+CLIENT_TIMEOUT: float = 1  # seconds before a client request is given up on
+# the deadline is only passed strictly after it
+TIMER_RESOLUTION: float = 1e-6  # seconds
+
+
+class SimulatedCluster:
+  """Servers of one cluster, sharing a virtual clock and a simulated network.
+  The same seed always yields the same run."""
+
+  def __init__(
+    self,
+    size: int = 3,
+    latency: float = NETWORK_LATENCY,
+    jitter: float = NETWORK_JITTER,
+    loss: float = 0,
+    disk_latency: float = DISK_LATENCY,
+    seed: int = 0,
+    base_port: int = 5000,
+    **options: Any,
+  ) -> None:
+    self.seed = seed
+    self.clock = VirtualClock()
+    self.network = SimulatedNetwork(self.clock, latency, jitter, loss, seed)
+    self.disk_latency = disk_latency
+    self.options = options
+    # the initial configuration, whatever servers were started since
+    self.addresses = [Address(port=base_port + i) for i in range(size)]
+    self.servers: Dict[Address, Server] = {}
+    # whether a write of a server is being made durable, and its deadline timer
+    self._flushing: Dict[Address, bool] = {}
+    self._timers: Dict[Address, Tuple[float, int]] = {}
+    # servers started so far, each drawing from a generator of its own
+    self._started = 0
+
+    for address in self.addresses:
+      self.start(address)
+
+  def _deliverer(self, address: Address) -> Callable[[bytes, Address], None]:
+    """Return the callback handling the messages delivered to a server."""
+
+    def deliver(data: bytes, sender: Address) -> None:
+      self.servers[address].rpc_receive(data, sender)
+      self._tick(address)
+
+    return deliver
+
+  def _flushed(self, address: Address) -> None:
+    """Complete the write of a server that has been made durable."""
+    self._flushing[address] = False
+    self.servers[address].flush_end()
+    self._tick(address)
+
+  def _tick(self, address: Address) -> None:
+    """Act on a server after an event, then re-arm its deadline."""
+    server = self.servers[address]
+    server.expire_client_batch()
+    server.send_ahead()
+
+    if not self._flushing[address] and server.is_flush_needed():
+      self._flushing[address] = True
+      server.flush_begin()()
+      self.clock.call_later(self.disk_latency, self._flushed, address)
+
+    server.apply_commits()
+
+    deadline = server.deadline() + TIMER_RESOLUTION
+    if address not in self._timers or self._timers[address][0] != deadline:
+      if address in self._timers:
+        self.clock.cancel(self._timers[address][1])
+      handle = self.clock.call_at(deadline, self._timed_out, address)
+      self._timers[address] = (deadline, handle)
+
+  def _timed_out(self, address: Address) -> None:
+    """Start a heartbeat or an election once the deadline passed."""
+    server = self.servers[address]
+    del self._timers[address]
+
+    if server.is_timed_out():
+      if server.is_leader():
+        server.start_heartbeat()
+      else:
+        server.start_election()
+
+    self._tick(address)
+
+  def cut(self, sender: Address, receiver: Address) -> None:
+    """Drop every message from a server to another, but not the other way."""
+    self.network.cut(sender, receiver)
+
+  def heal(self) -> None:
+    """Remove every partition and cut link."""
+    self.network.heal()
+
+  def leader(self) -> Union[Address, None]:
+    """Return the leader of the latest term, if there is one."""
+    leaders = [
+      (server._state.current_term, address)
+      for address, server in self.servers.items()
+      if server.is_leader()
+    ]
+    return max(leaders, key=lambda leader: leader[0])[1] if leaders else None
+
+  def partition(self, *groups: List[Address]) -> None:
+    """Split the servers into groups that cannot reach one another."""
+    self.network.partition(*groups)
+
+  def start(self, address: Address) -> Server:
+    """Start a server with an empty log. Outside of the initial configuration,
+    it waits to be added to the cluster."""
+    self._started += 1
+    server = Server(
+      addresses=self.addresses,
+      transport=SimulatedTransport(network=self.network),
+      driver=DatabaseDriver(directory=None),
+      clock=self.clock,
+      rng=Random(self.seed + self._started),
+      # entries are applied inline, every event happening on the virtual clock
+      apply_in_background=False,
+      **self.options,
+    )
+    server.init_sock(address.port)
+    self.servers[address] = server
+    self._flushing[address] = False
+    self.network.attach(address, self._deliverer(address))
+    self._tick(address)
+
+    return server
+
+  def run(self, duration: float) -> None:
+    """Run the cluster for a duration of virtual time."""
+    self.clock.run(duration)
+
+  def run_until(self, predicate: Callable[[], bool], timeout: float) -> bool:
+    """Run the cluster until a predicate holds, for at most a duration of
+    virtual time. Returns whether the predicate held."""
+    return self.clock.run_until(predicate, timeout)
+
+
+class SimulatedClient:
+  """Client sending requests to the leader of a simulated cluster, and calling
+  back with the outcome and latency of each (a request unanswered in time
+  failed)."""
+
+  def __init__(self, cluster: SimulatedCluster, address: Address) -> None:
+    self.cluster = cluster
+    self.address = address
+    self._request_count = 0
+    # requests waiting for a response: when they were sent, and their callback
+    self._pending: Dict[int, Tuple[float, Callable[[bool, float], None]]] = {}
+    cluster.network.attach(address, self._receive)
+
+  def _expire(self, request_identity: int) -> None:
+    """Fail a request unanswered in time."""
+    if request_identity in self._pending:
+      sent_at, callback = self._pending.pop(request_identity)
+      callback(False, self.cluster.clock() - sent_at)
+
+  def _receive(self, data: bytes, sender: Address) -> None:
+    """Call back for every response received."""
+    for rpc in decode(data):
+      if rpc.content.request_identity in self._pending:
+        sent_at, callback = self._pending.pop(rpc.content.request_identity)
+        callback(rpc.content.success, self.cluster.clock() - sent_at)
+
+  def _send(
+    self,
+    type: RPCType,
+    content: Callable[[int], BaseRPC],
+    callback: Callable[[bool, float], None],
+    timeout: float,
+  ) -> None:
+    """Send a request, built given its request identity, to the leader (any
+    server if there is none, which fails it)."""
+    self._request_count += 1
+    self._pending[self._request_count] = (self.cluster.clock(), callback)
+    self.cluster.clock.call_later(timeout, self._expire, self._request_count)
+
+    rpc = RPC(
+      direction=RPCDirection.REQUEST,
+      type=type,
+      content=content(self._request_count),
+    )
+    leader = self.cluster.leader() or self.cluster.addresses[0]
+    self.cluster.network.send(encode(rpc), self.address, leader)
+
+  def add_server(
+    self,
+    address: Address,
+    callback: Callable[[bool, float], None],
+    timeout: float = CLIENT_TIMEOUT,
+  ) -> None:
+    """Ask the leader to add a server, which must have been started."""
+    self._send(
+      RPCType.ADD_SERVER,
+      lambda request_identity: AddServerRPCRequest(
+        request_identity=request_identity, new_server=address
+      ),
+      callback,
+      timeout,
+    )
+
+  def remove_server(
+    self,
+    address: Address,
+    callback: Callable[[bool, float], None],
+    timeout: float = CLIENT_TIMEOUT,
+  ) -> None:
+    """Ask the leader to remove a server."""
+    self._send(
+      RPCType.REMOVE_SERVER,
+      lambda request_identity: RemoveServerRPCRequest(
+        request_identity=request_identity, old_server=address
+      ),
+      callback,
+      timeout,
+    )
+
+  def request(
+    self, key: str, value: str, callback: Callable[[bool, float], None]
+  ) -> None:
+    """Send a request setting a key to the leader (any server if there is none,
+    which fails it)."""
+    self._send(
+      RPCType.CLIENT_REQUEST,
+      lambda request_identity: ClientRequestRPCRequest(
+        request_identity=request_identity, key=key, value=value
+      ),
+      callback,
+      CLIENT_TIMEOUT,
+    )
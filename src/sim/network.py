@@ -0,0 +1,119 @@
+"""Defines the simulated network carrying messages between servers (and clients)
+sharing a process. Every message is delivered after a latency (plus a random
+jitter), unless it is lost, the sender and receiver are partitioned, or the link
+from the sender to the receiver is cut (one way only, as an asymmetric fault)."""
+
+from random import Random
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from transport import BaseTransport
+from utils import Address
+
+from .clock import VirtualClock
+
+NETWORK_LATENCY: float = 0.0005  # seconds, one way
+NETWORK_JITTER: float = 0.0001  # seconds
+
+_Deliver = Callable[[bytes, Address], None]
+
+
+class SimulatedNetwork:
+  """Network of attached addresses, counting the messages and bytes sent."""
+
+  def __init__(
+    self,
+    clock: VirtualClock,
+    latency: float = NETWORK_LATENCY,
+    jitter: float = NETWORK_JITTER,
+    loss: float = 0,
+    seed: int = 0,
+  ) -> None:
+    self.clock = clock
+    self.latency = latency
+    self.jitter = jitter
+    self.loss = loss
+    self._random = Random(seed)
+    self._attached: Dict[Address, _Deliver] = {}
+    # partition of every address in a group, others reach every address
+    self._groups: Dict[Address, int] = {}
+    # links cut one way, from a sender to a receiver
+    self._cut: Set[Tuple[Address, Address]] = set()
+    self.messages_sent = 0
+    self.bytes_sent = 0
+
+  def _deliver(self, data: bytes, sender: Address, receiver: Address) -> None:
+    """Hand a message over, if the receiver is still attached."""
+    if receiver in self._attached:
+      self._attached[receiver](data, sender)
+
+  def attach(self, address: Address, deliver: _Deliver) -> None:
+    """Deliver the messages sent to an address to a callback."""
+    self._attached[address] = deliver
+
+  def cut(self, sender: Address, receiver: Address) -> None:
+    """Drop every message from a sender to a receiver, but not the other way."""
+    self._cut.add((sender, receiver))
+
+  def detach(self, address: Address) -> None:
+    """Stop delivering messages to an address (those in flight are lost)."""
+    self._attached.pop(address, None)
+
+  def heal(self) -> None:
+    """Remove every partition and cut link."""
+    self._groups = {}
+    self._cut = set()
+
+  def is_reachable(self, sender: Address, receiver: Address) -> bool:
+    """Indicate if messages from a sender get through to a receiver."""
+    if (sender, receiver) in self._cut:
+      return False
+    if sender not in self._groups or receiver not in self._groups:
+      return True
+    return self._groups[sender] == self._groups[receiver]
+
+  def partition(self, *groups: Iterable[Address]) -> None:
+    """Split the addresses into groups that cannot reach one another."""
+    self._groups = {address: i for i, group in enumerate(groups) for address in group}
+
+  def send(self, data: bytes, sender: Address, receiver: Address) -> None:
+    """Send a message, to be delivered after the latency unless dropped."""
+    self.messages_sent += 1
+    self.bytes_sent += len(data)
+
+    if not self.is_reachable(sender, receiver):
+      return
+    if self.loss and self._random.random() < self.loss:
+      return
+
+    delay = self.latency + self._random.uniform(0, self.jitter)
+    self.clock.call_later(delay, self._deliver, data, sender, receiver)
+
+
+class SimulatedTransport(BaseTransport):
+  """Transport of a server over the simulated network. Messages are delivered
+  by the network itself, so there are no sockets to wait on."""
+
+  network: SimulatedNetwork
+
+  def discard(self, sock: object) -> None:
+    pass
+
+  def open(self, address: Address) -> None:
+    """Take an address on the network (messages are attached by the cluster)."""
+    self.address = address
+
+  def readers(self) -> List:
+    return []
+
+  def receive(self, sock: object) -> List:
+    return []
+
+  def send(self, message: bytes, addr: Address) -> None:
+    """Send a message over the network."""
+    if self.address is None:
+      raise RuntimeError("Ensure that transport is open.")
+    self.network.send(message, self.address, addr)
+
+  def send_many(self, messages: List[bytes], addr: Address) -> None:
+    """Send the messages coalesced into one, as a datagram would carry them."""
+    self.send(b"".join(messages), addr)
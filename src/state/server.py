@@ -1,98 +1,775 @@
 """Defines the server handling different operations."""
 
-from random import uniform
-from socket import SOL_SOCKET, socket, AF_INET, SOCK_DGRAM, SO_REUSEADDR
+from collections import deque
+from enum import Enum
+from logging import getLogger
+from random import Random
+from socket import socket
+from struct import error as StructError
 from time import time
-from typing import Dict, List, Set, Union
+from typing import Callable, Deque, Dict, List, Set, Tuple, Union
 
-from pydantic import BaseModel, Extra, NonNegativeInt, StrictBool, ValidationError
-from db import Entry
-from roles import BaseRole, CandidateRole, FollowerRole, LeaderRole
+from pydantic import (
+  BaseModel,
+  Extra,
+  Field,
+  NonNegativeFloat,
+  NonNegativeInt,
+  PositiveInt,
+  StrictBool,
+  ValidationError,
+)
+from db import CONFIGURATION_KEY, ApplyStage, Configuration, DatabaseDriver, Entry
+from roles import (
+  BaseRole,
+  CandidateRole,
+  FollowerRole,
+  LeaderRole,
+  PreCandidateRole,
+  SharedState,
+)
 from rpc import (
+  AddServerRPCRequest,
+  AddServerRPCResponse,
   AppendEntriesRPCRequest,
   AppendEntriesRPCResponse,
+  ClientQueryRPCRequest,
+  ClientQueryRPCResponse,
+  ClientRequestRPCRequest,
+  ClientRequestRPCResponse,
+  InstallSnapshotRPCRequest,
+  InstallSnapshotRPCResponse,
+  RemoveServerRPCRequest,
+  RemoveServerRPCResponse,
   RequestVoteRPCRequest,
   RequestVoteRPCResponse,
+  TimeoutNowRPCRequest,
+  TransferLeadershipRPCRequest,
+  TransferLeadershipRPCResponse,
 )
+from rpc.codec import Codec, Encoded, decode, encode, encode_entries
+from transport import BaseTransport, UDPTransport
 from utils.address import Address
-from utils.models import FrozenModel
+from utils.metrics import SIZE_BUCKETS, Counter, Gauge, Histogram
 from utils.rpc import RPC, RPCDirection, RPCType
 
+logger = getLogger(__name__)
+
 TIMEOUT_LOWER_BOUND: float = 5  # seconds
 TIMEOUT_UPPER_BOUND: float = 8  # seconds
 
+CLIENT_BATCH_SIZE: int = 64  # requests
+CLIENT_BATCH_LINGER: float = 0.002  # seconds
+
+# fraction of the lease given up to account for clocks running at different rates
+LEASE_CLOCK_DRIFT: float = 0.1
+
+APPEND_ENTRIES_MAX_ENTRIES: int = 512  # entries per AppendEntries RPC
+APPEND_ENTRIES_MAX_BYTES: int = 32 * 1024  # fits within a datagram once encoded
+PIPELINE_WINDOW: int = 4  # AppendEntries RPCs in flight per follower
+
+# estimated bytes taken by an entry besides its key and value
+ENTRY_OVERHEAD_BYTES: int = 24
+
+SNAPSHOT_THRESHOLD: int = 4096  # entries applied since the last snapshot
+SNAPSHOT_CHUNK_BYTES: int = 32 * 1024  # fits within a datagram once encoded
+
+LEARNER_MAX_LAG: int = 512  # entries behind the leader when a learner may vote
+
+RPCS_RECEIVED = Counter(
+  "raft_rpcs_received_total", "RPCs received.", ("direction", "type")
+)
+RPCS_SENT = Counter("raft_rpcs_sent_total", "RPCs sent.", ("direction", "type"))
+APPEND_ENTRIES_ENTRIES = Histogram(
+  "raft_append_entries_entries", "Entries per AppendEntries RPC sent.", SIZE_BUCKETS
+)
+MATCH_INDEX_LAG = Gauge(
+  "raft_match_index_lag",
+  "Entries of the leader past the match index of a follower, as of its last "
+  "response.",
+  ("group", "follower"),
+)
+COMMIT_APPLY_SECONDS = Histogram(
+  "raft_commit_apply_seconds", "Delay from entries committing to being applied."
+)
+PRE_VOTES_STARTED = Counter("raft_pre_votes_started_total", "Pre-votes started.")
+ELECTIONS_STARTED = Counter("raft_elections_started_total", "Elections started.")
+ELECTIONS_WON = Counter("raft_elections_won_total", "Elections won.")
+LEADERSHIP_TRANSFERS = Counter(
+  "raft_leadership_transfers_total",
+  "Leadership transfers started by this leader, by outcome.",
+  ("outcome",),
+)
+MEMBERSHIP_CHANGES = Counter(
+  "raft_membership_changes_total",
+  "Configuration entries appended by this leader, by change.",
+  ("change",),
+)
+QUORUM_LOSSES = Counter(
+  "raft_quorum_losses_total",
+  "Leaders stepping down for not hearing from a majority in an election timeout.",
+)
+# gauges of the state of a server are labelled with its Raft group, as the
+# servers of a Multi-Raft host share them
+CURRENT_TERM = Gauge("raft_current_term", "Current term.", ("group",))
+COMMIT_INDEX = Gauge(
+  "raft_commit_index", "Index of the last committed entry.", ("group",)
+)
+LAST_APPLIED_INDEX = Gauge(
+  "raft_last_applied_index", "Index of the last applied entry.", ("group",)
+)
+LOOP_ITERATION_SECONDS = Histogram(
+  "raft_loop_iteration_seconds", "Time handling events, excluding waiting on them."
+)
+
+
+class Replication(str, Enum):
+  """How the leader replicates its log to a follower. While probing, where the
+  logs match is unknown, so one AppendEntries RPC at a time is sent. Once one
+  succeeds, batches are pipelined, optimistically advancing the next index. A
+  follower missing compacted entries is sent the snapshot instead."""
 
-class _CaptureTerm(FrozenModel):
-  term: Union[NonNegativeInt, None] = None
+  PROBE = "probe"
+  PIPELINE = "pipeline"
+  SNAPSHOT = "snapshot"
 
 
 class Server(BaseModel):
   """Define server model."""
 
-  _entries_sent: Dict[Address, NonNegativeInt]
-  _role: BaseRole = FollowerRole(commit_index=0, last_applied_index=0)
-  _votes: Set[Address] = set()
-  sock: Union[socket, None] = None
+  _entries_sent: Dict[
+    Address, Dict[NonNegativeInt, Tuple[NonNegativeInt, NonNegativeInt]]
+  ]
+  _replication: Dict[Address, Replication]
+  _leader: Union[Address, None] = None
+  _role: BaseRole = FollowerRole()
+  _state: SharedState
+  _votes: Set[Address]
+  transport: BaseTransport = Field(default_factory=UDPTransport)
+  driver: DatabaseDriver = Field(default_factory=DatabaseDriver)
+  clock: Callable[[], float] = time
+  # election timeouts are drawn from it, seeded for reproducible runs
+  rng: Random = Field(default_factory=Random)
+  codec: Codec = Codec.BINARY
   addresses: List[Address]
-  timeout: float = time() + uniform(TIMEOUT_LOWER_BOUND, TIMEOUT_UPPER_BOUND)
+  timeout: float = 0
+  client_batch_size: PositiveInt = CLIENT_BATCH_SIZE
+  client_batch_linger: NonNegativeFloat = CLIENT_BATCH_LINGER
+  read_lease: StrictBool = False
+  pre_vote: StrictBool = True
+  check_quorum: StrictBool = True
+  append_entries_max_entries: PositiveInt = APPEND_ENTRIES_MAX_ENTRIES
+  append_entries_max_bytes: PositiveInt = APPEND_ENTRIES_MAX_BYTES
+  pipeline_window: PositiveInt = PIPELINE_WINDOW
+  snapshot_threshold: PositiveInt = SNAPSHOT_THRESHOLD
+  learner_max_lag: NonNegativeInt = LEARNER_MAX_LAG
+  preferred_leader: Union[Address, None] = None
+  apply_in_background: StrictBool = True
+  group: NonNegativeInt = 0
 
   class Config:
     arbitrary_types_allowed = True
     extra = Extra.allow
 
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._state = SharedState(
+      driver=self.driver,
+      stage=ApplyStage(self.driver.apply, threaded=self.apply_in_background),
+    )
+    # configuration until the log holds one: every address given votes
+    self._initial_configuration = Configuration(voters=self.addresses)
+    self._votes = set()
+    self._timeout_reset()
+    # RPCs held back until the mutations preceding them are durable
+    self._outbox: List[Tuple[RPC, Address]] = []
+    # client requests waiting to be appended to the log as one batch
+    self._client_batch: List[Tuple[ClientRequestRPCRequest, Address]] = []
+    self._client_batch_deadline: float = 0
+    # client requests appended to the log, waiting for their entry to commit
+    self._client_waiting: Dict[
+      NonNegativeInt, Tuple[ClientRequestRPCRequest, Address]
+    ] = {}
+    # number of AppendEntries RPCs sent, identifying each of them
+    self._request_count: NonNegativeInt = 0
+    # client queries waiting for a round of heartbeats to confirm leadership
+    self._queries_pending: List[Tuple[ClientQueryRPCRequest, Address]] = []
+    # client queries of the current round, which counts the followers answering
+    # AppendEntries RPCs sent from the first request of the round onwards
+    self._queries_round: List[Tuple[ClientQueryRPCRequest, Address]] = []
+    self._round_first_request: NonNegativeInt = 0
+    self._round_read_index: NonNegativeInt = 0
+    self._round_acknowledged: Set[Address] = set()
+    # confirmed client queries, answered once their read index is applied
+    self._queries_ready: List[
+      Tuple[NonNegativeInt, ClientQueryRPCRequest, Address]
+    ] = []
+    # when AppendEntries RPCs were sent, and the latest one each follower answered
+    self._request_sent_at: Dict[NonNegativeInt, float] = {}
+    self._acknowledged_at: Dict[Address, float] = {}
+    # when the current leader was last heard from
+    self._leader_contact: float = 0
+    # when each follower was last heard from by this leader, for check-quorum
+    self._follower_contact: Dict[Address, float] = {}
+    # follower leadership is being handed over to, when the transfer is given up
+    # on, whether it was told to stand, and the administrators waiting on it
+    self._transfer_target: Union[Address, None] = None
+    self._transfer_deadline: float = 0
+    self._transfer_timeout_sent: StrictBool = False
+    self._transfer_waiting: List[Tuple[TransferLeadershipRPCRequest, Address]] = []
+    # administrators waiting for their membership change to be committed
+    self._membership_waiting: List[
+      Tuple[Union[AddServerRPCRequest, RemoveServerRPCRequest], Address]
+    ] = []
+    # flushes started, oldest first: the term and last log index they make
+    # durable, and the RPCs waiting on them
+    self._flushing: List[
+      Tuple[NonNegativeInt, NonNegativeInt, List[Tuple[RPC, Address]]]
+    ] = []
+    # offset of the next snapshot chunk to send to each follower behind the log
+    self._snapshot_offsets: Dict[Address, NonNegativeInt] = {}
+    # commit indices not applied yet, and when they were committed
+    self._committed_at: Deque[Tuple[NonNegativeInt, float]] = deque()
+
+  def _client_answer_queries(self) -> None:
+    """Answer every confirmed client query whose read index has been applied."""
+    answered = 0
+
+    # read indices never decrease, so stop at the first one not yet applied
+    for read_index, req, sender in self._queries_ready:
+      if read_index > self._state.last_applied_index:
+        break
+
+      self._rpc_send(self._client_query_response(req, success=True), sender)
+      answered += 1
+
+    del self._queries_ready[:answered]
+
+  def _client_batch_append(self) -> None:
+    """Append every batched client request to the log in one persistence call,
+    then start replicating the new entries right away."""
+    if isinstance(self._role, LeaderRole) and self._client_batch:
+      batch, self._client_batch = self._client_batch, []
+      first_index = len(self._state.log)
+
+      self._state.extend_log(
+        [
+          Entry(
+            index=first_index + i,
+            term=self._state.current_term,
+            key=req.key,
+            value=req.value,
+          )
+          for i, (req, _) in enumerate(batch)
+        ]
+      )
+
+      for i, waiting in enumerate(batch):
+        self._client_waiting[first_index + i] = waiting
+
+      self._rpc_send_append_entries(idle_only=True)
+
+  def _client_reply_committed(self) -> None:
+    """Reply to every client whose entry is now covered by the commit index."""
+    # entries wait in log order, so stop at the first uncommitted one
+    while self._client_waiting:
+      index = next(iter(self._client_waiting))
+
+      if index > self._state.commit_index:
+        break
+
+      req, sender = self._client_waiting.pop(index)
+      self._rpc_send(self._client_request_response(req, success=True), sender)
+
+  def _client_query_response(
+    self, req: ClientQueryRPCRequest, success: StrictBool
+  ) -> RPC:
+    """Build the response to a client query, reading the state machine."""
+    return RPC(
+      direction=RPCDirection.RESPONSE,
+      type=RPCType.CLIENT_QUERY,
+      content=ClientQueryRPCResponse(
+        request_identity=req.request_identity,
+        success=success,
+        value=self.driver.get_db(req.key) if success else None,
+        leader_hint=self._leader,
+      ),
+    )
+
+  def _client_reply_failed(self) -> None:
+    """Reply to every pending client that its request may not have been applied
+    (or its query not served), pointing it at the current leader if known."""
+    pending = self._client_batch + list(self._client_waiting.values())
+    self._client_batch, self._client_waiting = [], {}
+
+    for req, sender in pending:
+      self._rpc_send(self._client_request_response(req, success=False), sender)
+
+    queries = (
+      self._queries_pending
+      + self._queries_round
+      + [(req, sender) for _, req, sender in self._queries_ready]
+    )
+    self._queries_pending, self._queries_round, self._queries_ready = [], [], []
+
+    for req, sender in queries:
+      self._rpc_send(self._client_query_response(req, success=False), sender)
+
+  def _client_request_response(
+    self, req: ClientRequestRPCRequest, success: StrictBool
+  ) -> RPC:
+    """Build the response to a client request."""
+    return RPC(
+      direction=RPCDirection.RESPONSE,
+      type=RPCType.CLIENT_REQUEST,
+      content=ClientRequestRPCResponse(
+        request_identity=req.request_identity,
+        success=success,
+        leader_hint=self._leader,
+      ),
+    )
+
+  def _commit_advance(self) -> None:
+    """Advance the commit index to the highest entry stored on a majority of
+    voters, if it is of the current term. Called whenever a match index grows."""
+    if isinstance(self._role, LeaderRole):
+      # the match index of the median voter is held by a majority of voters
+      voters = self._configuration().voters
+      match_indices = sorted(
+        (self._role.match_index[voter] for voter in voters), reverse=True
+      )
+      N = match_indices[len(voters) // 2]
+
+      # terms never decrease along the log, so no earlier entry is of this term
+      if (
+        N > self._state.commit_index
+        and self._state.log.term(N) == self._state.current_term
+      ):
+        self._commit_update(N)
+
+      self._client_reply_committed()
+      self._read_round_start()
+      self._membership_continue()
+
+  def _commit_update(self, index: NonNegativeInt) -> None:
+    """Advance the commit index, noting when for the commit-to-apply delay."""
+    self._state.commit_index = index
+    self._committed_at.append((index, self.clock()))
+
+  def _configuration(self) -> Configuration:
+    """Return the configuration in use: the latest one in the log, committed or
+    not, else the initial one."""
+    return self._state.configuration() or self._initial_configuration
+
+  def _configuration_append(self, configuration: Configuration) -> None:
+    """Append a configuration entry, which takes effect at once (Section 4.1),
+    then start replicating it, to the servers added as well."""
+    self._state.extend_log(
+      [
+        Entry(
+          index=len(self._state.log),
+          term=self._state.current_term,
+          key=CONFIGURATION_KEY,
+          value=configuration.to_value(),
+        )
+      ]
+    )
+
+    for address in configuration.members():
+      self._member_track(address)
+
+    self._rpc_send_append_entries(idle_only=True)
+
+  def _configuration_changeable(self) -> StrictBool:
+    """Indicate if this leader may append a configuration entry: one change at a
+    time, once the previous one and an entry of its own term are committed, and
+    not while handing leadership over."""
+    return (
+      isinstance(self._role, LeaderRole)
+      and self._transfer_target is None
+      and self._state.configuration_index() <= self._state.commit_index
+      and self._state.log.term(self._state.commit_index) == self._state.current_term
+    )
+
+  def _election_start(self, leadership_transfer: StrictBool = False) -> None:
+    """Stand for election in the next term, requesting votes from every other
+    server (at the request of the leader if leadership is transferred to us)."""
+    self._state.update_current_term(NonNegativeInt(self._state.current_term + 1))
+    self._role_promote_to_candidate()
+    self._state.update_voted_for(self._id())
+    ELECTIONS_STARTED.inc()
+    self._votes = {self._id()}
+    self._leader = None
+    self._timeout_reset()
+    self._vote_request(
+      self._state.current_term,
+      pre_vote=False,
+      leadership_transfer=leadership_transfer,
+    )
+
   def _id(self) -> Address:
     """Return server identification."""
-    if self.sock is not None:
-      host, port = self.sock.getsockname()
-      return Address(host=host, port=port)
+    if self.transport.address is not None:
+      return self.transport.address
     else:
       raise RuntimeError("Ensure that socket is set.")
 
-  def _role_demote_if_necessary(self, capture: _CaptureTerm) -> None:
+  def _lease_protects_leader(self, rpc: RPC) -> StrictBool:
+    """Indicate if a RequestVote RPC request must be ignored because the current
+    leader was heard from too recently for its lease to have expired. Under
+    check-quorum, a leader that lost its majority steps down before then, so a
+    server that was cut off cannot depose a healthy one (Section 4.2.3)."""
+    return (
+      (self.read_lease or self.check_quorum)
+      and rpc.direction == RPCDirection.REQUEST
+      and rpc.type == RPCType.REQUEST_VOTE
+      and not rpc.content.pre_vote
+      and not rpc.content.leadership_transfer
+      and not isinstance(self._role, LeaderRole)
+      and self._leader is not None
+      and self.clock() - self._leader_contact < TIMEOUT_LOWER_BOUND
+    )
+
+  def _lease_valid(self) -> StrictBool:
+    """Indicate if a majority acknowledged AppendEntries RPCs sent recently
+    enough that none of them can have elected another leader since."""
+    since = self.clock() - TIMEOUT_LOWER_BOUND * (1 - LEASE_CLOCK_DRIFT)
+    acknowledged = {
+      address
+      for address, sent_at in self._acknowledged_at.items()
+      if sent_at > since
+    }
+
+    return self._majority(acknowledged | {self._id()})
+
+  def _majority(self, servers: Set[Address]) -> StrictBool:
+    """Indicate if servers make up a majority of the voters."""
+    voters = self._configuration().voters
+    return sum(voter in servers for voter in voters) * 2 > len(voters)
+
+  def _member_track(self, address: Address) -> None:
+    """Start replicating to a server this leader does not replicate to yet."""
+    if address not in self._role.next_index:
+      self._role.next_index[address] = len(self._state.log)
+      self._role.match_index[address] = 0
+      self._entries_sent[address] = {}
+      self._replication[address] = Replication.PROBE
+      self._follower_contact[address] = self.clock()
+
+  def _membership_continue(self) -> None:
+    """Answer every administrator whose membership change is committed, then
+    step down if this leader is no longer a voter, or else make a voter of a
+    learner that caught up."""
+    if not isinstance(self._role, LeaderRole):
+      return
+
+    configuration = self._configuration()
+
+    if self._state.configuration_index() <= self._state.commit_index:
+      waiting, self._membership_waiting = self._membership_waiting, []
+
+      for req, sender in waiting:
+        if (
+          isinstance(req, AddServerRPCRequest)
+          and req.new_server in configuration.voters
+        ) or (
+          isinstance(req, RemoveServerRPCRequest)
+          and req.old_server not in configuration.members()
+        ):
+          self._rpc_send(self._membership_response(req, success=True), sender)
+        else:
+          self._membership_waiting.append((req, sender))
+
+      # a leader removed keeps leading until the change is committed (Section
+      # 4.2.2), then has the most up-to-date voter stand without waiting
+      if self._id() not in configuration.voters:
+        logger.info("Stepping down, removed from the configuration.")
+        self._timeout_now_send(
+          max(configuration.voters, key=lambda voter: self._role.match_index[voter])
+        )
+        self._leader = None
+        self._role_demote_to_follower()
+        self._timeout_reset()
+        return
+
+    if self._configuration_changeable():
+      last_index = len(self._state.log) - 1
+
+      for learner in configuration.learners:
+        # the learner must have answered, a fresh one is far behind whatever its
+        # match index
+        if (
+          self._replication[learner] == Replication.PIPELINE
+          and last_index - self._role.match_index[learner] <= self.learner_max_lag
+        ):
+          logger.info("Making learner %s:%d a voter.", learner.host, learner.port)
+          MEMBERSHIP_CHANGES.inc("learner_promoted")
+          self._configuration_append(
+            Configuration(
+              voters=configuration.voters + [learner],
+              learners=[other for other in configuration.learners if other != learner],
+            )
+          )
+          break
+
+  def _membership_reply_failed(self) -> None:
+    """Reply to every administrator waiting that its membership change may not
+    have been committed, pointing it at the current leader if known."""
+    waiting, self._membership_waiting = self._membership_waiting, []
+
+    for req, sender in waiting:
+      self._rpc_send(self._membership_response(req, success=False), sender)
+
+  def _membership_response(
+    self,
+    req: Union[AddServerRPCRequest, RemoveServerRPCRequest],
+    success: StrictBool,
+  ) -> RPC:
+    """Build the response to a membership change."""
+    if isinstance(req, AddServerRPCRequest):
+      return RPC(
+        direction=RPCDirection.RESPONSE,
+        type=RPCType.ADD_SERVER,
+        content=AddServerRPCResponse(
+          request_identity=req.request_identity,
+          success=success,
+          leader_hint=self._leader,
+        ),
+      )
+    else:
+      return RPC(
+        direction=RPCDirection.RESPONSE,
+        type=RPCType.REMOVE_SERVER,
+        content=RemoveServerRPCResponse(
+          request_identity=req.request_identity,
+          success=success,
+          leader_hint=self._leader,
+        ),
+      )
+
+  def _membership_wait(
+    self, req: Union[AddServerRPCRequest, RemoveServerRPCRequest], sender: Address
+  ) -> None:
+    """Answer a membership change once committed (at once if it already is).
+    Retries of a request wait along with it."""
+    if (req, sender) not in self._membership_waiting:
+      self._membership_waiting.append((req, sender))
+
+    self._membership_continue()
+
+  def _next_index_after_conflict(
+    self, res: AppendEntriesRPCResponse, sender: Address
+  ) -> NonNegativeInt:
+    """Find where the follower's log may match ours, given the conflict hint of a
+    failed AppendEntries RPC, skipping a whole term per round trip. Resume after
+    our last entry of the conflicting term, if we have any, else at the first
+    index of that term in the follower's log (Section 3.5)."""
+    log = self._state.log
+    next_index = res.conflict_index
+
+    if res.conflict_term is not None:
+      last_index = log.term_start(res.conflict_term + 1) - 1
+
+      if last_index >= log.start and log.term(last_index) == res.conflict_term:
+        next_index = last_index + 1
+
+    # never move back past entries known to match, nor forward past our log
+    return max(1, self._role.match_index[sender] + 1, min(next_index, len(log)))
+
+  def _pre_vote_start(self) -> None:
+    """Ask every other server whether it would vote for us in the next term,
+    leaving the current term and vote as they are."""
+    logger.info("Pre-voting for term %d.", self._state.current_term + 1)
+    PRE_VOTES_STARTED.inc()
+    self._role = PreCandidateRole()
+    self._votes = {self._id()}
+    self._timeout_reset()
+    self._vote_request(
+      self._state.current_term + 1, pre_vote=True, leadership_transfer=False
+    )
+
+  def _quorum_heard(self) -> StrictBool:
+    """Indicate if a majority was heard from within an election timeout, the
+    leader counting itself."""
+    since = self.clock() - TIMEOUT_LOWER_BOUND
+    heard = {
+      address
+      for address, contact in self._follower_contact.items()
+      if contact > since
+    }
+
+    return self._majority(heard | {self._id()})
+
+  def _read_round_acknowledge(
+    self, sender: Address, request_identity: NonNegativeInt
+  ) -> None:
+    """Count a server towards the current round, confirming its client queries
+    once a majority acknowledged this leader."""
+    if self._queries_round and request_identity >= self._round_first_request:
+      self._round_acknowledged.add(sender)
+
+      if self._majority(self._round_acknowledged):
+        self._queries_ready.extend(
+          (self._round_read_index, req, sender) for req, sender in self._queries_round
+        )
+        self._queries_round = []
+        self._client_answer_queries()
+        self._read_round_start()
+
+  def _read_round_start(self) -> None:
+    """Confirm leadership for every pending client query with one shared round of
+    heartbeats (the ReadIndex protocol of Section 6.4), once this leader has
+    committed an entry of its own term."""
+    if (
+      isinstance(self._role, LeaderRole)
+      and self._queries_pending
+      and not self._queries_round
+      and self._state.log.term(self._state.commit_index) == self._state.current_term
+    ):
+      self._queries_round, self._queries_pending = self._queries_pending, []
+      self._round_first_request = self._request_count + 1
+      self._round_read_index = self._state.commit_index
+      self._round_acknowledged = set()
+      self._rpc_send_append_entries()
+      self._read_round_acknowledge(self._id(), self._round_first_request)
+
+  def _role_demote_if_necessary(self, term: Union[NonNegativeInt, None]) -> None:
     """Convert to follower role if term is defined and larger."""
-    if capture.term is not None and capture.term > self._role.current_term:
-      self._role.update_current_term(NonNegativeInt(capture.term))
-      self._role.update_voted_for(None)
+    if term is not None and term > self._state.current_term:
+      self._state.update_current_term(NonNegativeInt(term))
+      self._state.update_voted_for(None)
+      self._leader = None
 
       if not isinstance(self._role, FollowerRole):
         self._role_demote_to_follower()
 
   def _role_demote_to_follower(self) -> None:
     """Demote current candidate/leader role to follower role."""
-    print(f"INFO: Demoted to term {self._role.current_term} follower.")
-    self._role = FollowerRole(**self._role.dict())
+    logger.info("Demoted to term %d follower.", self._state.current_term)
+    self._role = FollowerRole()
+    self._client_reply_failed()
+    self._membership_reply_failed()
+
+    if self._transfer_target is not None:
+      self._transfer_end(success=self._transfer_timeout_sent)
 
   def _role_promote_to_candidate(self) -> None:
     """Promote current follower role to candidate role."""
-    print(f"INFO: Promoted to term {self._role.current_term} candidate.")
-    self._role = CandidateRole(**self._role.dict())
+    logger.info("Promoted to term %d candidate.", self._state.current_term)
+    self._role = CandidateRole()
 
   def _role_promote_to_leader(self) -> None:
     """Promote current candidate role to leader role."""
-    print(f"INFO: Promoted to term {self._role.current_term} leader.")
-    self._role = LeaderRole(
-      **self._role.dict(),
-      next_index={address: len(self._role.log) for address in self.addresses},
-      match_index={address: 0 for address in self.addresses},
+    logger.info("Promoted to term %d leader.", self._state.current_term)
+    ELECTIONS_WON.inc()
+    self._role = LeaderRole(next_index={}, match_index={})
+    self._entries_sent = {}
+    self._replication = {}
+    self._acknowledged_at = {}
+    self._follower_contact = {}
+    self._snapshot_offsets = {}
+
+    # our own entries count once durable, as the next flush completes
+    for address in self._configuration().members() + [self._id()]:
+      self._member_track(address)
+    self._leader = self._id()
+    # commit an entry of this term at once, as client queries wait on one
+    self._state.extend_log(
+      [
+        Entry(
+          index=len(self._state.log),
+          term=self._state.current_term,
+          key="",
+          value="",
+        )
+      ]
     )
-    self._entries_sent = {address: 0 for address in self.addresses}
+
+  def _rpc_handle_add_server_request(
+    self, req: AddServerRPCRequest, sender: Address
+  ) -> Union[RPC, None]:
+    """Implement the AddServer RPC request according to Figure 4.1, the new
+    server joining as a learner: it is made a voter once within the lag allowed
+    of our log, so that it does not hold commits back while catching up
+    (Section 4.2.1). Answers once the configuration making it a voter is
+    committed."""
+    logger.debug("Handling AddServer RPC request.")
+
+    if not isinstance(self._role, LeaderRole):
+      return self._membership_response(req, success=False)
+
+    configuration = self._configuration()
+
+    if req.new_server not in configuration.members():
+      if not self._configuration_changeable():
+        return self._membership_response(req, success=False)
+
+      logger.info(
+        "Adding %s:%d as a learner.", req.new_server.host, req.new_server.port
+      )
+      MEMBERSHIP_CHANGES.inc("learner_added")
+      self._configuration_append(
+        Configuration(
+          voters=configuration.voters,
+          learners=configuration.learners + [req.new_server],
+        )
+      )
+
+    self._membership_wait(req, sender)
+
+    return None
 
   def _rpc_handle_append_entries_request(self, req: AppendEntriesRPCRequest) -> RPC:
     """Implement the AppendEntries RPC request according to Figure 3.1."""
     res: AppendEntriesRPCResponse
     previous_entry: Union[Entry, None] = None
+    log = self._state.log
 
-    if 0 <= req.previous_log_index < len(self._role.log):
-      previous_entry = self._role.log[req.previous_log_index]
+    if log.start <= req.previous_log_index < len(log):
+      previous_entry = log[req.previous_log_index]
+    elif req.previous_log_index < log.start:
+      # entries compacted into the snapshot are committed, hence match the leader
+      previous_entry = Entry(
+        index=req.previous_log_index,
+        term=req.previous_log_term,
+        key="",
+        value="",
+      )
 
-    print("INFO: Handling AppendEntries RPC request.")
+    logger.debug("Handling AppendEntries RPC request.")
 
     self._timeout_reset()
 
-    if req.term < self._role.current_term:
-      res = AppendEntriesRPCResponse(term=self._role.current_term, success=False)
-    elif previous_entry is None or req.previous_log_term != previous_entry.term:
-      res = AppendEntriesRPCResponse(term=self._role.current_term, success=False)
+    if req.term == self._state.current_term:
+      self._leader = req.leader_identity
+      self._leader_contact = self.clock()
+
+    if req.term < self._state.current_term:
+      res = AppendEntriesRPCResponse(
+        term=self._state.current_term,
+        success=False,
+        request_identity=req.request_identity,
+        conflict_index=0,
+        conflict_term=None,
+      )
+    elif previous_entry is None:
+      # missing entries, the leader resumes past our last one
+      res = AppendEntriesRPCResponse(
+        term=self._state.current_term,
+        success=False,
+        request_identity=req.request_identity,
+        conflict_index=len(log),
+        conflict_term=None,
+      )
+    elif req.previous_log_term != previous_entry.term:
+      # divergent entries, the leader skips every one of the conflicting term
+      res = AppendEntriesRPCResponse(
+        term=self._state.current_term,
+        success=False,
+        request_identity=req.request_identity,
+        conflict_index=log.term_start(previous_entry.term),
+        conflict_term=previous_entry.term,
+      )
     else:
       # raft is not byzantine, receiving an append entries means to demote to follower
       if not isinstance(self._role, FollowerRole):
@@ -101,66 +778,490 @@ class Server(BaseModel):
       assert all(x.index + 1 == y.index for x, y in zip(req.entries, req.entries[1:]))
       # update log with monotonic entries
       for entry in req.entries:
-        self._role.update_log(entry)
-      # update commit index if necessary
-      if req.leader_commit_index > self._role.commit_index:
-        self._role.commit_index = min(req.leader_commit_index, len(self._role.log) - 1)
+        self._state.update_log(entry)
+      # update commit index if necessary, up to the last entry known to match
+      last_new_index = req.previous_log_index + len(req.entries)
+      if min(req.leader_commit_index, last_new_index) > self._state.commit_index:
+        self._commit_update(min(req.leader_commit_index, last_new_index))
       # successfully appended entries
-      res = AppendEntriesRPCResponse(term=self._role.current_term, success=True)
+      res = AppendEntriesRPCResponse(
+        term=self._state.current_term,
+        success=True,
+        request_identity=req.request_identity,
+        conflict_index=0,
+        conflict_term=None,
+      )
 
     return RPC(
       direction=RPCDirection.RESPONSE,
       type=RPCType.APPEND_ENTRIES,
-      content=res.json(),
+      content=res,
     )
 
   def _rpc_handle_append_entries_response(
     self, res: AppendEntriesRPCResponse, sender: Address
   ) -> None:
     """Implement the AppendEntries RPC response according to Figure 3.1."""
-    print(f"INFO: Handling AppendEntries RPC response: {res}.")
+    logger.debug("Handling AppendEntries RPC response: %s.", res)
+
+    if isinstance(self._role, LeaderRole) and res.term == self._state.current_term:
+      self._follower_contact[sender] = self.clock()
+      self._read_round_acknowledge(sender, res.request_identity)
+
+      if res.request_identity in self._request_sent_at:
+        sent_at = self._request_sent_at.pop(res.request_identity)
+        self._acknowledged_at[sender] = max(
+          self._acknowledged_at.get(sender, 0), sent_at
+        )
+
+      in_flight = self._entries_sent[sender]
+      sent = in_flight.pop(res.request_identity, None)
+
+      # responses to RPCs given up on (when probing again) are stale
+      if sent is None:
+        return
 
-    if isinstance(self._role, LeaderRole) and res.term == self._role.current_term:
       if res.success:
-        previous_log_index = self._role.next_index[sender] - 1
-        num_entries = self._entries_sent[sender]
+        previous_log_index, num_entries = sent
+        self._role.match_index[sender] = max(
+          self._role.match_index[sender], previous_log_index + num_entries
+        )
+        self._role.next_index[sender] = max(
+          self._role.next_index[sender], self._role.match_index[sender] + 1
+        )
+        self._replication[sender] = Replication.PIPELINE
+        MATCH_INDEX_LAG.set(
+          len(self._state.log) - 1 - self._role.match_index[sender],
+          self.group,
+          sender.port,
+        )
+        self._commit_advance()
+        if sender == self._transfer_target:
+          self._transfer_continue()
+        # earlier RPCs carry no entry beyond those now known to match, and those
+        # still unanswered were likely lost
+        for request_identity in [r for r in in_flight if r < res.request_identity]:
+          del in_flight[request_identity]
+        # keep replicating entries appended since
+        self._rpc_replicate_to(sender, heartbeat=False)
+      else:
+        self._role.next_index[sender] = self._next_index_after_conflict(res, sender)
+        self._replication[sender] = Replication.PROBE
+        in_flight.clear()
+        self._rpc_replicate_to(sender, heartbeat=True)
 
-        if self._role.match_index[sender] > previous_log_index + num_entries:
-          print("WARNING: Match index did not monotonically increase within a term.")
-        else:
-          self._role.match_index[sender] = previous_log_index + num_entries
+  def _rpc_handle_install_snapshot_request(
+    self, req: InstallSnapshotRPCRequest
+  ) -> Union[RPC, None]:
+    """Implement the InstallSnapshot RPC request according to Figure 5.3. Chunks
+    are written as they arrive, and the snapshot replaces the state machine (and
+    the log it covers) once the last one is received. It is restored on the
+    apply stage, which is acknowledged once done (see `apply_commits`): chunks
+    received meanwhile go unanswered."""
+    logger.debug("Handling InstallSnapshot RPC request at offset %d.", req.offset)
+
+    self._timeout_reset()
+    next_offset: NonNegativeInt = 0
 
+    if req.term == self._state.current_term:
+      self._leader = req.leader_identity
+      self._leader_contact = self.clock()
+
+      if not isinstance(self._role, FollowerRole):
+        self._role_demote_to_follower()
+
+      if self._state.installing is not None:
+        return None
+
+      # a snapshot covering only applied entries brings nothing new
+      if req.last_included_index > self._state.last_applied_index:
+        next_offset = self._state.install_snapshot(
+          req.last_included_index,
+          req.last_included_term,
+          req.offset,
+          req.data,
+          req.done,
+        )
+
+        if self._state.installing is not None:
+          return None
+        # restored inline, which this very response acknowledges
+        self._state.installed = None
+
+    return RPC(
+      direction=RPCDirection.RESPONSE,
+      type=RPCType.INSTALL_SNAPSHOT,
+      content=InstallSnapshotRPCResponse(
+        term=self._state.current_term,
+        last_included_index=req.last_included_index,
+        offset=next_offset,
+        done=self._state.last_applied_index >= req.last_included_index,
+      ),
+    )
+
+  def _rpc_handle_install_snapshot_response(
+    self, res: InstallSnapshotRPCResponse, sender: Address
+  ) -> None:
+    """Implement the InstallSnapshot RPC response according to Figure 5.3,
+    streaming the next chunk, or replicating the log past the snapshot once the
+    follower installed it."""
+    logger.debug("Handling InstallSnapshot RPC response: %s.", res)
+
+    if isinstance(self._role, LeaderRole) and res.term == self._state.current_term:
+      self._follower_contact[sender] = self.clock()
+      snapshot = self.driver.get_snapshot()
+
+      if res.done:
+        self._snapshot_offsets.pop(sender, None)
+        self._role.match_index[sender] = max(
+          self._role.match_index[sender], res.last_included_index
+        )
         self._role.next_index[sender] = self._role.match_index[sender] + 1
-      elif self._role.next_index[sender] > 1:
-        self._role.next_index[sender] -= 1
+        self._replication[sender] = Replication.PROBE
+        self._commit_advance()
+        self._entries_sent[sender].clear()
+      elif (
+        snapshot is not None
+        and res.last_included_index == snapshot.last_included_index
+      ):
+        self._snapshot_offsets[sender] = res.offset
+      else:
+        # the snapshot was replaced while being sent, start over with the new one
+        self._snapshot_offsets[sender] = 0
+
+      self._rpc_replicate_to(sender, heartbeat=True)
+
+  def _rpc_handle_remove_server_request(
+    self, req: RemoveServerRPCRequest, sender: Address
+  ) -> Union[RPC, None]:
+    """Implement the RemoveServer RPC request according to Figure 4.1, answering
+    once the configuration without the old server is committed. The last voter
+    is never removed."""
+    logger.debug("Handling RemoveServer RPC request.")
+
+    if not isinstance(self._role, LeaderRole):
+      return self._membership_response(req, success=False)
+
+    configuration = self._configuration()
+
+    if req.old_server in configuration.members():
+      if (
+        not self._configuration_changeable()
+        or configuration.voters == [req.old_server]
+      ):
+        return self._membership_response(req, success=False)
+
+      logger.info(
+        "Removing %s:%d from the configuration.",
+        req.old_server.host,
+        req.old_server.port,
+      )
+      MEMBERSHIP_CHANGES.inc("server_removed")
+      self._configuration_append(
+        Configuration(
+          voters=[voter for voter in configuration.voters if voter != req.old_server],
+          learners=[
+            learner
+            for learner in configuration.learners
+            if learner != req.old_server
+          ],
+        )
+      )
+
+    self._membership_wait(req, sender)
+
+    return None
+
+  def _rpc_handle_client_query_request(
+    self, req: ClientQueryRPCRequest, sender: Address
+  ) -> Union[RPC, None]:
+    """Implement the ClientQuery RPC request according to Section 6.4, reading
+    from the state machine without appending to the log. Only the leader serves
+    queries, once it confirmed its leadership (or its lease holds) and applied
+    everything committed when the query arrived."""
+    logger.debug("Handling ClientQuery RPC request.")
+
+    if not isinstance(self._role, LeaderRole):
+      return self._client_query_response(req, success=False)
+
+    if (
+      self.read_lease
+      and self._transfer_target is None
+      and self._lease_valid()
+      and self._state.log.term(self._state.commit_index) == self._state.current_term
+    ):
+      self._queries_ready.append((self._state.commit_index, req, sender))
+      self._client_answer_queries()
+    else:
+      self._queries_pending.append((req, sender))
+      self._read_round_start()
+
+    return None
+
+  def _rpc_handle_client_request_request(
+    self, req: ClientRequestRPCRequest, sender: Address
+  ) -> Union[RPC, None]:
+    """Implement the ClientRequest RPC request according to Figure 6.1, batching
+    requests so that a batch is appended and replicated at once. Only the leader
+    serves requests, replying once the entry is committed."""
+    logger.debug("Handling ClientRequest RPC request.")
+
+    # a leader handing leadership over takes no more requests, the configuration
+    # only changes through membership changes, and an empty key marks no-op
+    # entries, which are never applied
+    if (
+      not isinstance(self._role, LeaderRole)
+      or self._transfer_target is not None
+      or not req.key
+      or req.key == CONFIGURATION_KEY
+    ):
+      return self._client_request_response(req, success=False)
+
+    self._client_batch.append((req, sender))
+
+    if len(self._client_batch) >= self.client_batch_size:
+      self._client_batch_append()
+    elif len(self._client_batch) == 1:
+      self._client_batch_deadline = self.clock() + self.client_batch_linger
+
+    return None
+
+  def _rpc_handle_timeout_now_request(self, req: TimeoutNowRPCRequest) -> None:
+    """Implement the TimeoutNow RPC request according to Section 3.10, standing
+    for election at once, without a pre-vote as the leader asked for it."""
+    logger.debug("Handling TimeoutNow RPC request.")
+
+    if req.term == self._state.current_term and not isinstance(
+      self._role, LeaderRole
+    ):
+      logger.info("Standing for election as leadership is handed over to us.")
+      self._election_start(leadership_transfer=True)
+
+  def _rpc_handle_transfer_leadership_request(
+    self, req: TransferLeadershipRPCRequest, sender: Address
+  ) -> Union[RPC, None]:
+    """Implement the TransferLeadership RPC request, answering once the leader
+    stepped down for the target or gave up on it."""
+    logger.debug("Handling TransferLeadership RPC request.")
+
+    # leadership is already where it was asked to go
+    already_led = isinstance(self._role, LeaderRole) and req.target == self._id()
+
+    if not already_led and self.transfer_leadership(req.target):
+      self._transfer_waiting.append((req, sender))
+      return None
+
+    return RPC(
+      direction=RPCDirection.RESPONSE,
+      type=RPCType.TRANSFER_LEADERSHIP,
+      content=TransferLeadershipRPCResponse(
+        request_identity=req.request_identity,
+        success=already_led,
+        leader_hint=self._leader,
+      ),
+    )
+
+  def _timeout_now_send(self, address: Address) -> None:
+    """Tell a follower to stand for election at once."""
+    self._rpc_send(
+      RPC(
+        direction=RPCDirection.REQUEST,
+        type=RPCType.TIMEOUT_NOW,
+        content=TimeoutNowRPCRequest(
+          term=self._state.current_term, leader_identity=self._id()
+        ),
+      ),
+      address,
+    )
+
+  def _timeout_reset(self, leader: StrictBool = False) -> None:
+    """Create new timeout value."""
+    logger.debug("Resetting timeout value.")
+
+    self.timeout = self.rng.uniform(TIMEOUT_LOWER_BOUND, TIMEOUT_UPPER_BOUND)
+    # shorter timeout for leader
+    if leader:
+      self.timeout /= 3
+    # offset to current time
+    self.timeout += self.clock()
+
+  def _transfer_continue(self) -> None:
+    """Tell the follower leadership is handed over to to stand for election,
+    once it holds every entry of our log."""
+    target = self._transfer_target
+
+    if (
+      isinstance(self._role, LeaderRole)
+      and target is not None
+      and not self._transfer_timeout_sent
+      and self._role.match_index[target] == len(self._state.log) - 1
+    ):
+      self._transfer_timeout_sent = True
+      self._timeout_now_send(target)
+
+  def _transfer_end(self, success: StrictBool) -> None:
+    """End the leadership transfer under way, answering every administrator
+    waiting on it."""
+    LEADERSHIP_TRANSFERS.inc("succeeded" if success else "failed")
+
+    for req, sender in self._transfer_waiting:
+      self._rpc_send(
+        RPC(
+          direction=RPCDirection.RESPONSE,
+          type=RPCType.TRANSFER_LEADERSHIP,
+          content=TransferLeadershipRPCResponse(
+            request_identity=req.request_identity,
+            success=success,
+            leader_hint=self._transfer_target if success else self._leader,
+          ),
+        ),
+        sender,
+      )
+
+    self._transfer_target = None
+    self._transfer_timeout_sent = False
+    self._transfer_waiting = []
+
+  def _transfer_to_preferred(self) -> None:
+    """Hand leadership over to the preferred leader, if it is a voter this leader
+    replicates to in pipeline mode and has heard from since the last heartbeat:
+    a transfer to a server that is down would hold client requests back until
+    given up on."""
+    preferred = self.preferred_leader
+
+    if (
+      isinstance(self._role, LeaderRole)
+      and preferred is not None
+      and preferred != self._id()
+      and preferred in self._configuration().voters
+      and self._transfer_target is None
+      and self._replication.get(preferred) == Replication.PIPELINE
+      and self._follower_contact[preferred]
+      > self.clock() - TIMEOUT_LOWER_BOUND / 3
+    ):
+      self.transfer_leadership(preferred)
+
+  def _vote_request(
+    self,
+    term: NonNegativeInt,
+    pre_vote: StrictBool,
+    leadership_transfer: StrictBool,
+  ) -> None:
+    """Send every other server a RequestVote RPC request for a term."""
+    rpc = RPC(
+      direction=RPCDirection.REQUEST,
+      type=RPCType.REQUEST_VOTE,
+      content=RequestVoteRPCRequest(
+        term=term,
+        candidate_identity=self._id(),
+        last_log_index=len(self._state.log) - 1,
+        last_log_term=self._state.log.term(-1),
+        pre_vote=pre_vote,
+        leadership_transfer=leadership_transfer,
+      ),
+    )
+
+    for address in self._configuration().voters:
+      if address != self._id():
+        self._rpc_send(rpc, address)
+
+  def apply_commits(self) -> None:
+    """Collect the entries the apply stage has applied, then hand it those
+    committed since, and answer the client queries waiting on them. Snapshot
+    once enough entries were applied, between two batches, as the state machine
+    then reflects every entry up to the applied index and no later one."""
+    self._state.apply_collect()
+
+    applied = self._state.last_applied_index - self._state.log.start
+    if applied >= self.snapshot_threshold and not self._state.stage.is_busy():
+      self._state.take_snapshot()
+
+    self._state.apply_commits()
+    self._client_answer_queries()
+
+    # a snapshot restored is acknowledged at once, rather than once the leader
+    # sends its last chunk again
+    if self._state.installed is not None and self._leader is not None:
+      self._rpc_send(
+        RPC(
+          direction=RPCDirection.RESPONSE,
+          type=RPCType.INSTALL_SNAPSHOT,
+          content=InstallSnapshotRPCResponse(
+            term=self._state.current_term,
+            last_included_index=self._state.installed,
+            offset=0,
+            done=True,
+          ),
+        ),
+        self._leader,
+      )
+    self._state.installed = None
+
+    now = self.clock()
+    while (
+      self._committed_at
+      and self._committed_at[0][0] <= self._state.last_applied_index
+    ):
+      COMMIT_APPLY_SECONDS.observe(now - self._committed_at.popleft()[1])
+
+    CURRENT_TERM.set(self._state.current_term, self.group)
+    COMMIT_INDEX.set(self._state.commit_index, self.group)
+    LAST_APPLIED_INDEX.set(self._state.last_applied_index, self.group)
+
+  def apply_readers(self) -> List[socket]:
+    """Return the sockets made readable whenever the apply stage has applied a
+    batch, to be waited on along with those of the transport (reading them is
+    left to `apply_commits`)."""
+    return self._state.stage.readers()
 
   def _rpc_handle_request_vote_request(self, req: RequestVoteRPCRequest) -> RPC:
-    """Implement the RequestVote RPC request according to Figure 3.1."""
-    res = RequestVoteRPCResponse(term=self._role.current_term, vote_granted=False)
-    last_entry: Union[Entry, None] = self._role.log[-1]
+    """Implement the RequestVote RPC request according to Figure 3.1, and the
+    PreVote RPC request according to Section 9.6: a pre-vote is granted to a
+    server whose log is up to date enough to win the term it proposes, unless
+    the current leader was heard from within an election timeout. Granting it
+    changes no state."""
+    res = RequestVoteRPCResponse(
+      term=self._state.current_term, vote_granted=False, pre_vote=req.pre_vote
+    )
+    last_entry: Union[Entry, None] = self._state.log[-1]
     assert last_entry is not None
 
     if not isinstance(self._role, LeaderRole):
-      print("INFO: Handling RequestVote RPC request.")
-
-      self._timeout_reset()
+      logger.debug("Handling RequestVote RPC request.")
 
       at_least_as_up_to_date = req.last_log_term > last_entry.term or (
         req.last_log_term == last_entry.term and req.last_log_index >= last_entry.index
       )
 
-      if req.term < self._role.current_term:
+      if req.pre_vote:
+        leader_heard = (
+          self._leader is not None
+          and self.clock() - self._leader_contact < TIMEOUT_LOWER_BOUND
+        )
+        res = RequestVoteRPCResponse(
+          term=self._state.current_term,
+          vote_granted=(
+            req.term > self._state.current_term
+            and at_least_as_up_to_date
+            and not leader_heard
+          ),
+          pre_vote=True,
+        )
+      elif req.term < self._state.current_term:
         pass
       elif (
-        self._role.voted_for is None or self._role.voted_for == req.candidate_identity
+        self._state.voted_for is None or self._state.voted_for == req.candidate_identity
       ) and at_least_as_up_to_date:
-        self._role.update_voted_for(req.candidate_identity)
-        res = RequestVoteRPCResponse(term=self._role.current_term, vote_granted=True)
+        self._state.update_voted_for(req.candidate_identity)
+        res = RequestVoteRPCResponse(term=self._state.current_term, vote_granted=True)
+        # only a vote granted holds off an election, lest a candidate that cannot
+        # win keeps every other server from standing
+        self._timeout_reset()
 
     return RPC(
       direction=RPCDirection.RESPONSE,
       type=RPCType.REQUEST_VOTE,
-      content=res.json(),
+      content=res,
     )
 
   def _rpc_handle_request_vote_response(
@@ -168,175 +1269,401 @@ class Server(BaseModel):
   ) -> None:
     """Implement the RequestVote RPC response according to Figure 3.1."""
 
-    print(f"INFO: Handling RequestVote RPC response: {res}.")
+    logger.debug("Handling RequestVote RPC response: %s.", res)
 
-    if isinstance(self._role, CandidateRole) and res.vote_granted:
+    if res.pre_vote:
+      # pre-votes proposing a term no later than that of the voter are rejected
+      # until we catch up with it, which a server cut off from the leader only
+      # does this way: take the term up, neither changing role nor voting
+      if (
+        isinstance(self._role, PreCandidateRole)
+        and not res.vote_granted
+        and res.term > self._state.current_term
+      ):
+        self._state.update_current_term(NonNegativeInt(res.term))
+        self._leader = None
+      elif isinstance(self._role, PreCandidateRole) and res.vote_granted:
+        self._votes.add(sender)
+
+        # stand for election once a majority would vote for us
+        if self._majority(self._votes):
+          self._election_start()
+    elif isinstance(self._role, CandidateRole) and res.vote_granted:
       self._votes.add(sender)
 
       # if majority attained (syntax is from Raft's TLA+ specification)
-      if len(self._votes) * 2 > len(self.addresses):
+      if self._majority(self._votes):
         self._role_promote_to_leader()
         self._rpc_send_append_entries()
         self._timeout_reset(leader=True)
 
+  def _rpc_replicate_to(self, address: Address, heartbeat: StrictBool) -> None:
+    """Send a follower as many batches of the entries it is missing as its
+    replication mode allows: one RPC in flight while probing, up to the window
+    while pipelining. A heartbeat is sent even if nothing else is."""
+    if isinstance(self._role, LeaderRole):
+      in_flight = self._entries_sent[address]
+      window = (
+        self.pipeline_window
+        if self._replication[address] == Replication.PIPELINE
+        else 1
+      )
+      sent = False
+
+      while (
+        self._replication[address] != Replication.SNAPSHOT
+        and len(in_flight) < window
+        and self._role.next_index[address] < len(self._state.log)
+      ):
+        self._rpc_send_append_entries_to(address)
+        sent = True
+
+      if heartbeat and not sent:
+        self._rpc_send_append_entries_to(address)
+
   def _rpc_send(self, rpc: RPC, addr: Address) -> None:
-    """Send an RPC to another server."""
-    if self.sock is not None:
+    """Queue an RPC to another server, sent on the next flush."""
+    self._outbox.append((rpc, addr))
+
+  def _rpc_send_append_entries(self, idle_only: StrictBool = False) -> None:
+    """Send AppendEntry RPCs to every voter and learner but us, at least a
+    heartbeat each, or only to those with room for more in flight."""
+    if isinstance(self._role, LeaderRole):
+      for address in self._configuration().members():
+        if address != self._id():
+          self._rpc_replicate_to(address, heartbeat=not idle_only)
+
+  def _rpc_send_append_entries_to(self, address: Address) -> None:
+    """Send an AppendEntry RPC with the next batch of entries the follower is
+    missing, bounded in entries and (estimated) bytes, or the next snapshot chunk
+    if some of them were compacted."""
+    if isinstance(self._role, LeaderRole):
+      next_index = self._role.next_index[address]
+
+      if next_index <= self._state.log.start:
+        self._replication[address] = Replication.SNAPSHOT
+        self._rpc_send_install_snapshot_to(address)
+        return
+
+      log = self._state.log
+      last_index = min(len(log), next_index + self.append_entries_max_entries)
+      size = 0
+
+      # at least one entry is sent, however large
+      for index in range(next_index, last_index):
+        size += ENTRY_OVERHEAD_BYTES + log.payload_size(index)
+        if index > next_index and size > self.append_entries_max_bytes:
+          last_index = index
+          break
+
+      num_entries = last_index - next_index
+      APPEND_ENTRIES_ENTRIES.observe(num_entries)
+
+      self._request_count += 1
+      in_flight = self._entries_sent[address]
+      in_flight[self._request_count] = (next_index - 1, num_entries)
+
+      # heartbeats are sent even with a full window, forget the oldest RPCs sent
+      # to an unresponsive follower instead
+      if len(in_flight) > self.pipeline_window:
+        del in_flight[next(iter(in_flight))]
+
+      # the follower is expected to accept every batch while pipelining
+      if self._replication[address] == Replication.PIPELINE:
+        self._role.next_index[address] = next_index + num_entries
+
+      if self.read_lease:
+        self._request_sent_at[self._request_count] = self.clock()
+
+      content = dict(
+        term=self._state.current_term,
+        leader_identity=self._id(),
+        previous_log_index=next_index - 1,
+        previous_log_term=log.term(next_index - 1),
+        leader_commit_index=self._state.commit_index,
+        request_identity=self._request_count,
+      )
+
+      if self.codec == Codec.BINARY:
+        # entries are encoded once for every follower and retry, then spliced in
+        entries = Encoded(
+          num_entries,
+          self.driver.get_encoded_entries(next_index, last_index, encode_entries),
+        )
+        req = AppendEntriesRPCRequest.construct(entries=entries, **content)
+      else:
+        req = AppendEntriesRPCRequest.construct(
+          entries=list(log[next_index:last_index]), **content
+        )
+
+      self._rpc_send(
+        RPC(direction=RPCDirection.REQUEST, type=RPCType.APPEND_ENTRIES, content=req),
+        address,
+      )
+
+  def _rpc_send_install_snapshot_to(self, address: Address) -> None:
+    """Send an InstallSnapshot RPC with the next chunk of the latest snapshot."""
+    snapshot = self.driver.get_snapshot()
+
+    if isinstance(self._role, LeaderRole) and snapshot is not None:
+      offset = self._snapshot_offsets.setdefault(address, 0)
+      data = self.driver.read_snapshot(offset, SNAPSHOT_CHUNK_BYTES)
+
+      self._rpc_send(
+        RPC(
+          direction=RPCDirection.REQUEST,
+          type=RPCType.INSTALL_SNAPSHOT,
+          content=InstallSnapshotRPCRequest(
+            term=self._state.current_term,
+            leader_identity=self._id(),
+            last_included_index=snapshot.last_included_index,
+            last_included_term=snapshot.last_included_term,
+            offset=offset,
+            data=data,
+            done=offset + len(data) >= snapshot.size,
+          ),
+        ),
+        address,
+      )
+
+  def _send(self, outbox: List[Tuple[RPC, Address]]) -> None:
+    """Encode and send RPCs through the transport, coalescing the RPCs to each
+    server so that the transport may send them together."""
+    if self.transport.address is None:
+      if outbox:
+        logger.error("Socket is not initialized.")
+      return
+
+    messages: Dict[Address, List[bytes]] = {}
+    for rpc, addr in outbox:
+      messages.setdefault(addr, []).append(encode(rpc, self.codec))
+      RPCS_SENT.inc(rpc.direction, rpc.type)
+
+    for addr, encoded in messages.items():
       try:
-        self.sock.sendto(f"{rpc.json()}\n".encode(), (addr.host, addr.port))
+        self.transport.send_many(encoded, addr)
       except:
-        print("ERROR: Failed to send RPC.")
+        logger.error("Failed to send RPC to %s.", addr)
+
+  def deadline(self) -> float:
+    """Return the time by which the server must act, even if nothing arrives."""
+    if self._client_batch:
+      return min(self.timeout, self._client_batch_deadline)
     else:
-      print("ERROR: Socket is not initialized.")
+      return self.timeout
 
-  def _rpc_send_append_entries(self) -> None:
-    """Send an AppendEntry RPC to everyone but us."""
-    if isinstance(self._role, LeaderRole):
-      for address in self.addresses:
-        if address != self._id():
-          previous_entry = self._role.log[self._role.next_index[address] - 1]
-          entries = self._role.log[self._role.next_index[address] :]
-          self._entries_sent[address] = len(entries)
-
-          self._rpc_send(
-            RPC(
-              direction=RPCDirection.REQUEST,
-              type=RPCType.APPEND_ENTRIES,
-              content=AppendEntriesRPCRequest(
-                term=self._role.current_term,
-                leader_identity=self._id(),
-                previous_log_index=self._role.next_index[address] - 1,
-                previous_log_term=previous_entry.term,
-                entries=entries,
-                leader_commit_index=self._role.commit_index,
-              ).json(),
-            ),
-            address,
-          )
+  def expire_client_batch(self) -> None:
+    """Append the batched client requests once they have lingered long enough."""
+    if self._client_batch and self.clock() >= self._client_batch_deadline:
+      self._client_batch_append()
 
-  def _timeout_reset(self, leader: StrictBool = False) -> None:
-    """Create new timeout value."""
-    print("INFO: Resetting timeout value.")
+  def flush(self) -> None:
+    """Persist every mutation made since the last flush with a single fsync, then
+    send all queued RPCs, so that no server replies before it has persisted."""
+    self.flush_begin()()
+    self.flush_end()
 
-    self.timeout = uniform(TIMEOUT_LOWER_BOUND, TIMEOUT_UPPER_BOUND)
-    # shorter timeout for leader
-    if leader:
-      self.timeout /= 3
-    # offset to current time
-    self.timeout += time()
+  def flush_begin(self) -> Callable[[], None]:
+    """Start persisting every mutation made so far, holding back the RPCs queued
+    until then. Returns the blocking part of the persistence, which may run on
+    another thread, to be followed by flush_end once done."""
+    self._flushing.append(
+      (self._state.current_term, len(self._state.log) - 1, self._outbox)
+    )
+    self._outbox = []
 
-  def apply_commits(self) -> None:
-    """Instruct role to handle applying commits to the database."""
-    self._role.apply_commits()
+    return self.driver.sync_deferred()
+
+  def flush_end(self) -> None:
+    """Complete the oldest flush started: the entries it made durable count
+    towards commitment as stored by the leader itself, and the RPCs held back by
+    it are sent (along with the replies to clients it committed)."""
+    term, last_index, outbox = self._flushing.pop(0)
+
+    if isinstance(self._role, LeaderRole) and term == self._state.current_term:
+      queued, self._outbox = self._outbox, []
+
+      if last_index > self._role.match_index[self._id()]:
+        self._role.match_index[self._id()] = last_index
+        self._commit_advance()
+
+      outbox, self._outbox = outbox + self._outbox, queued
+
+    self._send(outbox)
+
+  def send_ahead(self) -> None:
+    """Send the queued RPCs that need not wait for this server's own writes to be
+    durable: the requests of the leader replicating its log, which it may write
+    in parallel (Section 10.2.1). The rest stay queued for the next flush."""
+    outbox, self._outbox = self._outbox, []
+    ahead: List[Tuple[RPC, Address]] = []
+
+    for rpc, addr in outbox:
+      if rpc.direction == RPCDirection.REQUEST and rpc.type in (
+        RPCType.APPEND_ENTRIES,
+        RPCType.INSTALL_SNAPSHOT,
+      ):
+        ahead.append((rpc, addr))
+      else:
+        self._outbox.append((rpc, addr))
+
+    self._send(ahead)
 
   def init_sock(self, port: NonNegativeInt) -> None:
-    """Initialize the socket."""
+    """Initialize the transport's sockets."""
     try:
-      self.sock = socket(AF_INET, SOCK_DGRAM)
-      self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-      self.sock.bind(("127.0.0.1", port))
+      self.transport.open(Address(port=port))
     except:
-      print("ERROR: Failed to set up socket.")
+      logger.critical("Failed to set up socket.", exc_info=True)
       exit(1)
 
+  def is_flush_needed(self) -> StrictBool:
+    """Indicate if there are mutations or RPCs waiting for a flush."""
+    return bool(self._outbox) or self.driver.is_dirty()
+
   def is_leader(self) -> StrictBool:
     """Indicate if the server is currently term leader."""
     return isinstance(self._role, LeaderRole)
 
   def is_timed_out(self) -> StrictBool:
     """Indicate if the server has timed out."""
-    return time() > self.timeout
+    return self.clock() > self.timeout
+
+  def members(self) -> List[Address]:
+    """Return every server of the configuration in use, voters first."""
+    return self._configuration().members()
 
   def start_election(self) -> None:
-    """Start election process."""
-    if self.sock is not None:
-      self._role.update_current_term(NonNegativeInt(self._role.current_term + 1))
-      self._role_promote_to_candidate()
-      self._role.update_voted_for(self._id())
-      self._votes = {self._id()}
+    """Start election process, polling the other servers first if pre-votes are
+    enabled, so that a server that cannot win does not increment its term. Only
+    voters stand: learners, and servers yet to be added or removed, never do."""
+    if self.transport.address is not None:
+      if self._id() not in self._configuration().voters:
+        self._timeout_reset()
+      elif self.pre_vote:
+        self._pre_vote_start()
+      else:
+        self._election_start()
+
+  def start_heartbeat(self) -> None:
+    """Start leader heartbeat, unless check-quorum finds that a majority has not
+    been heard from within an election timeout, in which case step down: this
+    leader may well have been replaced on the other side of a partition."""
+    if (
+      self._transfer_target is not None
+      and self.clock() > self._transfer_deadline
+    ):
+      logger.info("Giving up on transferring leadership.")
+      self._transfer_end(success=False)
+
+    if (
+      isinstance(self._role, LeaderRole)
+      and self.check_quorum
+      and not self._quorum_heard()
+    ):
+      logger.info("Stepping down, a majority has not been heard from.")
+      QUORUM_LOSSES.inc()
+      self._leader = None
+      self._role_demote_to_follower()
       self._timeout_reset()
+    elif isinstance(self._role, LeaderRole):
+      self._rpc_send_append_entries()
+      # forget AppendEntries RPCs too old to ever extend the lease
+      since = self.clock() - TIMEOUT_UPPER_BOUND
+      self._request_sent_at = {
+        request: sent_at
+        for request, sent_at in self._request_sent_at.items()
+        if sent_at > since
+      }
+      self._timeout_reset(leader=True)
+      self._transfer_to_preferred()
 
-      rpc = RPC(
-        direction=RPCDirection.REQUEST,
-        type=RPCType.REQUEST_VOTE,
-        content=RequestVoteRPCRequest(
-          term=self._role.current_term,
-          candidate_identity=self._id(),
-          last_log_index=self._role.log[-1].index,
-          last_log_term=self._role.log[-1].term,
-        ).json(),
-      )
+  def transfer_leadership(self, target: Union[Address, None] = None) -> StrictBool:
+    """Hand leadership over to a follower, the most up-to-date one unless one is
+    given (Section 3.10): stop taking client requests, bring the follower's log
+    up to date, then have it stand for election without waiting for its
+    election timeout. The transfer is given up on after an election timeout.
+    Returns whether a transfer is under way."""
+    followers = [
+      address for address in self._configuration().voters if address != self._id()
+    ]
 
-      for address in self.addresses:
-        if address != self._id():
-          self._rpc_send(rpc, address)
+    if not isinstance(self._role, LeaderRole) or not followers:
+      return False
+    if self._transfer_target is not None:
+      return True
 
-  def start_heartbeat(self) -> None:
-    """Start leader heartbeat."""
-    if isinstance(self._role, LeaderRole):
-      match_indices = self._role.match_index.values()
-      N = min(match_indices)
+    if target is None:
+      target = max(followers, key=lambda address: self._role.match_index[address])
+    elif target not in followers:
+      return False
 
-      while (
-        N < len(self._role.log)
-        and N > self._role.commit_index
-        and sum(idx >= N for idx in match_indices) * 2 > len(self.addresses)
-        and self._role.log[N].term == self._role.current_term
-      ):
-        self._role.commit_index = N
-        N += 1
+    logger.info("Transferring leadership to %s:%d.", target.host, target.port)
+    self._transfer_target = target
+    self._transfer_deadline = self.clock() + TIMEOUT_LOWER_BOUND
+    # the requests taken so far are appended, and reach the target with the rest
+    self._client_batch_append()
+    self._rpc_replicate_to(target, heartbeat=True)
+    self._transfer_continue()
 
-      self._rpc_send_append_entries()
-      self._timeout_reset(leader=True)
+    return True
+
+  def rpc_receive(self, data: bytes, sender: Address) -> None:
+    """Decode and handle every RPC received in a datagram or stream message."""
+    try:
+      rpcs = decode(data)
+    except (KeyError, StructError, ValidationError, ValueError):
+      logger.error("Invalid RPC request/response received.")
+    else:
+      for rpc in rpcs:
+        self.rpc_handle(rpc, sender)
 
   def rpc_handle(self, rpc: RPC, sender: Address) -> None:
     """Handle an incoming RPC request."""
+    RPCS_RECEIVED.inc(rpc.direction, rpc.type)
+
     try:
-      self._role_demote_if_necessary(_CaptureTerm.parse_raw(rpc.content))
+      if self._lease_protects_leader(rpc):
+        logger.info("Ignoring RequestVote RPC request while leader lease holds.")
+        return
+
+      # a pre-vote only proposes its term, which nobody takes up
+      if not getattr(rpc.content, "pre_vote", False):
+        self._role_demote_if_necessary(getattr(rpc.content, "term", None))
 
       if rpc.direction == RPCDirection.REQUEST:
         res: Union[RPC, None] = None
 
         if rpc.type == RPCType.APPEND_ENTRIES:
-          res = self._rpc_handle_append_entries_request(
-            AppendEntriesRPCRequest.parse_raw(rpc.content)
-          )
+          res = self._rpc_handle_append_entries_request(rpc.content)
         elif rpc.type == RPCType.REQUEST_VOTE:
-          res = self._rpc_handle_request_vote_request(
-            RequestVoteRPCRequest.parse_raw(rpc.content)
-          )
+          res = self._rpc_handle_request_vote_request(rpc.content)
         elif rpc.type == RPCType.ADD_SERVER:
-          raise NotImplementedError("AddServer RPC is not implemented yet.")
+          res = self._rpc_handle_add_server_request(rpc.content, sender)
         elif rpc.type == RPCType.REMOVE_SERVER:
-          raise NotImplementedError("RemoveServer RPC is not implemented yet.")
+          res = self._rpc_handle_remove_server_request(rpc.content, sender)
         elif rpc.type == RPCType.INSTALL_SNAPSHOT:
-          raise NotImplementedError("InstallSnapshot RPC is not implemented yet.")
+          res = self._rpc_handle_install_snapshot_request(rpc.content)
         elif rpc.type == RPCType.REGISTER_CLIENT:
           raise NotImplementedError("RegisterClient RPC is not implemented yet.")
         elif rpc.type == RPCType.CLIENT_REQUEST:
-          raise NotImplementedError("ClientRequest RPC is not implemented yet.")
+          res = self._rpc_handle_client_request_request(rpc.content, sender)
         elif rpc.type == RPCType.CLIENT_QUERY:
-          raise NotImplementedError("ClientQuery RPC is not implemented yet.")
+          res = self._rpc_handle_client_query_request(rpc.content, sender)
+        elif rpc.type == RPCType.TIMEOUT_NOW:
+          self._rpc_handle_timeout_now_request(rpc.content)
+        elif rpc.type == RPCType.TRANSFER_LEADERSHIP:
+          res = self._rpc_handle_transfer_leadership_request(rpc.content, sender)
 
         if isinstance(res, RPC):
           self._rpc_send(res, sender)
       elif rpc.direction == RPCDirection.RESPONSE:
         if rpc.type == RPCType.APPEND_ENTRIES:
-          self._rpc_handle_append_entries_response(
-            AppendEntriesRPCResponse.parse_raw(rpc.content),
-            sender,
-          )
+          self._rpc_handle_append_entries_response(rpc.content, sender)
         elif rpc.type == RPCType.REQUEST_VOTE:
-          self._rpc_handle_request_vote_response(
-            RequestVoteRPCResponse.parse_raw(rpc.content),
-            sender,
-          )
-        elif rpc.type == RPCType.ADD_SERVER:
-          raise NotImplementedError("AddServer RPC is not implemented yet.")
-        elif rpc.type == RPCType.REMOVE_SERVER:
-          raise NotImplementedError("RemoveServer RPC is not implemented yet.")
+          self._rpc_handle_request_vote_response(rpc.content, sender)
         elif rpc.type == RPCType.INSTALL_SNAPSHOT:
-          raise NotImplementedError("InstallSnapshot RPC is not implemented yet.")
+          self._rpc_handle_install_snapshot_response(rpc.content, sender)
         elif rpc.type == RPCType.REGISTER_CLIENT:
           raise NotImplementedError("RegisterClient RPC is not implemented yet.")
         elif rpc.type == RPCType.CLIENT_REQUEST:
@@ -344,8 +1671,8 @@ class Server(BaseModel):
         elif rpc.type == RPCType.CLIENT_QUERY:
           raise NotImplementedError("ClientQuery RPC is not implemented yet.")
     except ValidationError:
-      print("ERROR: Invalid RPC request/response received.")
+      logger.error("Invalid RPC request/response received.")
     except NotImplementedError as e:
-      print(f"ERROR: {e}")
+      logger.error("%s", e)
     except:
-      print("CRITICAL: Deadly unknown exception occurred.")
+      logger.critical("Deadly unknown exception occurred.", exc_info=True)
@@ -0,0 +1,3 @@
+from ._base import *
+from .tcp import *
+from .udp import *
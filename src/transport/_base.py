@@ -0,0 +1,52 @@
+"""Defines the base transport carrying messages between servers."""
+
+from socket import socket
+from typing import List, Tuple, Union
+
+from pydantic import BaseModel, Extra
+from utils import Address
+
+
+class BaseTransport(BaseModel):
+  """Base transport, delivering whole messages to and from other servers."""
+
+  address: Union[Address, None] = None
+
+  class Config:
+    arbitrary_types_allowed = True
+    copy_on_model_validation = "none"
+    extra = Extra.allow
+
+  def discard(self, sock: socket) -> None:
+    """Recover from an exceptional condition on a socket."""
+    raise NotImplementedError
+
+  def open(self, address: Address) -> None:
+    """Start listening for messages on an address."""
+    raise NotImplementedError
+
+  def readers(self) -> List[socket]:
+    """Return the sockets to wait on for incoming messages."""
+    raise NotImplementedError
+
+  def receive(self, sock: socket) -> List[Tuple[bytes, Address]]:
+    """Read from a readable socket, returning every complete message received
+    so far."""
+    raise NotImplementedError
+
+  def send(self, message: bytes, addr: Address) -> None:
+    """Send a message to another server."""
+    raise NotImplementedError
+
+  def send_many(self, messages: List[bytes], addr: Address) -> None:
+    """Send several messages to another server, in order."""
+    for message in messages:
+      self.send(message, addr)
+
+  def write(self, sock: socket) -> None:
+    """Write pending data to a writable socket."""
+    pass
+
+  def writers(self) -> List[socket]:
+    """Return the sockets to wait on for pending writes."""
+    return []
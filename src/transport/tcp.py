@@ -0,0 +1,224 @@
+"""Defines the stream transport, keeping one persistent TCP connection per peer
+and framing every message with its length."""
+
+from errno import EINPROGRESS, EWOULDBLOCK
+from socket import (
+  AF_INET,
+  IPPROTO_TCP,
+  SOCK_STREAM,
+  SOL_SOCKET,
+  SO_ERROR,
+  SO_REUSEADDR,
+  TCP_NODELAY,
+  socket,
+)
+from struct import Struct
+from time import time
+from typing import Dict, List, Tuple, Union
+
+from pydantic import BaseModel, Extra, StrictBool
+from utils import Address
+
+from . import BaseTransport
+
+BACKOFF_LOWER_BOUND: float = 0.05  # seconds
+BACKOFF_UPPER_BOUND: float = 2  # seconds
+PENDING_MAX_BYTES: int = 64 * 1024 * 1024  # bytes
+RECEIVE_BYTES: int = 256 * 1024  # bytes
+
+# message length
+_LENGTH = Struct("!I")
+
+
+class _Connection(BaseModel):
+  """Connection to a peer, with its partially read and unwritten bytes."""
+
+  sock: socket
+  peer: Union[Address, None] = None
+  connecting: StrictBool = False
+  inbound: bytearray = bytearray()
+  outbound: bytearray = bytearray()
+
+  class Config:
+    arbitrary_types_allowed = True
+    extra = Extra.allow
+
+
+class TCPTransport(BaseTransport):
+  """Stream transport over persistent, length-prefixed TCP connections.
+
+  The first message on every connection announces the address of the server
+  that opened it, so that replies can flow back over the same connection."""
+
+  listener: Union[socket, None] = None
+
+  def __init__(self, **data) -> None:
+    super().__init__(**data)
+    self._connections: Dict[socket, _Connection] = {}
+    self._peers: Dict[Address, _Connection] = {}
+    # when a peer may next be dialed, and how long to wait after that
+    self._backoff: Dict[Address, Tuple[float, float]] = {}
+
+  def _close(self, connection: _Connection) -> None:
+    """Close a connection, backing off from its peer if it never connected."""
+    self._connections.pop(connection.sock, None)
+    connection.sock.close()
+
+    if connection.peer is not None:
+      if self._peers.get(connection.peer) is connection:
+        del self._peers[connection.peer]
+      if connection.connecting:
+        _, delay = self._backoff.get(connection.peer, (0, BACKOFF_LOWER_BOUND / 2))
+        delay = min(delay * 2, BACKOFF_UPPER_BOUND)
+        self._backoff[connection.peer] = (time() + delay, delay)
+
+  def _connect(self, addr: Address) -> Union[_Connection, None]:
+    """Dial a peer, unless it is still being backed off from."""
+    retry_at, _ = self._backoff.get(addr, (0, 0))
+
+    if time() < retry_at or self.address is None:
+      return None
+
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.setblocking(False)
+    sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+    connection = _Connection(sock=sock, peer=addr, connecting=True)
+    self._connections[sock] = connection
+    self._peers[addr] = connection
+
+    if sock.connect_ex((addr.host, addr.port)) not in (0, EINPROGRESS, EWOULDBLOCK):
+      self._close(connection)
+      return None
+
+    hello = self.address.json().encode()
+    connection.outbound += _LENGTH.pack(len(hello)) + hello
+
+    return connection
+
+  def _flush(self, connection: _Connection) -> None:
+    """Write as much of the unwritten bytes as the socket accepts."""
+    try:
+      sent = connection.sock.send(connection.outbound)
+      del connection.outbound[:sent]
+    except BlockingIOError:
+      pass
+    except OSError:
+      self._close(connection)
+
+  def discard(self, sock: socket) -> None:
+    """Reopen the listener, or drop a connection, after an exceptional
+    condition."""
+    if sock is self.listener and self.address is not None:
+      self.listener.close()
+      self.open(self.address)
+    elif sock in self._connections:
+      self._close(self._connections[sock])
+
+  def open(self, address: Address) -> None:
+    """Listen for connections on an address (any free port if the port is 0)."""
+    self.listener = socket(AF_INET, SOCK_STREAM)
+    self.listener.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    self.listener.setblocking(False)
+    self.listener.bind((address.host, address.port))
+    self.listener.listen()
+    # an address without a port is given one by the system
+    self.address = Address(host=address.host, port=self.listener.getsockname()[1])
+
+  def readers(self) -> List[socket]:
+    """Return the listener and every connection."""
+    listener = [self.listener] if self.listener is not None else []
+    return listener + list(self._connections)
+
+  def receive(self, sock: socket) -> List[Tuple[bytes, Address]]:
+    """Accept a connection, or read every complete message off one."""
+    if sock is self.listener:
+      conn, _ = sock.accept()
+      conn.setblocking(False)
+      conn.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+      self._connections[conn] = _Connection(sock=conn)
+      return []
+
+    connection = self._connections.get(sock)
+    if connection is None:
+      return []
+
+    try:
+      data = sock.recv(RECEIVE_BYTES)
+    except BlockingIOError:
+      return []
+    except OSError:
+      data = b""
+
+    if not data:
+      self._close(connection)
+      return []
+
+    connection.inbound += data
+    messages: List[Tuple[bytes, Address]] = []
+    offset = 0
+
+    while offset + _LENGTH.size <= len(connection.inbound):
+      (length,) = _LENGTH.unpack_from(connection.inbound, offset)
+      start, end = offset + _LENGTH.size, offset + _LENGTH.size + length
+
+      if end > len(connection.inbound):
+        break
+
+      message = bytes(connection.inbound[start:end])
+      offset = end
+
+      if connection.peer is None:
+        # the first message on an accepted connection announces the peer
+        connection.peer = Address.parse_raw(message)
+        self._peers.setdefault(connection.peer, connection)
+      else:
+        messages.append((message, connection.peer))
+
+    del connection.inbound[:offset]
+
+    return messages
+
+  def send(self, message: bytes, addr: Address) -> None:
+    """Queue a framed message on the connection to a peer, dialing it first if
+    necessary. Messages to peers that cannot be reached are dropped."""
+    self.send_many([message], addr)
+
+  def send_many(self, messages: List[bytes], addr: Address) -> None:
+    """Queue framed messages on the connection to a peer, then write them with
+    as few sends as the socket allows."""
+    connection = self._peers.get(addr) or self._connect(addr)
+
+    if connection is None:
+      return
+    if len(connection.outbound) + sum(map(len, messages)) > PENDING_MAX_BYTES:
+      raise RuntimeError(f"Too many bytes pending to {addr}.")
+
+    for message in messages:
+      connection.outbound += _LENGTH.pack(len(message)) + message
+
+    if not connection.connecting:
+      self._flush(connection)
+
+  def write(self, sock: socket) -> None:
+    """Complete a pending dial, and write unwritten bytes."""
+    connection = self._connections.get(sock)
+    if connection is None:
+      return
+
+    if connection.connecting:
+      if sock.getsockopt(SOL_SOCKET, SO_ERROR) != 0:
+        self._close(connection)
+        return
+
+      connection.connecting = False
+      self._backoff.pop(connection.peer, None)
+
+    self._flush(connection)
+
+  def writers(self) -> List[socket]:
+    """Return every connection that is dialing or has unwritten bytes."""
+    return [
+      connection.sock
+      for connection in self._connections.values()
+      if connection.connecting or connection.outbound
+    ]
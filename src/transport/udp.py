@@ -0,0 +1,88 @@
+"""Defines the datagram transport. Every wakeup drains the datagrams pending on
+the socket, and messages to the same server are coalesced into as few datagrams
+as fit (RPCs are self-delimiting, so a datagram may hold any number of them).
+Python exposes neither recvmmsg nor sendmmsg, so this is what batching comes
+down to: one recvfrom per pending datagram, one sendto per coalesced one."""
+
+from socket import (
+  AF_INET,
+  MSG_DONTWAIT,
+  SOCK_DGRAM,
+  SOL_SOCKET,
+  SO_REUSEADDR,
+  socket,
+)
+from typing import List, Tuple, Union
+
+from utils import Address
+
+from . import BaseTransport
+
+# largest payload of a UDP datagram over IPv4
+DATAGRAM_MAX_BYTES: int = 65507  # bytes
+# datagrams read per wakeup, so that a flood cannot starve the rest of the loop
+RECEIVE_MAX_DATAGRAMS: int = 256  # datagrams
+
+
+class UDPTransport(BaseTransport):
+  """Datagram transport over a single UDP socket."""
+
+  sock: Union[socket, None] = None
+
+  def _sendto(self, message: bytes, addr: Address) -> None:
+    """Send a single datagram."""
+    if self.sock is not None:
+      self.sock.sendto(message, (addr.host, addr.port))
+    else:
+      raise RuntimeError("Ensure that socket is set.")
+
+  def discard(self, sock: socket) -> None:
+    """Reopen the socket after an exceptional condition."""
+    if sock is self.sock and self.address is not None:
+      self.sock.close()
+      self.open(self.address)
+
+  def open(self, address: Address) -> None:
+    """Bind the socket to an address (any free port if the port is 0)."""
+    self.sock = socket(AF_INET, SOCK_DGRAM)
+    self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+    self.sock.bind((address.host, address.port))
+    # an address without a port is given one by the system
+    self.address = Address(host=address.host, port=self.sock.getsockname()[1])
+
+  def readers(self) -> List[socket]:
+    """Return the socket, if it is bound."""
+    return [self.sock] if self.sock is not None else []
+
+  def receive(self, sock: socket) -> List[Tuple[bytes, Address]]:
+    """Read every pending datagram, up to a bound. The socket stays blocking for
+    sends, so reads past the first are made non-blocking by flag."""
+    messages: List[Tuple[bytes, Address]] = []
+
+    while len(messages) < RECEIVE_MAX_DATAGRAMS:
+      try:
+        data, addr = sock.recvfrom(DATAGRAM_MAX_BYTES, MSG_DONTWAIT)
+      except BlockingIOError:
+        break
+
+      messages.append((data, Address(host=addr[0], port=addr[1])))
+
+    return messages
+
+  def send(self, message: bytes, addr: Address) -> None:
+    """Send the message as a datagram."""
+    self._sendto(message, addr)
+
+  def send_many(self, messages: List[bytes], addr: Address) -> None:
+    """Send the messages coalesced into as few datagrams as they fit in."""
+    datagram = b""
+
+    for message in messages:
+      if datagram and len(datagram) + len(message) > DATAGRAM_MAX_BYTES:
+        self._sendto(datagram, addr)
+        datagram = b""
+
+      datagram += message
+
+    if datagram:
+      self._sendto(datagram, addr)
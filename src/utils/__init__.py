@@ -1,3 +1,6 @@
 from .address import *
+from .group import *
+from .log import *
+from .metrics import *
 from .models import *
 from .rpc import *
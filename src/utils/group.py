@@ -0,0 +1,10 @@
+"""Defines how the key space is split among the Raft groups of a Multi-Raft
+cluster (see `multi`): by hash, so that every group serves about as many keys
+however they are named, and clients route requests the way servers do."""
+
+from zlib import crc32
+
+
+def group_of(key: str, groups: int) -> int:
+  """Return the group serving a key, out of a number of groups."""
+  return crc32(key.encode()) % groups
@@ -0,0 +1,79 @@
+"""Defines how servers log. Modules log through the standard library, with
+%-style arguments, so that messages below the configured level are never
+formatted. Records that pass the level are rate-limited per category (the
+logger and message template) and handed to a queue, then written by a background
+thread, so the event loop never waits on stdout."""
+
+from logging import (
+  INFO,
+  Filter,
+  Formatter,
+  LogRecord,
+  StreamHandler,
+  getLogger,
+)
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from sys import stdout
+from time import monotonic
+from typing import Dict, Tuple, Union
+
+LOG_FORMAT: str = "%(levelname)s: %(message)s"
+LOG_RATE_LIMIT: float = 50  # records per second and category
+LOG_RATE_BURST: int = 100  # records per category before rate-limiting
+
+
+class RateLimitFilter(Filter):
+  """Token bucket per category of records. Records are dropped once a bucket is
+  empty, and the next record let through tells how many were."""
+
+  def __init__(self, rate: float = LOG_RATE_LIMIT, burst: int = LOG_RATE_BURST):
+    super().__init__()
+    self.rate = rate
+    self.burst = burst
+    # tokens left, when they were last refilled, and records dropped since
+    self._buckets: Dict[Tuple[str, str], Tuple[float, float, int]] = {}
+
+  def filter(self, record: LogRecord) -> bool:
+    if self.rate <= 0:
+      return True
+
+    category = (record.name, str(record.msg))
+    now = monotonic()
+    tokens, refilled_at, dropped = self._buckets.get(category, (self.burst, now, 0))
+    tokens = min(self.burst, tokens + (now - refilled_at) * self.rate)
+
+    if tokens < 1:
+      self._buckets[category] = (tokens, now, dropped + 1)
+      return False
+
+    self._buckets[category] = (tokens - 1, now, 0)
+
+    if dropped:
+      record.msg = f"{record.msg} ({dropped} similar records dropped)"
+
+    return True
+
+
+def configure_logging(
+  level: Union[int, str] = INFO, rate: float = LOG_RATE_LIMIT
+) -> QueueListener:
+  """Route every record of at least the given level through the rate limit to a
+  background thread writing to stdout. Returns the listener, to be stopped on
+  exit so that queued records are written."""
+  queue: SimpleQueue = SimpleQueue()
+
+  handler = QueueHandler(queue)
+  handler.addFilter(RateLimitFilter(rate))
+
+  writer = StreamHandler(stdout)
+  writer.setFormatter(Formatter(LOG_FORMAT))
+
+  root = getLogger()
+  root.handlers = [handler]
+  root.setLevel(level)
+
+  listener = QueueListener(queue, writer)
+  listener.start()
+
+  return listener
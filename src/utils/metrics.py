@@ -0,0 +1,186 @@
+"""Defines the metrics servers collect, and the endpoint exposing them in the
+Prometheus text format. Metrics are module-level objects registered as they are
+created. Collecting is kept to a dictionary update (and a bisect for
+histograms) on the hot path: label values are kept as given and only turned
+into text when scraped, by a thread of the endpoint reading copies of the
+dictionaries the server thread updates."""
+
+from bisect import bisect_left
+from enum import Enum
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Any, Dict, List, Tuple
+
+METRICS_PATH: str = "/metrics"
+
+# seconds, from a fraction of a millisecond up to an election timeout
+LATENCY_BUCKETS: Tuple[float, ...] = (
+  0.0001,
+  0.00025,
+  0.0005,
+  0.001,
+  0.0025,
+  0.005,
+  0.01,
+  0.025,
+  0.05,
+  0.1,
+  0.25,
+  0.5,
+  1,
+  2.5,
+  5,
+)
+# entries, up to the default bound of an AppendEntries RPC
+SIZE_BUCKETS: Tuple[float, ...] = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+_Labels = Tuple[Any, ...]
+
+_METRICS: List["_Metric"] = []
+
+
+def _label_text(names: Tuple[str, ...], values: _Labels, extra: str = "") -> str:
+  """Render the labels of a sample, enum labels by their name."""
+  pairs = [
+    f'{name}="{value.name if isinstance(value, Enum) else value}"'
+    for name, value in zip(names, values)
+  ]
+  if extra:
+    pairs.append(extra)
+
+  return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+  """Metric registered for exposition, with samples keyed by label values."""
+
+  kind: str = "untyped"
+
+  def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+    self.name = name
+    self.help = help
+    self.labels = labels
+    _METRICS.append(self)
+
+  def samples(self) -> List[str]:
+    raise NotImplementedError
+
+  def render(self) -> str:
+    """Render the metric in the Prometheus text format."""
+    header = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+    return "\n".join(header + self.samples())
+
+
+class Counter(_Metric):
+  """Monotonically increasing count."""
+
+  kind = "counter"
+
+  def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+    super().__init__(name, help, labels)
+    self._values: Dict[_Labels, float] = {}
+
+  def inc(self, *labels: Any, amount: float = 1) -> None:
+    self._values[labels] = self._values.get(labels, 0) + amount
+
+  def samples(self) -> List[str]:
+    return [
+      f"{self.name}{_label_text(self.labels, labels)} {value}"
+      for labels, value in dict(self._values).items()
+    ]
+
+
+class Gauge(_Metric):
+  """Value that may go up and down, as last set."""
+
+  kind = "gauge"
+
+  def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> None:
+    super().__init__(name, help, labels)
+    self._values: Dict[_Labels, float] = {}
+
+  def set(self, value: float, *labels: Any) -> None:
+    self._values[labels] = value
+
+  def samples(self) -> List[str]:
+    return [
+      f"{self.name}{_label_text(self.labels, labels)} {value}"
+      for labels, value in dict(self._values).items()
+    ]
+
+
+class Histogram(_Metric):
+  """Distribution of observations over fixed buckets."""
+
+  kind = "histogram"
+
+  def __init__(
+    self,
+    name: str,
+    help: str,
+    buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    labels: Tuple[str, ...] = (),
+  ) -> None:
+    super().__init__(name, help, labels)
+    self.buckets = buckets
+    # count per bucket (the last one past every bound), and sum of observations
+    self._counts: Dict[_Labels, List[int]] = {}
+    self._sums: Dict[_Labels, float] = {}
+
+  def observe(self, value: float, *labels: Any) -> None:
+    counts = self._counts.get(labels)
+    if counts is None:
+      counts = self._counts[labels] = [0] * (len(self.buckets) + 1)
+
+    counts[bisect_left(self.buckets, value)] += 1
+    self._sums[labels] = self._sums.get(labels, 0) + value
+
+  def samples(self) -> List[str]:
+    lines: List[str] = []
+
+    for labels, counts in dict(self._counts).items():
+      counts, cumulative = list(counts), 0
+      bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+
+      for bound, count in zip(bounds, counts):
+        cumulative += count
+        le = _label_text(self.labels, labels, f'le="{bound}"')
+        lines.append(f"{self.name}_bucket{le} {cumulative}")
+
+      text = _label_text(self.labels, labels)
+      lines.append(f"{self.name}_sum{text} {self._sums.get(labels, 0)}")
+      lines.append(f"{self.name}_count{text} {cumulative}")
+
+    return lines
+
+
+def render_metrics() -> str:
+  """Render every metric in the Prometheus text format."""
+  return "\n".join(metric.render() for metric in _METRICS) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+  """Answers scrapes of the metrics path."""
+
+  def do_GET(self) -> None:
+    if self.path != METRICS_PATH:
+      self.send_error(404)
+      return
+
+    body = render_metrics().encode()
+    self.send_response(200)
+    self.send_header("Content-Type", "text/plain; version=0.0.4")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format: str, *args: Any) -> None:
+    pass
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+  """Expose the metrics over HTTP on a background thread."""
+  httpd = ThreadingHTTPServer((host, port), _MetricsHandler)
+  Thread(target=httpd.serve_forever, daemon=True).start()
+
+  return httpd
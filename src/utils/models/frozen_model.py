@@ -1,5 +1,6 @@
 """Defines a frozen model with extended JSON abilities."""
 
+from base64 import b64encode
 
 from orjson import dumps, loads
 from pydantic import BaseModel
@@ -9,6 +10,8 @@ class FrozenModel(BaseModel):
   """Frozen model configured with orjson extensions."""
 
   class Config:
+    copy_on_model_validation = "none"
     frozen = True
+    json_encoders = {bytes: lambda v: b64encode(v).decode()}
     json_loads = loads
     json_dumps = lambda v, *, default: dumps(v, default=default).decode()
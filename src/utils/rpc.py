@@ -20,6 +20,9 @@ class RPCType(IntEnum):
   REGISTER_CLIENT = 6
   CLIENT_REQUEST = 7
   CLIENT_QUERY = 8
+  # Section 3.10
+  TIMEOUT_NOW = 9
+  TRANSFER_LEADERSHIP = 10
 
 
 class RPCDirection(IntEnum):
@@ -41,5 +44,7 @@ class RPC(FrozenModel):
     RPCType.REGISTER_CLIENT,
     RPCType.CLIENT_REQUEST,
     RPCType.CLIENT_QUERY,
+    RPCType.TIMEOUT_NOW,
+    RPCType.TRANSFER_LEADERSHIP,
   ]
-  content: str
+  content: FrozenModel